@@ -1,6 +1,119 @@
 from django.contrib import admin
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+
+from core.machine_state import machine_state_cache
 from core.models import *
 
+# Таблицы меньше этого размера считаются точным COUNT(*), большие - по статистике PostgreSQL
+EXACT_COUNT_LIMIT = 10000
+
+
+def estimated_count(queryset):
+    """
+    Приблизительное количество строк queryset в PostgreSQL.
+
+    Без фильтров берется pg_class.reltuples, с фильтрами - оценка строк из плана запроса.
+
+    Returns:
+        int: Оценка количества строк, либо None, если БД не PostgreSQL, таблица
+            меньше EXACT_COUNT_LIMIT или статистики по ней еще нет.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                       [queryset.model._meta.db_table])
+        reltuples = cursor.fetchone()[0]
+        # -1: таблица еще ни разу не анализировалась
+        if reltuples < EXACT_COUNT_LIMIT:
+            return None
+        if not queryset.query.where:
+            return int(reltuples)
+        try:
+            sql, params = queryset.order_by().query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        return int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор, который на больших таблицах не считает строки через COUNT(*).
+
+    Количество страниц приблизительное: последняя страница может оказаться неполной или пустой.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        return super().count if estimate is None else estimate
+
+
+class IdFilter(admin.SimpleListFilter):
+    """
+    Фильтр по ID связанной записи, который вводится вручную.
+
+    Обычный фильтр по внешнему ключу выводит в боковой панели все смены, заказы
+    или пользователей и сам по себе перестает загружаться на больших таблицах.
+    """
+    template = 'admin/core/id_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.title = model._meta.get_field(self.field_name).verbose_name
+        super().__init__(request, params, model, model_admin)
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is not None,
+            'value': self.value() or '',
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'hidden': [(name, value) for name, value in changelist.params.items() if name != self.parameter_name],
+        }
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value and value.isdigit():
+            return queryset.filter(**{self.parameter_name: value})
+        return queryset
+
+
+def id_filter(field_name):
+    name = field_name.title().replace('_', '')
+    return type(f'{name}IdFilter', (IdFilter,), {'field_name': field_name, 'parameter_name': f'{field_name}_id'})
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Админка таблиц с миллионами строк.
+
+    Количество строк оценивается EstimatedCountPaginator, полный COUNT(*) без фильтров не выполняется.
+    Поиск только по ID: поиск подстроки по неиндексированным колонкам читает всю таблицу.
+    Связанные записи выбираются через list_select_related и autocomplete_fields,
+    фильтры по внешним ключам - через id_filter, по времени - без date_hierarchy,
+    которому нужен DISTINCT по всей таблице.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    search_fields = ['id__exact']
+    search_help_text = 'Поиск по ID'
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if search_term and not search_term.isdigit():
+            return queryset.none(), False
+        return super().get_search_results(request, queryset, search_term)
+
 
 class MachineTypesModelAdmin(admin.ModelAdmin):
     list_display = ['machine_type']
@@ -9,7 +122,15 @@ class MachineTypesModelAdmin(admin.ModelAdmin):
 
 class MachineModelAdmin(admin.ModelAdmin):
     list_display = [field.name for field in MachineModel._meta.fields]
-    list_filter = [field.name for field in MachineModel._meta.fields ]
+    list_filter = ['machine_type', 'is_broken', 'is_in_progress']
+    list_select_related = ['machine_type', 'order_in_progress__related_to_shift', 'order_in_progress__user__user',
+                           'order_in_progress__machine__machine_type']
+    search_fields = ['machine_name']
+    autocomplete_fields = ['order_in_progress']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        machine_state_cache.publish(obj)
 
 
 class RoleModelAdmin(admin.ModelAdmin):
@@ -30,38 +151,63 @@ class PositionsModelAdmin(admin.ModelAdmin):
 
 class CustomUserModelAdmin(admin.ModelAdmin):
     list_display = [field.name for field in CustomUserModel._meta.fields]
-    list_filter = [field.name for field in CustomUserModel._meta.fields ]
-    search_fields = [field.name for field in CustomUserModel._meta.fields]
+    list_filter = ['role', 'position', 'working_area']
+    list_select_related = ['user', 'role', 'position', 'working_area', 'current_shift']
+    search_fields = ['user__username', 'phone_number']
+    autocomplete_fields = ['user', 'machine', 'current_shift']
 
 
-class ShiftModelAdmin(admin.ModelAdmin):
+class ShiftModelAdmin(LargeTableAdmin):
     list_display = [field.name for field in ShiftModel._meta.fields]
-    list_filter = [field.name for field in ShiftModel._meta.fields ]
-    date_hierarchy = 'start_time'
+    list_filter = [('start_time', admin.DateFieldListFilter), id_filter('user')]
+    list_select_related = ['user__user']
+    autocomplete_fields = ['user']
 
 
-class OrdersModelAdmin(admin.ModelAdmin):
+class OrdersModelAdmin(LargeTableAdmin):
     list_display = [field.name for field in OrdersModel._meta.fields]
-    list_filter = ['user', 'machine', 'related_to_shift', 'hold_ended' ,'ended_early']
-    date_hierarchy = 'start_time'
+    list_filter = [('start_time', admin.DateFieldListFilter), 'ended_early',
+                   id_filter('user'), id_filter('machine'), id_filter('related_to_shift')]
+    list_select_related = ['user__user', 'machine__machine_type', 'related_to_shift']
+    autocomplete_fields = ['user', 'machine', 'related_to_shift']
 
 
-class ReportsModelAdmin(admin.ModelAdmin):
+class ReportsModelAdmin(LargeTableAdmin):
     list_display = [field.name for field in ReportsModel._meta.fields]
-    list_filter = [field.name for field in ReportsModel._meta.fields ]
-    search_fields = [field.name for field in ReportsModel._meta.fields]
-    date_hierarchy = 'start_time'
+    list_filter = [('start_time', admin.DateFieldListFilter), 'is_solved', id_filter('user'), id_filter('order')]
+    list_select_related = ['user__user', 'order__related_to_shift', 'order__user__user', 'order__machine__machine_type']
+    autocomplete_fields = ['user', 'order']
     readonly_fields = ['start_time',]
 
 
-class UserRequestsModelAdmin(admin.ModelAdmin):
+class UserRequestsModelAdmin(LargeTableAdmin):
     list_display = [field.name for field in UserRequestsModel._meta.fields]
-    list_filter = [field.name for field in UserRequestsModel._meta.fields ]
-    search_fields = [field.name for field in UserRequestsModel._meta.fields]
-    date_hierarchy = 'start_time'
+    list_filter = [('start_time', admin.DateFieldListFilter), 'is_solved', id_filter('user')]
+    list_select_related = ['user__user']
+    autocomplete_fields = ['user']
     readonly_fields = ['start_time',]
 
 
+class ProductionRollupModelAdmin(LargeTableAdmin):
+    list_display = [field.name for field in ProductionRollupModel._meta.fields]
+    list_filter = [('period_start', admin.DateFieldListFilter), 'granularity', 'working_area', 'position',
+                   id_filter('machine')]
+    list_select_related = ['machine__machine_type', 'working_area', 'position']
+    autocomplete_fields = ['machine']
+
+
+class OrderEventModelAdmin(LargeTableAdmin):
+    list_display = [field.name for field in OrderEventModel._meta.fields]
+    list_filter = [('ts', admin.DateFieldListFilter), 'step', id_filter('user'), id_filter('order')]
+    list_select_related = ['user__user', 'order__related_to_shift', 'order__user__user', 'order__machine__machine_type']
+    autocomplete_fields = ['user', 'order']
+
+
+class DeletedRowModelAdmin(LargeTableAdmin):
+    list_display = [field.name for field in DeletedRowModel._meta.fields]
+    list_filter = [('deleted_at', admin.DateFieldListFilter), 'model']
+
+
 admin.site.register(UserRequestsModel, UserRequestsModelAdmin)
 admin.site.register(MachineTypesModel, MachineTypesModelAdmin)
 admin.site.register(ReportsModel, ReportsModelAdmin)
@@ -72,3 +218,6 @@ admin.site.register(PositionsModel, PositionsModelAdmin)
 admin.site.register(RoleModel, RoleModelAdmin)
 admin.site.register(MachineModel, MachineModelAdmin)
 admin.site.register(WorkingAreaModel, WorkingAreaModelAdmin)
+admin.site.register(ProductionRollupModel, ProductionRollupModelAdmin)
+admin.site.register(OrderEventModel, OrderEventModelAdmin)
+admin.site.register(DeletedRowModel, DeletedRowModelAdmin)
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from core.backup import connect_signals as connect_backup_signals
+        from core.lookup_cache import connect_signals
+        from core.machine_state import connect_signals as connect_machine_state_signals
+        from core.metrics import install_query_counter
+
+        connect_signals()
+        connect_backup_signals()
+        connect_machine_state_signals()
+        connection_created.connect(install_query_counter, dispatch_uid='core_metrics_query_counter')
@@ -0,0 +1,27 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.contrib.auth.views import redirect_to_login
+
+
+def async_login_required(login_url=None):
+    """
+    login_required для async-представлений.
+
+    Сессия и пользователь загружаются за один переход в поток, после этого
+    request.user - готовый объект и в представлении не обращается к БД.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request.user = await sync_to_async(get_user)(request)
+            if not request.user.is_authenticated:
+                return redirect_to_login(request.get_full_path(), login_url or settings.LOGIN_URL)
+            return await view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,231 @@
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models.signals import post_delete
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from core.buisness import rebuild_rollups
+from core.export import export_data, export_models, model_label
+from core.log import get_logger
+from core.models import ShiftModel, OrdersModel, ReportsModel, UserRequestsModel, DeletedRowModel, \
+    OrderEventModel, ProductionRollupModel
+
+logger = get_logger(__name__)
+
+# Модели с отметкой изменения updated_at. Остальные модели - небольшие справочники,
+# они попадают в каждый бэкап целиком.
+TRACKED_MODELS = (ShiftModel, OrdersModel, ReportsModel, UserRequestsModel)
+
+# Журналы, строки которых только добавляются, и поле с отметкой добавления.
+# Удаляются они только каскадом вместе с заказом, отметка об удалении заказа это повторяет
+APPEND_ONLY_MODELS = {OrderEventModel: 'received_at'}
+
+# Итоги производства не выгружаются: restore_backup пересчитывает их по заказам через rebuild_rollups
+DERIVED_MODELS = (ProductionRollupModel,)
+
+BACKUP_FORMAT = 'jsonl.gz'
+MANIFEST_NAME = 'manifest.json'
+
+
+def snapshot_dir():
+    return os.path.join(settings.BACKUP_DIR, 'snapshots')
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'backups': []}
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST_NAME)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_backup(mode='auto', directory=None):
+    """
+    Делает полный или инкрементальный бэкап и записывает его в манифест.
+
+    Инкрементальный бэкап содержит строки TRACKED_MODELS, измененные с момента
+    предыдущего успешного бэкапа (отметка until в манифесте) за вычетом BACKUP_OVERLAP,
+    добавленные за то же время строки APPEND_ONLY_MODELS, отметки DeletedRowModel
+    об удаленных строках и справочники целиком. DERIVED_MODELS не выгружаются.
+
+    Parameters:
+        mode (str): 'full', 'incremental' или 'auto' - полный бэкап, если его еще нет
+            или с последнего прошло BACKUP_FULL_EVERY - 1 инкрементальных.
+        directory (str | None): Каталог бэкапов, по умолчанию BACKUP_DIR/snapshots.
+
+    Returns:
+        dict: Запись манифеста о созданном бэкапе.
+    """
+    directory = directory or snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+    backups = manifest['backups']
+
+    if mode == 'auto':
+        full_indexes = [i for i, entry in enumerate(backups) if entry['type'] == 'full']
+        deltas_since_full = len(backups) - full_indexes[-1] - 1 if full_indexes else None
+        if deltas_since_full is None or deltas_since_full + 1 >= settings.BACKUP_FULL_EVERY:
+            mode = 'full'
+        else:
+            mode = 'incremental'
+    if mode == 'incremental' and not backups:
+        raise ValueError('Инкрементальный бэкап невозможен без полного')
+
+    # updated_at ставится до фиксации транзакции, поэтому строка с отметкой раньше until
+    # может стать видна уже после чтения. Следующий бэкап начинается на BACKUP_OVERLAP
+    # раньше until, повторное применение строки безопасно
+    until = timezone.now()
+    since = None
+    # Отметки об удалении нужны только инкрементальным бэкапам
+    querysets = {model: model._default_manager.none() for model in (DeletedRowModel, *DERIVED_MODELS)}
+    if mode == 'incremental':
+        since = parse_datetime(backups[-1]['until']) - timedelta(seconds=settings.BACKUP_OVERLAP)
+        querysets.update({
+            model: model._default_manager.filter(updated_at__gte=since) for model in TRACKED_MODELS
+        })
+        querysets.update({
+            model: model._default_manager.filter(**{f'{field}__gte': since})
+            for model, field in APPEND_ONLY_MODELS.items()
+        })
+        querysets[DeletedRowModel] = DeletedRowModel.objects.filter(deleted_at__gte=since)
+
+    name = f'{until:%Y-%m-%d_%H%M%S_%f}_{mode}'
+    files = export_data(os.path.join(directory, name), (BACKUP_FORMAT,), settings.BACKUP_CHUNK_SIZE,
+                        querysets=querysets)
+
+    entry = {
+        'name': name,
+        'type': mode,
+        'since': since.isoformat() if since else None,
+        'until': until.isoformat(),
+        'files': [os.path.basename(path) for path in files],
+    }
+    backups.append(entry)
+    save_manifest(directory, manifest)
+
+    logger.info('backup_written', mode=mode, name=name)
+
+    return entry
+
+
+def restore_chain(manifest, until=None):
+    """
+    Возвращает последний полный бэкап и все следующие за ним инкрементальные,
+    не дальше бэкапа с именем until.
+    """
+    backups = manifest['backups']
+    if until is not None:
+        names = [entry['name'] for entry in backups]
+        backups = backups[:names.index(until) + 1]
+    full_indexes = [i for i, entry in enumerate(backups) if entry['type'] == 'full']
+    if not full_indexes:
+        raise ValueError('В манифесте нет полного бэкапа')
+    return backups[full_indexes[-1]:]
+
+
+def restore_backup(directory=None, until=None, chunk_size=2000):
+    """
+    Восстанавливает данные: полный бэкап, затем по порядку инкрементальные.
+
+    Строки вставляются с обновлением при совпадении первичного ключа, поэтому
+    одна и та же строка из нескольких бэкапов применяется безопасно. После строк
+    каждого бэкапа удаляются записи по его отметкам DeletedRowModel. В конце
+    итоги производства пересчитываются по восстановленным заказам.
+
+    Returns:
+        list[str]: Имена примененных бэкапов.
+    """
+    directory = directory or snapshot_dir()
+    chain = restore_chain(load_manifest(directory), until)
+    models = export_models()
+
+    # Внешние ключи в PostgreSQL и SQLite проверяются в конце транзакции,
+    # поэтому порядок моделей и циклические ссылки не мешают
+    with transaction.atomic():
+        for entry in chain:
+            for model in models:
+                path = os.path.join(directory, entry['name'], f'{model_label(model)}.{BACKUP_FORMAT}')
+                if not os.path.exists(path):
+                    continue
+                if model is DeletedRowModel:
+                    _apply_deletions(path)
+                elif model not in DERIVED_MODELS:
+                    _restore_file(model, path, chunk_size)
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+        # Ошибка пересчета не отменяет восстановление, итоги можно пересчитать командой rebuild_rollups
+        if rebuild_rollups() is None:
+            logger.warning('backup_rollups_not_rebuilt')
+
+    logger.info('backup_restored', backups=[entry['name'] for entry in chain])
+
+    return [entry['name'] for entry in chain]
+
+
+def _restore_file(model, path, chunk_size):
+    fields = {field.name: field for field in model._meta.concrete_fields}
+    update_fields = [field.name for field in fields.values() if not field.primary_key]
+
+    batch = []
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            data = json.loads(line)
+            batch.append(model(**{
+                fields[name].attname: fields[name].to_python(value) for name, value in data.items()
+            }))
+            if len(batch) >= chunk_size:
+                _upsert(model, batch, update_fields)
+                batch = []
+    if batch:
+        _upsert(model, batch, update_fields)
+
+
+def _apply_deletions(path):
+    deleted = defaultdict(list)
+    with gzip.open(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            data = json.loads(line)
+            deleted[data['model']].append(data['object_id'])
+    # Удаление через ORM, чтобы вместе с заказом удалились его отчеты и события
+    for label, ids in deleted.items():
+        apps.get_model(label)._default_manager.filter(pk__in=ids).delete()
+
+
+def _upsert(model, objects, update_fields):
+    model._default_manager.bulk_create(
+        objects,
+        update_conflicts=True,
+        unique_fields=[model._meta.pk.name],
+        update_fields=update_fields,
+    )
+
+
+def record_deletion(sender, instance, **kwargs):
+    DeletedRowModel.objects.create(model=model_label(sender), object_id=instance.pk)
+
+
+def connect_signals():
+    """
+    Записывает отметки об удалении строк TRACKED_MODELS, в том числе удаленных каскадом.
+    """
+    for model in TRACKED_MODELS:
+        post_delete.connect(record_deletion, sender=model, dispatch_uid=f'backup_deletion_{model.__name__}')
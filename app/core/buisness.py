@@ -1,18 +1,52 @@
-import datetime
-import logging
+import asyncio
+import base64
+import time
 from datetime import timedelta
 
-from PIL import Image
-from celery import shared_task, chain
+from asgiref.sync import sync_to_async
+from celery import shared_task, current_app
+from celery.exceptions import TimeoutError as CeleryTimeoutError
+from django.conf import settings
 from django.core.management import call_command
-from django.db.models import Sum, ExpressionWrapper, F, fields
-from django.http import HttpResponse
+from django.db import transaction, IntegrityError
+from django.db.models import Sum, Count, Q, ExpressionWrapper, F, Subquery, fields
+from django.db.models.functions import Trunc
 from django.utils import timezone
-from pyzbar.pyzbar import decode
-
-from core.models import ReportsModel, OrdersModel, ShiftModel, MachineModel, UserRequestsModel, PositionsModel
-
-logger = logging.getLogger('django')
+from django.utils.dateparse import parse_datetime
+from kombu.exceptions import ChannelError
+
+from core.log import get_logger
+from core.lookup_cache import get_lookup
+from core.machine_state import machine_state_cache
+from core.metrics import timed
+from core.models import ReportsModel, OrdersModel, ShiftModel, MachineModel, UserRequestsModel, PositionsModel, \
+    CustomUserModel, ProductionRollupModel, OrderEventModel
+from core.qr_cache import qr_decode_cache
+from core.tasks import decode_qr_image
+
+logger = get_logger(__name__)
+
+QR_DECODE_ERROR = 'Ошибка в декодировании'
+
+GOOD_TIME_EXPRESSION = ExpressionWrapper(
+    F('machine_end_time') - F('machine_start_time'),
+    output_field=fields.DurationField()
+)
+GOOD_TIME_FILTER = Q(machine_end_time__isnull=False, machine_start_time__isnull=False)
+
+BAD_TIME_EXPRESSION = ExpressionWrapper(
+    F('end_working_time') - F('scan_time') -
+    (F('machine_end_time') - F('machine_start_time')) -
+    F('bugs_time') - F('hold_time'),
+    output_field=fields.DurationField()
+)
+BAD_TIME_FILTER = Q(
+    end_working_time__isnull=False,
+    scan_time__isnull=False,
+    machine_end_time__isnull=False,
+    machine_start_time__isnull=False,
+    bugs_time__isnull=False,
+)
 
 
 def get_last_or_create_shift(custom_user):
@@ -25,21 +59,109 @@ def get_last_or_create_shift(custom_user):
     Returns:
         ShiftModel: The last shift associated with the custom user.
         If no previous shift exists or the last shift is ended, a new shift is created and returned.
+        The returned shift is stored in custom_user.current_shift.
     """
     last_shift = ShiftModel.objects.filter(user=custom_user).last()
     if not last_shift or last_shift.is_ended():
         new_shift = ShiftModel(user=custom_user)
         new_shift.save()
-        logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} "
-                    f"created a new shift #{new_shift.id}")
+        set_current_shift(custom_user, new_shift)
+        logger.info('shift_created', user=custom_user.id, shift=new_shift.id)
         return new_shift
     else:
+        if custom_user.current_shift_id != last_shift.id:
+            set_current_shift(custom_user, last_shift)
         return last_shift
 
+
+def set_current_shift(custom_user, shift):
+    """
+    Обновляет указатель текущей смены пользователя.
+    """
+    CustomUserModel.objects.filter(id=custom_user.id).update(current_shift=shift)
+    custom_user.current_shift = shift
+
+
+# Ожидаемое состояние заказа для шагов работы: заказ еще не завершен
+ORDER_IS_OPEN = {'end_working_time__isnull': True}
+
+# Станок можно занять, только если он не в работе и не сломан
+MACHINE_IS_FREE = {'is_in_progress': False, 'is_broken': False}
+
+
+def transition_order(order, expected=None, **values):
+    """
+    Записывает только переданные поля заказа одним UPDATE.
+
+    Parameters:
+        order (OrdersModel): Заказ, поля которого обновляются.
+        expected (dict | None): Условия на текущее состояние строки в формате lookup -> значение.
+            Если строка в БД им уже не соответствует, UPDATE ее не затронет.
+        **values: Новые значения полей.
+
+    Returns:
+        bool: True, если строка обновлена. Объект order обновляется только в этом случае.
+    """
+    # QuerySet.update не заполняет auto_now, updated_at нужен для инкрементальных бэкапов
+    values.setdefault('updated_at', timezone.now())
+    updated = OrdersModel.objects.filter(pk=order.pk, **(expected or {})).update(**values)
+    if not updated:
+        logger.warning('order_transition_skipped', order=order.pk, expected=expected, fields=sorted(values))
+        return False
+
+    for field, value in values.items():
+        setattr(order, field, value)
+    return True
+
+
+def log_order_event(order, step, at, payload=None, key=None):
+    """
+    Добавляет событие в журнал заказа. Записи журнала не изменяются и не удаляются.
+    """
+    return OrderEventModel.objects.create(
+        user_id=order.user_id,
+        order_id=order.id,
+        step=step,
+        ts=at,
+        payload=payload or {},
+        idempotency_key=key,
+    )
+
+
+def record_transition(order, step, at, payload=None, key=None, expected=ORDER_IS_OPEN, **values):
+    """
+    Записывает шаг заказа: событие в журнал и новые значения колонок заказа, в одной транзакции.
+
+    Журнал хранит всю историю заказа, в том числе каждую паузу. Колонки заказа - его текущее
+    состояние для страниц шагов, materialize_orders восстанавливает их из журнала.
+    Событие вставляется первым, а UPDATE заказа идет последним запросом транзакции,
+    так что блокировка строки заказа держится только до фиксации.
+
+    Запись двойная намеренно. Если бы колонки обновлял только materialize_orders, строка
+    заказа отставала бы от журнала: страница следующего шага и условие expected повторного
+    нажатия читали бы устаревшее состояние. Цена - UPDATE горячей строки на каждый шаг.
+
+    Returns:
+        bool: True, если заказ соответствовал expected и шаг записан.
+
+    Raises:
+        IntegrityError: Событие с тем же ключом идемпотентности уже записано.
+    """
+    with transaction.atomic():
+        log_order_event(order, step, at, payload, key)
+        if not transition_order(order, expected, **values):
+            transaction.set_rollback(True)
+            return False
+    return True
+
+
 @shared_task
 def save_url(request, order):
-    order.hold_url = request.META.get('PATH_INFO')
-    order.save()
+    url = request.META.get('PATH_INFO')
+    # Повторная загрузка той же страницы не должна перезаписывать заказ
+    if order.hold_url == url:
+        return order
+    transition_order(order, hold_url=url)
     return order
 
 
@@ -52,100 +174,158 @@ def is_all_orders_ended(shift):
         orders = OrdersModel.objects.filter(related_to_shift=shift)
         return not orders or all(order.is_ended() for order in orders)
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in is_all_orders_ended: {e}",
-                     exc_info=True)
+        logger.exception('is_all_orders_ended_failed')
 
         # Вернуть False в случае ошибки
         return False
 
 
+def claim_machine(machine_id, order):
+    """
+    Занимает свободный станок заказом order одним условным UPDATE.
+
+    UPDATE блокирует строку станка до конца транзакции, поэтому из одновременных
+    запросов станок получает только один, остальные видят его уже занятым.
+
+    Returns:
+        bool: True, если станок занят этим заказом, False, если станок занят другим заказом или сломан.
+    """
+    return MachineModel.objects.filter(id=machine_id, **MACHINE_IS_FREE).update(
+        is_in_progress=True, order_in_progress=order
+    ) == 1
+
+
+def release_machine(machine_id, order_id):
+    """
+    Освобождает станок одним условным UPDATE, только если он занят заказом order_id.
+
+    Returns:
+        bool: True, если станок освобожден, False, если им уже владеет другой заказ или он свободен.
+    """
+    return MachineModel.objects.filter(id=machine_id, order_in_progress_id=order_id).update(
+        is_in_progress=False, order_in_progress=None
+    ) == 1
+
+
+@timed
 def start_new_order(custom_user, shift, selected_machine):
+    """
+    Создает заказ и занимает им станок в одной транзакции.
+
+    Returns:
+        OrdersModel | None: Новый заказ, либо None, если станок занят, сломан или произошла ошибка.
+    """
     try:
-        machine = MachineModel.objects.get(id=selected_machine)
-        machine.is_in_progress = True
-        new_order = OrdersModel.objects.create(
-            user=custom_user,
-            machine=machine,
-            related_to_shift=shift,
-            start_time=timezone.now()
-        )
-        machine.order_in_progress = new_order
-        machine.save()
+        with transaction.atomic():
+            new_order = OrdersModel.objects.create(
+                user=custom_user,
+                machine_id=selected_machine,
+                related_to_shift=shift,
+                start_time=timezone.now()
+            )
+            if not claim_machine(selected_machine, new_order):
+                # Заказ откатывается вместе с транзакцией
+                transaction.set_rollback(True)
+                logger.warning('machine_busy', user=custom_user.id, machine=selected_machine)
+                return None
+            log_order_event(new_order, OrderEventModel.START, new_order.start_time)
+
+        machine_state_cache.publish_machine(selected_machine)
 
         # Логирование события начала нового заказа
-        logger.info(
-            f"{datetime.datetime.now()} |BACKEND| User {custom_user} started a new order (Order ID: {new_order.id}) on Machine ID: {machine.id}")
+        logger.info('order_started', user=custom_user.id, order=new_order.id, machine=selected_machine)
 
         return new_order
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in start_new_order: {e}", exc_info=True)
+        logger.exception('start_new_order_failed')
 
         # Вернуть None в случае ошибки
         return None
 
 
+def find_current_order(orders, selected_machine):
+    """
+    Возвращает текущий заказ станка из выборки orders.
+
+    Сначала ищет по указателю MachineModel.order_in_progress (поиск по первичному ключу),
+    если станок свободен или занят не этим заказом - берет последний заказ выборки.
+    """
+    order = orders.filter(
+        pk=Subquery(MachineModel.objects.filter(id=selected_machine).values('order_in_progress')[:1])
+    ).first()
+    return order or orders.last()
+
+
 def get_order(custom_user, shift, selected_machine):
     try:
-        order = OrdersModel.objects.filter(
+        order = find_current_order(OrdersModel.objects.filter(
             user=custom_user,
             related_to_shift=shift,
             machine_id=selected_machine
-        ).last()
+        ), selected_machine)
 
         # Логирование события получения заказа
-        logger.info(
-            f"{datetime.datetime.now()} |BACKEND, ORDER| User {custom_user} retrieved the order (Order ID: {order.id}) for Machine ID: {selected_machine}")
+        logger.info('order_retrieved', user=custom_user.id, order=order.id, machine=selected_machine)
 
         return order
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in get_order: {e}", exc_info=True)
+        logger.exception('get_order_failed')
 
         return None
 
 
+@timed
 def stop_order(order):
     try:
-        machine = MachineModel.objects.get(id=order.machine_id)
-        machine.is_in_progress = False
-        machine.order_in_progress = None
-        order.ended_early = True
-        order.end_working_time = timezone.now()
-        machine.save()
-        order.save()
+        now = timezone.now()
+        # Заказ завершается и освобождает станок в одной транзакции.
+        # Уже завершенный заказ не перезаписывается
+        with transaction.atomic():
+            if not record_transition(order, OrderEventModel.STOP, now, ended_early=True, end_working_time=now):
+                return None
+            release_machine(order.machine_id, order.id)
+        machine_state_cache.publish_machine(order.machine_id)
+        add_order_to_rollups(order)
 
         # Логирование события остановки заказа
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Order {order.id} stopped on Machine ID: {machine.id}")
+        logger.info('order_stopped', order=order.id, machine=order.machine_id)
 
         return order
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in stop_order: {e}", exc_info=True)
+        logger.exception('stop_order_failed')
 
         # Вернуть None в случае ошибки
         return None
 
 
-def add_part_name(order, part_name):
+@timed
+def add_part_name(order, part_name, at=None, key=None):
     try:
-        order.part_name = part_name
-        order.scan_time = timezone.now()
-        order.save()
+        at = at or timezone.now()
+        if not record_transition(order, OrderEventModel.SCAN, at, {'part_name': part_name}, key,
+                                 part_name=part_name, scan_time=at):
+            return None
 
         # Логирование события добавления наименования детали к заказу
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Added part name '{part_name}' to Order {order.id}")
+        logger.info('part_name_added', order=order.id, part_name=part_name)
 
         return order
 
-    except Exception as e:
+    except IntegrityError:
+        # Повтор события с тем же ключом, обрабатывает apply_order_events
+        raise
+
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in add_part_name: {e}", exc_info=True)
+        logger.exception('add_part_name_failed')
 
         # Вернуть None в случае ошибки
         return None
@@ -153,17 +333,17 @@ def add_part_name(order, part_name):
 
 def add_quantity(order, quantity):
     try:
-        order.num_parts = quantity
-        order.save()
+        if not transition_order(order, ORDER_IS_OPEN, num_parts=quantity):
+            return None
 
         # Логирование события добавления количества деталей к заказу
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Added quantity {quantity} to Order {order.id}")
+        logger.info('quantity_added', order=order.id, quantity=quantity)
 
         return order
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in add_quantity: {e}", exc_info=True)
+        logger.exception('add_quantity_failed')
 
         # Вернуть None в случае ошибки
         return None
@@ -171,146 +351,210 @@ def add_quantity(order, quantity):
 
 def add_start_working_time(order):
     try:
-        order.start_working_time = timezone.now()
-        order.save()
+        if not transition_order(order, ORDER_IS_OPEN, start_working_time=timezone.now()):
+            return None
 
         # Логирование события добавления времени начала работы над заказом
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Added start working time to Order {order.id}")
+        logger.info('start_working_time_added', order=order.id)
 
         return order
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in add_start_working_time: {e}",
-                     exc_info=True)
+        logger.exception('add_start_working_time_failed')
 
         # Вернуть None в случае ошибки
         return None
 
 
-def add_machine_start_time(order):
+@timed
+def add_quantity_and_start_working_time(order, quantity, at=None, key=None):
+    """
+    Записывает количество деталей и начало работы с деталью одним UPDATE.
+    """
     try:
-        order.machine_start_time = timezone.now()
-        order.save()
+        at = at or timezone.now()
+        if not record_transition(order, OrderEventModel.QUANTITY, at, {'quantity': quantity}, key,
+                                 num_parts=quantity, start_working_time=at):
+            return None
+
+        logger.info('quantity_and_start_working_time_added', order=order.id, quantity=quantity)
+
+        return order
+
+    except IntegrityError:
+        # Повтор события с тем же ключом, обрабатывает apply_order_events
+        raise
+
+    except Exception:
+        logger.exception('add_quantity_and_start_working_time_failed')
+
+        # Вернуть None в случае ошибки
+        return None
+
+
+@timed
+def add_machine_start_time(order, at=None, key=None):
+    try:
+        at = at or timezone.now()
+        if not record_transition(order, OrderEventModel.SETUP, at, key=key, machine_start_time=at):
+            return None
 
         # Логирование события добавления времени начала работы на станке
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Added machine start time to Order {order.id}")
+        logger.info('machine_start_time_added', order=order.id)
 
         return order
 
-    except Exception as e:
+    except IntegrityError:
+        # Повтор события с тем же ключом, обрабатывает apply_order_events
+        raise
+
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in add_machine_start_time: {e}",
-                     exc_info=True)
+        logger.exception('add_machine_start_time_failed')
 
         # Вернуть None в случае ошибки
         return None
 
 
-def add_machine_end_time(order):
+@timed
+def add_machine_end_time(order, at=None, key=None):
     try:
-        order.machine_end_time = timezone.now()
-        order.save()
+        at = at or timezone.now()
+        if not record_transition(order, OrderEventModel.PROCESSING, at, key=key, machine_end_time=at):
+            return None
 
         # Логирование события добавления времени завершения работы на станке
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Added machine end time to Order {order.id}")
+        logger.info('machine_end_time_added', order=order.id)
 
         return order
 
-    except Exception as e:
+    except IntegrityError:
+        # Повтор события с тем же ключом, обрабатывает apply_order_events
+        raise
+
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in add_machine_end_time: {e}",
-                     exc_info=True)
+        logger.exception('add_machine_end_time_failed')
 
         # Вернуть None в случае ошибки
         return None
 
 
-def add_end_working_time(order):
+@timed
+def add_end_working_time(order, at=None, key=None):
     try:
-        order.end_working_time = timezone.now()
-        order.save()
+        at = at or timezone.now()
+        if not record_transition(order, OrderEventModel.ENDING, at, key=key, end_working_time=at):
+            return None
 
         # Логирование события добавления времени завершения работы над заказом
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Added end working time to Order {order.id}")
+        logger.info('end_working_time_added', order=order.id)
 
         return order
 
-    except Exception as e:
+    except IntegrityError:
+        # Повтор события с тем же ключом, обрабатывает apply_order_events
+        raise
+
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in add_end_working_time: {e}",
-                     exc_info=True)
+        logger.exception('add_end_working_time_failed')
 
         # Вернуть None в случае ошибки
         return None
 
 
+@timed
 def machine_free(order, status='in_progress'):
     try:
-        machine = MachineModel.objects.get(id=order.machine_id)
-
-        if status == 'in_progress':
-            machine.order_in_progress = None
-            machine.is_in_progress = False
-        elif status == 'broken':
-            machine.is_broken = False
-        elif status == 'both':
-            machine.order_in_progress = None
-            machine.is_broken = False
-            machine.is_in_progress = False
-
-        machine.save()
+        # Станок освобождается только от своего заказа и меняются только нужные колонки,
+        # чтобы не затереть состояние, записанное параллельным запросом
+        with transaction.atomic():
+            if status in ('in_progress', 'both'):
+                release_machine(order.machine_id, order.id)
+            if status in ('broken', 'both'):
+                MachineModel.objects.filter(id=order.machine_id).update(is_broken=False)
+        machine_state_cache.publish_machine(order.machine_id)
 
         # Логирование события освобождения станка
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Machine ID: {machine.id} freed (Status: {status})")
+        logger.info('machine_freed', machine=order.machine_id, order=order.id, status=status)
 
         return order
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in machine_free: {e}", exc_info=True)
+        logger.exception('machine_free_failed')
 
         # Вернуть None в случае ошибки
         return None
 
 
-def set_on_hold(request, order):
+@timed
+def set_on_hold(request, order, at=None):
     try:
-        order.hold_started = timezone.now()
-        order.hold_url = request.META.get('HTTP_REFERER', '/')
-        order.save()
+        at = at or timezone.now()
+        hold_url = request.META.get('HTTP_REFERER', '/')
+        if not record_transition(order, OrderEventModel.PAUSE, at, {'url': hold_url},
+                                 hold_started=at, hold_url=hold_url):
+            return None
 
         # Логирование события установки заказа на паузу
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Order {order.id} set on hold. Hold URL: {order.hold_url}")
+        logger.info('order_on_hold', order=order.id, hold_url=order.hold_url)
 
         return order
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in set_on_hold: {e}", exc_info=True)
+        logger.exception('set_on_hold_failed')
 
         # Вернуть None в случае ошибки
         return None
 
 
-def remove_hold(order):
+def hold_duration(hold_started, hold_ended, machine_start_time=None, machine_end_time=None):
+    """
+    Длительность паузы без той ее части, когда станок работал сам и время уже учтено как полезное.
+    """
+    duration = hold_ended - hold_started
+    if machine_start_time is not None:
+        overlap = min(hold_ended, machine_end_time or hold_ended) - max(hold_started, machine_start_time)
+        duration -= max(overlap, timedelta())
+    return max(duration, timedelta())
+
+
+def is_on_hold(order):
+    return order.hold_started is not None and (order.hold_ended is None or order.hold_ended < order.hold_started)
+
+
+@timed
+def remove_hold(order, at=None):
     try:
-        order.hold_ended = timezone.now()
-        order.save()
+        at = at or timezone.now()
+        values = {'hold_ended': at}
+        if is_on_hold(order):
+            values['hold_time'] = order.hold_time + hold_duration(
+                order.hold_started, at, order.machine_start_time, order.machine_end_time
+            )
+        # Условие на hold_ended не дает двум одновременным продолжениям дважды добавить одну паузу
+        if not record_transition(order, OrderEventModel.RESUME, at,
+                                 expected={**ORDER_IS_OPEN, 'hold_ended': order.hold_ended}, **values):
+            return None
 
         # Логирование события снятия заказа с паузы
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Hold removed from Order {order.id}")
+        logger.info('hold_removed', order=order.id)
 
         return order
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in remove_hold: {e}", exc_info=True)
+        logger.exception('remove_hold_failed')
 
         # Вернуть None в случае ошибки
         return None
 
 
+@timed
 def add_report(request, order, custom_user):
     try:
         current_url = request.META.get('HTTP_REFERER', '/')
@@ -322,21 +566,18 @@ def add_report(request, order, custom_user):
             url=current_url
         )
 
-        machine_id = order.machine.id
-        machine = MachineModel.objects.get(id=machine_id)
-        machine.is_broken = True
-        machine.save()
+        MachineModel.objects.filter(id=order.machine_id).update(is_broken=True)
+        machine_state_cache.publish_machine(order.machine_id)
 
-        order.hold_url = current_url
-        order.save()
+        transition_order(order, hold_url=current_url)
 
         # Логирование события добавления отчета о поломке
-        logger.info(
-            f"{datetime.datetime.now()} |BACKEND| Report added for Order {order.id}. Description: {request.POST.get('bug_description')}")
+        logger.info('report_added', order=order.id, user=custom_user.id,
+                    description=request.POST.get('bug_description'))
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in add_report: {e}", exc_info=True)
+        logger.exception('add_report_failed')
 
         # Вернуть None в случае ошибки
         return None
@@ -347,13 +588,13 @@ def get_all_reports(user):
         all_reports = ReportsModel.objects.filter(user=user, is_solved=False)
 
         # Логирование события получения всех не решенных отчетов пользователя
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Got all unsolved reports for User {user.id}")
+        logger.info('unsolved_reports_retrieved', user=user.id)
 
         return all_reports
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in get_all_reports: {e}", exc_info=True)
+        logger.exception('get_all_reports_failed')
 
         # Вернуть None в случае ошибки
         return None
@@ -368,12 +609,11 @@ def add_request(request, custom_user):
         )
 
         # Логирование события добавления запроса
-        logger.info(
-            f"{datetime.datetime.now()} |BACKEND| Request added for User {custom_user.id}. Description: {request.POST.get('request_description')}")
+        logger.info('request_added', user=custom_user.id, description=request.POST.get('request_description'))
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in add_request: {e}", exc_info=True)
+        logger.exception('add_request_failed')
 
         # Вернуть None в случае ошибки
         return None
@@ -389,63 +629,323 @@ def count_and_set_reports_duration(order):
             one_report_duration = report.end_time - report.start_time
             total_duration += one_report_duration
 
-        order.bugs_time = total_duration
-        order.save()
+        transition_order(order, bugs_time=total_duration)
 
         # Логирование события подсчета и установки продолжительности багов
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Counted and set reports duration for Order {order.id}")
+        logger.info('reports_duration_set', order=order.id)
 
         return total_duration
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in count_and_set_reports_duration: {e}",
-                     exc_info=True)
+        logger.exception('count_and_set_reports_duration_failed')
         # Вернуть None в случае ошибки
         return None
 
 
-def decode_photo(request):
+@timed
+def end_order(order, at=None, key=None):
+    """
+    Завершает заказ: конец работы с деталью, освобождение станка, время поломок и итоги.
+
+    Returns:
+        OrdersModel | None: Заказ, либо None, если он уже был завершен.
+    """
+    ended = add_end_working_time(order, at, key)
+    machine_free(order)
+    count_and_set_reports_duration(order)
+    if ended:
+        add_order_to_rollups(order)
+    return ended
+
+
+# Шаг -> применение события к заказу. Каждый шаг вызывает тот же переход, что и страница шага
+ORDER_EVENT_STEPS = {
+    OrderEventModel.SCAN: lambda order, at, payload, key: add_part_name(order, str(payload['part_name']), at, key),
+    OrderEventModel.QUANTITY: lambda order, at, payload, key: add_quantity_and_start_working_time(
+        order, int(payload['quantity']), at, key),
+    OrderEventModel.SETUP: lambda order, at, payload, key: add_machine_start_time(order, at, key),
+    OrderEventModel.PROCESSING: lambda order, at, payload, key: add_machine_end_time(order, at, key),
+    OrderEventModel.ENDING: lambda order, at, payload, key: end_order(order, at, key),
+}
+
+
+class OrderEventRejected(Exception):
+    pass
+
+
+def parse_order_event(event):
+    """
+    Проверяет событие планшета и возвращает (key, order_id, step, client_ts, payload).
+
+    Время с устройства без часового пояса считается локальным, время из будущего
+    (часы планшета спешат) заменяется текущим.
+
+    Raises:
+        OrderEventRejected: Событие заполнено неверно.
+    """
+    if not isinstance(event, dict):
+        raise OrderEventRejected('Событие должно быть объектом')
+    key = event.get('key')
+    if not isinstance(key, str) or not 0 < len(key) <= OrderEventModel.KEY_MAX_LENGTH:
+        raise OrderEventRejected('Неверный ключ идемпотентности')
+    if event.get('step') not in ORDER_EVENT_STEPS:
+        raise OrderEventRejected(f'Неизвестный шаг {event.get("step")}')
+    try:
+        order_id = int(event.get('order'))
+        client_ts = parse_datetime(event.get('client_ts') or '')
+    except (TypeError, ValueError):
+        raise OrderEventRejected('Неверный заказ или время')
+    if client_ts is None:
+        raise OrderEventRejected('Неверное время')
+    if timezone.is_naive(client_ts):
+        client_ts = timezone.make_aware(client_ts)
+    payload = event.get('payload') or {}
+    if not isinstance(payload, dict):
+        raise OrderEventRejected('payload должен быть объектом')
+    return key, order_id, event['step'], min(client_ts, timezone.now()), payload
+
+
+@timed
+def apply_order_events(custom_user, events):
+    """
+    Применяет пакет шагов работы над заказами, накопленный планшетом, в одной транзакции.
+
+    События применяются по порядку, каждое в своей точке сохранения: отклоненное событие
+    откатывается, остальные записываются. Событие с уже принятым ключом не применяется повторно.
+
+    Parameters:
+        custom_user (CustomUserModel): Отправитель. Применяются только события его заказов.
+        events (list[dict]): События {key, order, step, client_ts, payload}.
+
+    Returns:
+        list[dict]: Для каждого события {key, status: applied | duplicate | rejected, error}.
+    """
+    results = []
+    keys = [event.get('key') for event in events if isinstance(event, dict)]
+    order_ids = {event.get('order') for event in events if isinstance(event, dict)}
+
+    with transaction.atomic():
+        seen = set(OrderEventModel.objects.filter(
+            user=custom_user, idempotency_key__in=[key for key in keys if isinstance(key, str)]
+        ).values_list('idempotency_key', flat=True))
+        orders = OrdersModel.objects.filter(user=custom_user).in_bulk(
+            [order_id for order_id in order_ids if isinstance(order_id, (int, str)) and str(order_id).isdigit()]
+        )
+
+        for event in events:
+            key = event.get('key') if isinstance(event, dict) else None
+            if isinstance(key, str) and key in seen:
+                results.append({'key': key, 'status': 'duplicate'})
+                continue
+            try:
+                key, order_id, step, client_ts, payload = parse_order_event(event)
+                order = orders.get(order_id)
+                if order is None:
+                    raise OrderEventRejected(f'Заказ {order_id} не найден')
+                # Событие с ключом пишет в журнал сам переход
+                with transaction.atomic():
+                    try:
+                        applied = ORDER_EVENT_STEPS[step](order, client_ts, payload, key)
+                    except (KeyError, TypeError, ValueError):
+                        raise OrderEventRejected(f'Неверные данные шага {step}')
+                    if applied is None:
+                        raise OrderEventRejected(f'Шаг {step} не применен к заказу {order_id}')
+            except OrderEventRejected as e:
+                results.append({'key': key, 'status': 'rejected', 'error': str(e)})
+                continue
+            except IntegrityError:
+                # Тот же ключ только что принят параллельным запросом
+                results.append({'key': key, 'status': 'duplicate'})
+                continue
+            seen.add(key)
+            results.append({'key': key, 'status': 'applied'})
+
+    logger.info('order_events_received', user=custom_user.id, events=len(events),
+                applied=sum(result['status'] == 'applied' for result in results))
+
+    return results
+
+
+# Колонки заказа, которые восстанавливаются из журнала событий
+MATERIALIZED_ORDER_FIELDS = (
+    'start_time', 'part_name', 'scan_time', 'num_parts', 'start_working_time', 'machine_start_time',
+    'machine_end_time', 'end_working_time', 'ended_early', 'hold_started', 'hold_url', 'hold_ended', 'hold_time',
+)
+
+
+def fold_order_events(events):
+    """
+    Значения колонок заказа по его событиям, отсортированным по времени.
+
+    Паузы считаются по всем парам pause/resume, а не только по последней,
+    время работы станка во время паузы не входит в hold_time.
     """
-    API endpoint to /qr-decoder/
-    decode image_data
-    request: request
-    return :str
+    values = {}
+    holds = []
+    for event in events:
+        if event.step == OrderEventModel.START:
+            values['start_time'] = event.ts
+        elif event.step == OrderEventModel.SCAN:
+            values.update(part_name=event.payload.get('part_name', ''), scan_time=event.ts)
+        elif event.step == OrderEventModel.QUANTITY:
+            values.update(num_parts=event.payload.get('quantity', 0), start_working_time=event.ts)
+        elif event.step == OrderEventModel.SETUP:
+            values['machine_start_time'] = event.ts
+        elif event.step == OrderEventModel.PROCESSING:
+            values['machine_end_time'] = event.ts
+        elif event.step == OrderEventModel.PAUSE:
+            values.update(hold_started=event.ts, hold_url=event.payload.get('url'))
+        elif event.step == OrderEventModel.RESUME:
+            if values.get('hold_started') and (values.get('hold_ended') is None
+                                               or values['hold_ended'] < values['hold_started']):
+                holds.append((values['hold_started'], event.ts))
+            values['hold_ended'] = event.ts
+        elif event.step == OrderEventModel.ENDING:
+            values['end_working_time'] = event.ts
+        elif event.step == OrderEventModel.STOP:
+            values.update(end_working_time=event.ts, ended_early=True)
+
+    values['hold_time'] = sum(
+        (hold_duration(started, ended, values.get('machine_start_time'), values.get('machine_end_time'))
+         for started, ended in holds),
+        timedelta(),
+    )
+    return values
+
+
+@timed
+def materialize_orders(order_ids=None, batch_size=1000):
+    """
+    Восстанавливает колонки заказов из журнала событий и пересчитывает bad_time их смен.
+
+    Заказы без событий (созданные до журнала) не меняются.
+
+    Parameters:
+        order_ids (list[int] | None): ID заказов, None - все заказы с событиями.
+        batch_size (int): Количество заказов в одной пачке.
+
+    Returns:
+        int: Количество обновленных заказов, либо None в случае ошибки.
     """
-    image_data = request.FILES.get('image')
-    image = Image.open(image_data)
-    resized = image.resize((500, 500))
-    decoded_qr_img = decode(resized)
     try:
-        cropped_data = decoded_qr_img[0].data
-        decoded_qr_data = cropped_data.decode('utf-8')
-        logger.info(f"{datetime.datetime.now()} |INFO| QR successfully decoded: {decoded_qr_data}")
-    except IndexError:
-        logger.info(f"{datetime.datetime.now()} |ERROR| QR decoding error")
-        decoded_qr_data = 'Ошибка в декодировании'
-    return HttpResponse(decoded_qr_data)
+        events = OrderEventModel.objects.all()
+        if order_ids is not None:
+            events = events.filter(order_id__in=order_ids)
+        ids = list(events.order_by('order_id').values_list('order_id', flat=True).distinct())
+
+        updated = 0
+        shift_ids = set()
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            # Заказы блокируются до чтения журнала: шаг, записанный параллельно,
+            # либо уже виден в журнале, либо ждет блокировку и применится после bulk_update
+            with transaction.atomic():
+                orders = {
+                    order.id: order
+                    for order in OrdersModel.objects.select_for_update().filter(id__in=batch).order_by('id')
+                }
+                by_order = {}
+                for event in OrderEventModel.objects.filter(order_id__in=batch).order_by('ts', 'id'):
+                    by_order.setdefault(event.order_id, []).append(event)
+
+                now = timezone.now()
+                for order_id, order_events in by_order.items():
+                    order = orders[order_id]
+                    for field, value in fold_order_events(order_events).items():
+                        setattr(order, field, value)
+                    order.updated_at = now
+                    shift_ids.add(order.related_to_shift_id)
+                OrdersModel.objects.bulk_update(orders.values(), [*MATERIALIZED_ORDER_FIELDS, 'updated_at'])
+            updated += len(orders)
+
+        recalculate_bad_time(sorted(shift_ids), batch_size)
+
+        logger.info('orders_materialized', orders=updated)
+
+        return updated
+
+    except Exception:
+        logger.exception('materialize_orders_failed')
+        # Вернуть None в случае ошибки
+        return None
+
+
+def qr_queue_length():
+    """
+    Возвращает количество задач распознавания QR, ожидающих в очереди qr.
+    """
+    with current_app.connection_or_acquire() as connection:
+        try:
+            return connection.default_channel.queue_declare(queue='qr', passive=True).message_count
+        except ChannelError:
+            # Пустая очередь в Redis не существует как ключ
+            return 0
+
+
+def submit_qr_decode(image_data, cache_key):
+    """
+    Ставит распознавание QR в очередь qr.
+
+    Parameters:
+        image_data (bytes): Содержимое загруженного изображения.
+        cache_key (str): Ключ изображения в qr_decode_cache, по которому decode_photo_status
+            сохранит результат задачи.
+
+    Returns:
+        AsyncResult | None: Результат задачи или None, если очередь переполнена.
+    """
+    if qr_queue_length() >= settings.QR_DECODE_MAX_PENDING:
+        logger.warning('qr_decode_queue_full')
+        return None
+
+    encoded = base64.b64encode(image_data).decode('ascii')
+    result = decode_qr_image.apply_async((encoded,), expires=settings.QR_DECODE_TIMEOUT)
+    qr_decode_cache.set_task(result.id, cache_key)
+    return result
+
+
+async def wait_qr_decode(result, timeout):
+    """
+    Асинхронно ждет результат распознавания не дольше timeout секунд.
+
+    В отличие от result.get() не занимает поток на все время ожидания:
+    готовность проверяется короткими обращениями к бэкенду результатов
+    раз в QR_DECODE_POLL_INTERVAL секунд.
+
+    Raises:
+        celery.exceptions.TimeoutError: Результат не готов за timeout секунд.
+    """
+    ready = sync_to_async(result.ready, thread_sensitive=False)
+    deadline = time.monotonic() + timeout
+    while not await ready():
+        if time.monotonic() >= deadline:
+            raise CeleryTimeoutError(f'QR decode {result.id} is not ready after {timeout} s')
+        await asyncio.sleep(settings.QR_DECODE_POLL_INTERVAL)
+    return await sync_to_async(result.get, thread_sensitive=False)()
 
 
 @shared_task
+@timed
 def calculate_shift_end_time(shift_id):
     shift = ShiftModel.objects.get(id=shift_id)
     try:
         shift.end_time = timezone.now()
         shift.save()
         # Логирование события расчета времени окончания смены
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Calculated shift end time for Shift {shift.id}")
+        logger.info('shift_end_time_calculated', shift=shift.id)
 
         return shift_id
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in calculate_shift_end_time: {e}",
-                     exc_info=True)
+        logger.exception('calculate_shift_end_time_failed')
         # Вернуть None в случае ошибки
         return None
 
 
 @shared_task
+@timed
 def count_num_ended_orders(shift_id):
     shift = ShiftModel.objects.get(id=shift_id)
     try:
@@ -453,38 +953,38 @@ def count_num_ended_orders(shift_id):
             related_to_shift=shift, ended_early=False).count()
         shift.save()
         # Логирование события подсчета количества завершенных заказов в смене
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Counted number of ended orders for Shift {shift.id}")
+        logger.info('ended_orders_counted', shift=shift.id)
 
         return shift_id
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in count_num_ended_orders: {e}",
-                     exc_info=True)
+        logger.exception('count_num_ended_orders_failed')
         # Вернуть None в случае ошибки
         return None
 
 
 @shared_task
+@timed
 def calculate_shift_time_total(shift_id):
     shift = ShiftModel.objects.get(id=shift_id)
     try:
         shift.time_total = shift.end_time - shift.start_time
         shift.save()
         # Логирование события расчета общего времени смены
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Calculated total shift time for Shift {shift.id}")
+        logger.info('shift_time_total_calculated', shift=shift.id)
 
         return shift_id
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in calculate_shift_time_total: {e}",
-                     exc_info=True)
+        logger.exception('calculate_shift_time_total_failed')
         # Вернуть None в случае ошибки
         return None
 
 
 @shared_task
+@timed
 def calculate_total_bugs_time(shift_id):
     shift = ShiftModel.objects.get(id=shift_id)
     try:
@@ -495,19 +995,19 @@ def calculate_total_bugs_time(shift_id):
         shift.total_bugs_time = total_bugs_time or timedelta()
         shift.save()
         # Логирование события расчета общего времени багов в смене
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Calculated total bugs time for Shift {shift.id}")
+        logger.info('total_bugs_time_calculated', shift=shift.id)
 
         return shift_id
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in calculate_total_bugs_time: {e}",
-                     exc_info=True)
+        logger.exception('calculate_total_bugs_time_failed')
         # Вернуть None в случае ошибки
         return None
 
 
 @shared_task
+@timed
 def calculate_good_time(shift_id):
     shift = ShiftModel.objects.get(id=shift_id)
     try:
@@ -527,58 +1027,99 @@ def calculate_good_time(shift_id):
         shift.save()
 
         # Логирование события расчета общего полезного времени
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Calculated total good time for Shift {shift.id}")
+        logger.info('good_time_calculated', shift=shift.id)
 
         return shift_id
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in calculate_good_time: {e}",
-                     exc_info=True)
+        logger.exception('calculate_good_time_failed')
         # Вернуть None в случае ошибки
         return None
 
 
 @shared_task
+@timed
 def calculate_bad_time(shift_id):
     shift = ShiftModel.objects.get(id=shift_id)
     try:
-        total_bad_time = timedelta()
-
-        for order in OrdersModel.objects.filter(related_to_shift=shift):
-            if (
-                    order.end_working_time is not None and
-                    order.scan_time is not None and
-                    order.machine_end_time is not None and
-                    order.machine_start_time is not None and
-                    order.bugs_time is not None
-            ):
-                bad_time_in_order = (
-                        order.end_working_time - order.scan_time -
-                        (order.machine_end_time - order.machine_start_time) -
-                        order.bugs_time
-                )
-                total_bad_time += bad_time_in_order
-
-        if shift.bad_time is not None:
-            shift.bad_time += total_bad_time
-        else:
-            shift.bad_time = total_bad_time
+        total_bad_time = OrdersModel.objects.filter(related_to_shift=shift).filter(BAD_TIME_FILTER).aggregate(
+            total_bad_time=Sum(BAD_TIME_EXPRESSION)
+        )['total_bad_time']
 
-        shift.save()
+        # Значение перезаписывается, поэтому повторный запуск задачи не удваивает время
+        ShiftModel.objects.filter(id=shift_id).update(bad_time=total_bad_time or timedelta(),
+                                                      updated_at=timezone.now())
         # Логирование события расчета общего бесполезного времени
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Calculated total bad time for Shift {shift.id}")
+        logger.info('bad_time_calculated', shift=shift.id)
 
         return shift_id
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in calculate_bad_time: {e}", exc_info=True)
+        logger.exception('calculate_bad_time_failed')
         # Вернуть None в случае ошибки
         return None
 
 
+def recalculate_bad_time(shift_ids=None, batch_size=1000):
+    """
+    Пересчитывает bad_time и зависящее от него lost_time для завершенных смен пачками.
+
+    На каждую пачку из batch_size смен выполняется один сгруппированный
+    запрос по заказам и один bulk_update.
+
+    Parameters:
+        shift_ids (list[int] | None): ID смен для пересчета, None - все завершенные смены.
+        batch_size (int): Количество смен в одной пачке.
+
+    Returns:
+        int: Количество пересчитанных смен.
+    """
+    shifts = ShiftModel.objects.filter(end_time__isnull=False).order_by('id')
+    if shift_ids is not None:
+        shifts = shifts.filter(id__in=shift_ids)
+
+    updated = 0
+    batch = []
+    for shift_id in shifts.values_list('id', flat=True).iterator(chunk_size=batch_size):
+        batch.append(shift_id)
+        if len(batch) == batch_size:
+            updated += _recalculate_bad_time_batch(batch)
+            batch = []
+    if batch:
+        updated += _recalculate_bad_time_batch(batch)
+
+    logger.info('bad_time_recalculated', shifts=updated)
+
+    return updated
+
+
+def _recalculate_bad_time_batch(shift_ids):
+    bad_times = dict(
+        OrdersModel.objects.filter(related_to_shift_id__in=shift_ids).filter(BAD_TIME_FILTER)
+        .values('related_to_shift_id')
+        .annotate(bad_time=Sum(BAD_TIME_EXPRESSION))
+        .values_list('related_to_shift_id', 'bad_time')
+    )
+    now = timezone.now()
+    shifts = []
+    # lost_time зависит от bad_time, поэтому пересчитывается той же формулой, что в finalize_shift
+    for shift_id, time_total, good_time, total_bugs_time, chill_time in ShiftModel.objects.filter(
+            id__in=shift_ids).values_list('id', 'time_total', 'good_time', 'total_bugs_time',
+                                          'user__position__chill_time'):
+        bad_time = bad_times.get(shift_id) or timedelta()
+        lost_time = None
+        if time_total is not None:
+            lost_time = (time_total - (good_time or timedelta()) - bad_time -
+                         (total_bugs_time or timedelta()) - chill_time)
+        shifts.append(ShiftModel(id=shift_id, bad_time=bad_time, lost_time=lost_time, updated_at=now))
+    ShiftModel.objects.bulk_update(shifts, ['bad_time', 'lost_time', 'updated_at'])
+    return len(shifts)
+
+
 @shared_task
+@timed
 def calculate_lost_time(shift_id):
     shift = ShiftModel.objects.get(id=shift_id)
     try:
@@ -592,32 +1133,241 @@ def calculate_lost_time(shift_id):
         shift.lost_time = total_lost_time
         shift.save()
         # Логирование события расчета общего потерянного времени
-        logger.info(f"{datetime.datetime.now()} |BACKEND| Calculated total lost time for Shift {shift.id}")
+        logger.info('lost_time_calculated', shift=shift.id)
 
         return shift_id
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in calculate_lost_time: {e}",
-                     exc_info=True)
+        logger.exception('calculate_lost_time_failed')
+        # Вернуть None в случае ошибки
+        return None
+
+
+@timed
+def finalize_shift(shift_id):
+    """
+    Закрывает смену и считает все показатели ShiftModel за один проход.
+
+    Все метрики по заказам смены считаются одним агрегирующим запросом,
+    результат записывается одним UPDATE в рамках одной транзакции.
+
+    Parameters:
+        shift_id (int): ID закрываемой смены.
+
+    Returns:
+        int: shift_id, либо None в случае ошибки.
+    """
+    try:
+        with transaction.atomic():
+            shift = ShiftModel.objects.select_for_update(of=('self',)).select_related('user').get(id=shift_id)
+            chill_time = get_lookup(PositionsModel, shift.user.position_id).chill_time
+
+            totals = OrdersModel.objects.filter(related_to_shift_id=shift_id).aggregate(
+                num_ended_orders=Count('id', filter=Q(ended_early=False)),
+                total_bugs_time=Sum('bugs_time'),
+                good_time=Sum(GOOD_TIME_EXPRESSION, filter=GOOD_TIME_FILTER),
+                bad_time=Sum(BAD_TIME_EXPRESSION, filter=BAD_TIME_FILTER),
+            )
+
+            end_time = timezone.now()
+            time_total = end_time - shift.start_time
+            total_bugs_time = totals['total_bugs_time'] or timedelta()
+            good_time = totals['good_time'] or timedelta()
+            bad_time = totals['bad_time'] or timedelta()
+            lost_time = (
+                    time_total - good_time - bad_time -
+                    total_bugs_time - chill_time
+            )
+
+            ShiftModel.objects.filter(id=shift_id).update(
+                end_time=end_time,
+                num_ended_orders=totals['num_ended_orders'],
+                time_total=time_total,
+                total_bugs_time=total_bugs_time,
+                good_time=good_time,
+                bad_time=bad_time,
+                lost_time=lost_time,
+                updated_at=end_time,
+            )
+            CustomUserModel.objects.filter(id=shift.user_id, current_shift_id=shift_id).update(current_shift=None)
+
+        logger.info('shift_finalized', shift=shift_id)
+
+        return shift_id
+
+    except Exception:
+        logger.exception('finalize_shift_failed')
         # Вернуть None в случае ошибки
         return None
 
 
 @shared_task
 def count_and_end_shift(shift_id):
+    """
+    Асинхронный вариант finalize_shift для воркера Celery.
+    """
+    return finalize_shift(shift_id)
+
+
+def end_shift(shift_id):
+    """
+    Закрывает смену синхронно или, если включен SHIFT_CLOSE_ASYNC, через Celery.
+    """
+    if settings.SHIFT_CLOSE_ASYNC:
+        return count_and_end_shift.delay(shift_id)
+    return finalize_shift(shift_id)
+
+
+ROLLUP_METRICS = ('num_orders', 'num_ended_orders', 'num_parts', 'good_time', 'bad_time', 'bugs_time')
+ROLLUP_DIMENSIONS = ('machine', 'working_area', 'position')
+
+
+def _rollup_rows(orders, granularity):
+    """
+    Итоги завершенных заказов queryset по периодам granularity и разрезам, одним запросом.
+    """
+    rows = orders.filter(end_working_time__isnull=False).values(
+        'machine',
+        period_start=Trunc('end_working_time', granularity),
+        working_area=F('user__working_area'),
+        position=F('user__position'),
+    ).annotate(
+        num_orders=Count('id'),
+        num_ended_orders=Count('id', filter=Q(ended_early=False)),
+        num_parts=Sum('num_parts'),
+        good_time=Sum(GOOD_TIME_EXPRESSION, filter=GOOD_TIME_FILTER),
+        bad_time=Sum(BAD_TIME_EXPRESSION, filter=BAD_TIME_FILTER),
+        bugs_time=Sum('bugs_time'),
+    ).order_by()
+
+    for row in rows.iterator():
+        keys = {
+            'granularity': granularity,
+            'period_start': row['period_start'],
+            'machine_id': row['machine'],
+            'working_area_id': row['working_area'],
+            'position_id': row['position'],
+        }
+        values = {name: row[name] or (0 if name.startswith('num_') else timedelta()) for name in ROLLUP_METRICS}
+        yield keys, values
+
+
+@timed
+def add_order_to_rollups(order):
+    """
+    Добавляет завершенный заказ в часовые и дневные итоги его станка, рабочего места и должности.
+
+    Вызывается один раз на заказ: в end_order после записи времени поломок или в stop_order.
+    Правки заказа после завершения в итоги не попадают, их сверяет команда rebuild_rollups.
+
+    Строка разреза прибавляется UPDATE, который блокирует ее до конца транзакции. Если строки
+    еще нет, она создается в точке сохранения; когда ее одновременно создал другой заказ,
+    уникальный индекс отклоняет вставку и заказ прибавляется к уже созданной строке.
+    """
     try:
-        task_chain = (
-                calculate_shift_end_time.s(shift_id) |
-                count_num_ended_orders.s() |
-                calculate_shift_time_total.s() |
-                calculate_total_bugs_time.s() |
-                calculate_good_time.s() |
-                calculate_bad_time.s() |
-                calculate_lost_time.s()
-        )
-        # Запуск цепочки задач
-        task_chain.apply_async()
-        return shift_id
-    except Exception as e:
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in count_and_end_shift: {e}")
+        with transaction.atomic():
+            for granularity, _ in ProductionRollupModel.GRANULARITY_CHOICES:
+                for keys, values in _rollup_rows(OrdersModel.objects.filter(id=order.id), granularity):
+                    rollup = ProductionRollupModel.objects.filter(**keys)
+                    increments = {name: F(name) + value for name, value in values.items()}
+                    if rollup.update(**increments):
+                        continue
+                    try:
+                        with transaction.atomic():
+                            ProductionRollupModel.objects.create(**keys, **values)
+                    except IntegrityError:
+                        rollup.update(**increments)
+
+        logger.info('order_added_to_rollups', order=order.id)
+
+        return order
+
+    except Exception:
+        logger.exception('add_order_to_rollups_failed')
+        # Вернуть None в случае ошибки
+        return None
+
+
+def parse_local_datetime(value):
+    """
+    Разбирает время ISO 8601. Время без часового пояса считается локальным (TIME_ZONE).
+
+    Returns:
+        datetime | None: Время с часовым поясом, либо None, если строка не разбирается.
+    """
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+@timed
+def rebuild_rollups(since=None, batch_size=1000):
+    """
+    Пересчитывает итоги с нуля по заказам, завершенным начиная с since (по умолчанию - за все время).
+
+    Периоды, в которые попадает since, пересчитываются целиком. since без часового пояса
+    считается локальным временем.
+
+    Returns:
+        int: Количество записанных строк итогов, либо None в случае ошибки.
+    """
+    if since is not None and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    try:
+        created = 0
+        with transaction.atomic():
+            for granularity, _ in ProductionRollupModel.GRANULARITY_CHOICES:
+                rollups = ProductionRollupModel.objects.filter(granularity=granularity)
+                orders = OrdersModel.objects.all()
+                if since is not None:
+                    period_start = timezone.localtime(since).replace(minute=0, second=0, microsecond=0)
+                    if granularity == ProductionRollupModel.DAY:
+                        period_start = period_start.replace(hour=0)
+                    rollups = rollups.filter(period_start__gte=period_start)
+                    orders = orders.filter(end_working_time__gte=period_start)
+
+                rollups.delete()
+                objects = [
+                    ProductionRollupModel(**keys, **values) for keys, values in _rollup_rows(orders, granularity)
+                ]
+                ProductionRollupModel.objects.bulk_create(objects, batch_size=batch_size)
+                created += len(objects)
+
+        logger.info('rollups_rebuilt', rows=created, since=since)
+
+        return created
+
+    except Exception:
+        logger.exception('rebuild_rollups_failed')
+        # Вернуть None в случае ошибки
+        return None
+
+
+def get_rollups(granularity=ProductionRollupModel.DAY, since=None, until=None, group_by=ROLLUP_DIMENSIONS,
+                **filters):
+    """
+    Читает итоги производства.
+
+    Parameters:
+        granularity (str): 'hour' или 'day'.
+        since (datetime | None): Начало интервала, включительно.
+        until (datetime | None): Конец интервала, не включительно.
+        group_by (Iterable[str]): Разрезы из ROLLUP_DIMENSIONS, по остальным итоги суммируются.
+        **filters: Фильтры по разрезам, например machine_id=1.
+
+    Returns:
+        QuerySet: Словари с period_start, разрезами group_by и метриками ROLLUP_METRICS.
+    """
+    rollups = ProductionRollupModel.objects.filter(granularity=granularity, **filters)
+    if since is not None:
+        rollups = rollups.filter(period_start__gte=since)
+    if until is not None:
+        rollups = rollups.filter(period_start__lt=until)
+    return rollups.values('period_start', *group_by).annotate(
+        **{name: Sum(name) for name in ROLLUP_METRICS}
+    ).order_by('period_start', *group_by)
@@ -0,0 +1,211 @@
+import csv
+import datetime
+import gzip
+import json
+import os
+
+import xlsxwriter
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.log import get_logger
+
+logger = get_logger(__name__)
+
+EXPORT_FORMATS = ('xlsx', 'csv', 'jsonl')
+
+# Максимум строк на листе Excel, дальше модель продолжается на следующем листе
+XLSX_MAX_ROWS = 1048575
+
+
+def export_models():
+    """
+    Модели приложения core в порядке объявления, включая промежуточные таблицы ManyToMany.
+    """
+    models = []
+    for model in apps.get_app_config('core').get_models():
+        models.append(model)
+        for field in model._meta.local_many_to_many:
+            models.append(field.remote_field.through)
+    return models
+
+
+def model_label(model):
+    return model._meta.label_lower
+
+
+def model_columns(model):
+    """
+    Возвращает (заголовки, attname) конкретных полей модели, первичный ключ первым.
+    """
+    fields = [model._meta.pk] + [field for field in model._meta.concrete_fields if not field.primary_key]
+    return [field.name for field in fields], [field.attname for field in fields]
+
+
+def iter_rows(queryset, attnames, chunk_size):
+    return queryset.order_by('pk').values_list(*attnames).iterator(chunk_size=chunk_size)
+
+
+def json_cell(value):
+    """
+    Значение JSONField (dict или list) для ячейки xlsx и csv - строка JSON, остальные без изменений.
+    """
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=DjangoJSONEncoder, ensure_ascii=False)
+    return value
+
+
+class XlsxSink:
+    """
+    Пишет каждую модель на свой лист. constant_memory сбрасывает строки на диск
+    по мере записи, поэтому память не растет с размером таблицы.
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, 'core.xlsx')
+        self.workbook = xlsxwriter.Workbook(self.path, {'constant_memory': True, 'remove_timezone': True})
+        self.datetime_format = self.workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+        self.duration_format = self.workbook.add_format({'num_format': '[h]:mm:ss'})
+
+    def start(self, label, headers):
+        self.label = label
+        self.headers = headers
+        self.sheet_number = 0
+        self._add_sheet()
+
+    def write(self, row):
+        if self.row_number > XLSX_MAX_ROWS:
+            self._add_sheet()
+        for column, value in enumerate(row):
+            if isinstance(value, datetime.datetime):
+                self.sheet.write_datetime(self.row_number, column, value, self.datetime_format)
+            elif isinstance(value, datetime.timedelta):
+                self.sheet.write_datetime(self.row_number, column, value, self.duration_format)
+            else:
+                self.sheet.write(self.row_number, column, json_cell(value))
+        self.row_number += 1
+
+    def finish(self):
+        pass
+
+    def close(self):
+        self.workbook.close()
+        return [self.path]
+
+    def _add_sheet(self):
+        self.sheet_number += 1
+        name = self.label if self.sheet_number == 1 else f'{self.label[:27]}_{self.sheet_number}'
+        self.sheet = self.workbook.add_worksheet(name[:31])
+        self.sheet.write_row(0, 0, self.headers)
+        self.row_number = 1
+
+
+class CsvSink:
+    def __init__(self, directory):
+        self.directory = directory
+        self.paths = []
+
+    def start(self, label, headers):
+        path = os.path.join(self.directory, f'{label}.csv')
+        self.paths.append(path)
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(headers)
+
+    def write(self, row):
+        self.writer.writerow([json_cell(value) for value in row])
+
+    def finish(self):
+        self.file.close()
+
+    def close(self):
+        return self.paths
+
+
+class JsonlSink:
+    def __init__(self, directory, compress=False):
+        self.directory = directory
+        self.compress = compress
+        self.paths = []
+
+    def start(self, label, headers):
+        if self.compress:
+            path = os.path.join(self.directory, f'{label}.jsonl.gz')
+            self.file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            path = os.path.join(self.directory, f'{label}.jsonl')
+            self.file = open(path, 'w', encoding='utf-8')
+        self.paths.append(path)
+        self.headers = headers
+
+    def write(self, row):
+        self.file.write(json.dumps(dict(zip(self.headers, row)), cls=DjangoJSONEncoder, ensure_ascii=False))
+        self.file.write('\n')
+
+    def finish(self):
+        self.file.close()
+
+    def close(self):
+        return self.paths
+
+
+SINKS = {
+    'xlsx': XlsxSink,
+    'csv': CsvSink,
+    'jsonl': JsonlSink,
+    'jsonl.gz': lambda directory: JsonlSink(directory, compress=True),
+}
+
+
+def export_data(directory, formats=EXPORT_FORMATS, chunk_size=2000, progress=None, querysets=None):
+    """
+    Потоково выгружает все модели core в directory.
+
+    Строки читаются через .iterator(chunk_size) и сразу пишутся во все форматы,
+    таблица целиком в памяти не держится.
+
+    Parameters:
+        directory (str): Каталог выгрузки, создается при необходимости.
+        formats (Iterable[str]): Форматы из EXPORT_FORMATS.
+        chunk_size (int): Количество строк, читаемых из БД за раз.
+        progress (callable | None): Вызывается как progress(label, rows_done, rows_total).
+        querysets (dict | None): Модель -> QuerySet, чтобы выгрузить только часть строк.
+            Остальные модели выгружаются целиком.
+
+    Returns:
+        list[str]: Пути созданных файлов.
+    """
+    os.makedirs(directory, exist_ok=True)
+    sinks = [SINKS[name](directory) for name in formats]
+
+    querysets = querysets or {}
+    models = export_models()
+    rows_done = 0
+    rows_total = sum(querysets.get(model, model._default_manager.all()).count() for model in models)
+
+    for model in models:
+        label = model_label(model)
+        headers, attnames = model_columns(model)
+        queryset = querysets.get(model, model._default_manager.all())
+        for sink in sinks:
+            sink.start(label, headers)
+
+        for row in iter_rows(queryset, attnames, chunk_size):
+            for sink in sinks:
+                sink.write(row)
+            rows_done += 1
+            if progress is not None and rows_done % chunk_size == 0:
+                progress(label, rows_done, rows_total)
+
+        for sink in sinks:
+            sink.finish()
+        if progress is not None:
+            progress(label, rows_done, rows_total)
+
+    paths = []
+    for sink in sinks:
+        paths.extend(sink.close())
+
+    logger.info('data_exported', rows=rows_done, directory=directory)
+
+    return paths
@@ -0,0 +1,113 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+from django.db import models
+
+
+def get_logger(name):
+    return EventLogger(logging.getLogger(name))
+
+
+class EventLogger:
+    """
+    Логгер структурированных событий: короткое имя события и поля ключ=значение.
+
+    Запись создается, только если уровень включен, а поля сериализуются в JSON уже в потоке
+    QueueListener. Поэтому в поля передаются ID и простые значения: для объектов моделей
+    пишется только pk, чтобы запись в лог не обращалась к БД.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def log(self, level, event, exc_info=False, **fields):
+        if self.logger.isEnabledFor(level):
+            # stacklevel указывает на вызывающую функцию, а не на методы EventLogger
+            self.logger.log(level, event, exc_info=exc_info, extra={'fields': fields}, stacklevel=3)
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+    def exception(self, event, **fields):
+        self.log(logging.ERROR, event, exc_info=True, **fields)
+
+
+def _json_default(value):
+    if isinstance(value, models.Model):
+        return value.pk
+    return str(value)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна JSON-строка на запись: время, уровень, логгер, функция, событие и его поля.
+    """
+
+    def format(self, record):
+        data = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'func': record.funcName,
+            'event': record.getMessage(),
+            **getattr(record, 'fields', {}),
+        }
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=_json_default)
+
+
+class BackgroundStreamHandler(QueueHandler):
+    """
+    Кладет записи в очередь, а пишет их в stderr отдельный поток QueueListener.
+
+    Поток запроса только добавляет запись в очередь: форматирование и запись
+    в поток вывода выполняются в фоне. После fork (воркеры gunicorn и celery)
+    в дочернем процессе запускается свой QueueListener.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.listener = None
+        super().__init__(queue.SimpleQueue())
+        self._start()
+        atexit.register(self._stop)
+        os.register_at_fork(after_in_child=self._start)
+
+    def prepare(self, record):
+        # Слушатель работает в этом же процессе: запись не сериализуется,
+        # поэтому трассировка и поля форматируются уже в его потоке.
+        # Аргументы сторонних сообщений подставляются сразу, пока объекты не изменились
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def _start(self):
+        self.queue = queue.SimpleQueue()
+        target = logging.StreamHandler(self.stream)
+        target.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, target)
+        self.listener.start()
+
+    def _stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
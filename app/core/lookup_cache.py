@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from core.models import RoleModel, WorkingAreaModel, PositionsModel, MachineTypesModel, MachineModel, CustomUserModel
+
+# Справочники, которые почти не меняются и нужны почти на каждой странице
+LOOKUP_MODELS = (RoleModel, WorkingAreaModel, PositionsModel, MachineTypesModel)
+
+
+def lookup_key(model, pk):
+    return f'core:{model._meta.model_name}:{pk}'
+
+
+def user_machines_key(custom_user_id):
+    return f'core:user_machines:{custom_user_id}'
+
+
+def get_lookup(model, pk):
+    """
+    Запись справочника по первичному ключу: из кэша, при промахе - из БД.
+    """
+    key = lookup_key(model, pk)
+    instance = cache.get(key)
+    if instance is None:
+        instance = model._default_manager.get(pk=pk)
+        cache.set(key, instance, settings.LOOKUP_CACHE_TTL)
+    return instance
+
+
+def get_user_machine_ids(custom_user_id):
+    """
+    ID станков, закрепленных за пользователем.
+    """
+    key = user_machines_key(custom_user_id)
+    machine_ids = cache.get(key)
+    if machine_ids is None:
+        machine_ids = list(CustomUserModel.machine.through.objects.filter(
+            customusermodel_id=custom_user_id
+        ).values_list('machinemodel_id', flat=True))
+        cache.set(key, machine_ids, settings.LOOKUP_CACHE_TTL)
+    return machine_ids
+
+
+def get_user_machines(custom_user_id):
+    """
+    Станки пользователя вместе с типом и текущим заказом одним запросом.
+
+    Список станков берется из кэша, а состояние (сломан, в работе) всегда читается из БД:
+    оно меняется условными UPDATE, которые не отправляют сигналов.
+    """
+    return MachineModel.objects.filter(
+        id__in=get_user_machine_ids(custom_user_id)
+    ).select_related('machine_type', 'order_in_progress').order_by('id')
+
+
+def invalidate_lookup(sender, instance, **kwargs):
+    cache.delete(lookup_key(sender, instance.pk))
+
+
+def invalidate_user_machines(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        custom_user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        custom_user_ids = list(instance.customusermodel_set.values_list('id', flat=True))
+    else:
+        custom_user_ids = pk_set
+    cache.delete_many([user_machines_key(custom_user_id) for custom_user_id in custom_user_ids])
+
+
+def connect_signals():
+    for model in LOOKUP_MODELS:
+        post_save.connect(invalidate_lookup, sender=model, dispatch_uid=f'lookup_cache_save_{model.__name__}')
+        post_delete.connect(invalidate_lookup, sender=model, dispatch_uid=f'lookup_cache_delete_{model.__name__}')
+    m2m_changed.connect(invalidate_user_machines, sender=CustomUserModel.machine.through,
+                        dispatch_uid='lookup_cache_user_machines')
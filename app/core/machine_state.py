@@ -0,0 +1,146 @@
+import json
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.utils import timezone
+
+from core.log import get_logger
+from core.models import MachineModel
+
+logger = get_logger(__name__)
+
+# Хэш machine_id -> JSON состояния станка и канал, в который публикуется каждое изменение
+MACHINE_STATE_KEY = 'machines:state'
+MACHINE_STATE_CHANNEL = 'machines:events'
+# Отметка о том, что хэш заполнен из БД. Без нее хэш может содержать только станки,
+# опубликованные через publish
+MACHINE_STATE_READY_KEY = 'machines:ready'
+
+
+def machine_state(machine):
+    return {
+        'id': machine.id,
+        'name': machine.machine_name,
+        'is_broken': machine.is_broken,
+        'is_in_progress': machine.is_in_progress,
+        'order_id': machine.order_in_progress_id,
+        'updated_at': timezone.now().isoformat(),
+    }
+
+
+class MachineStateCache:
+    """
+    Состояние станков в Redis для табло цеха.
+
+    Функции, меняющие станок, записывают его состояние сюда сразу после сохранения в БД
+    и публикуют в канал MACHINE_STATE_CHANNEL. Табло читают снимок и подписку,
+    поэтому число экранов не влияет на нагрузку на БД. Без redis_url кэш выключен,
+    а снимок читается из БД.
+    """
+
+    def __init__(self, redis_url=None):
+        self.redis_url = redis_url
+        self._redis = redis.Redis.from_url(redis_url) if redis_url else None
+
+    @property
+    def enabled(self):
+        return self._redis is not None
+
+    def publish(self, machine):
+        if self._redis is None:
+            return
+        state = json.dumps(machine_state(machine), ensure_ascii=False)
+        try:
+            pipe = self._redis.pipeline()
+            pipe.hset(MACHINE_STATE_KEY, machine.id, state)
+            pipe.publish(MACHINE_STATE_CHANNEL, state)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning('machine_state_redis_error', error=str(e))
+
+    def publish_machine(self, machine_id):
+        """
+        Публикует текущее состояние станка из БД. Без Redis ничего не читает.
+        """
+        if self._redis is None:
+            return
+        self.publish(MachineModel.objects.get(id=machine_id))
+
+    def remove(self, machine_id):
+        """
+        Убирает удаленный станок из хэша и публикует {'id': machine_id, 'deleted': True}.
+        """
+        if self._redis is None:
+            return
+        try:
+            pipe = self._redis.pipeline()
+            pipe.hdel(MACHINE_STATE_KEY, machine_id)
+            pipe.publish(MACHINE_STATE_CHANNEL, json.dumps({'id': machine_id, 'deleted': True}))
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning('machine_state_redis_error', error=str(e))
+
+    def snapshot(self):
+        """
+        Состояния всех станков, отсортированные по ID.
+
+        Пока нет отметки MACHINE_STATE_READY_KEY, хэш заполняется из БД одним запросом.
+        HSETNX не перезаписывает состояния, успевшие прийти через publish.
+        """
+        if self._redis is None:
+            return self._load()
+        try:
+            if not self._redis.exists(MACHINE_STATE_READY_KEY):
+                self._warm_up()
+            states = self._redis.hvals(MACHINE_STATE_KEY)
+        except redis.RedisError as e:
+            logger.warning('machine_state_redis_error', error=str(e))
+            return self._load()
+        return sorted((json.loads(state) for state in states), key=lambda state: state['id'])
+
+    async def changes(self, heartbeat):
+        """
+        Асинхронно отдает изменения состояний из канала MACHINE_STATE_CHANNEL.
+
+        Если за heartbeat секунд изменений не было, отдает None, чтобы поток
+        мог отправить keep-alive и заметить отключение клиента.
+        """
+        client = aioredis.Redis.from_url(self.redis_url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(MACHINE_STATE_CHANNEL)
+            while True:
+                message = await pubsub.get_message(timeout=heartbeat)
+                if message is None:
+                    yield None
+                elif message['type'] == 'message':
+                    yield json.loads(message['data'])
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.close()
+            await client.close()
+
+    def _warm_up(self):
+        pipe = self._redis.pipeline()
+        for state in self._load():
+            pipe.hsetnx(MACHINE_STATE_KEY, state['id'], json.dumps(state, ensure_ascii=False))
+        pipe.set(MACHINE_STATE_READY_KEY, 1)
+        pipe.execute()
+        logger.info('machine_state_warmed_up')
+
+    @staticmethod
+    def _load():
+        return [machine_state(machine) for machine in MachineModel.objects.order_by('id')]
+
+
+machine_state_cache = MachineStateCache(settings.MACHINE_STATE_REDIS_URL)
+
+
+def remove_deleted_machine(sender, instance, **kwargs):
+    machine_state_cache.remove(instance.id)
+
+
+def connect_signals():
+    post_delete.connect(remove_deleted_machine, sender=MachineModel, dispatch_uid='machine_state_delete')
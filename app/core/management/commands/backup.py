@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.backup import run_backup
+
+
+class Command(BaseCommand):
+    help = ('Полный или инкрементальный бэкап в BACKUP_DIR/snapshots. '
+            'По умолчанию полный делается раз в BACKUP_FULL_EVERY запусков, остальные - инкрементальные.')
+
+    def add_arguments(self, parser):
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument('--full', action='store_const', const='full', dest='mode', help='Полный бэкап')
+        mode.add_argument('--incremental', action='store_const', const='incremental', dest='mode',
+                          help='Только изменения с предыдущего бэкапа')
+        parser.add_argument('--dir', help='Каталог бэкапов')
+
+    def handle(self, *args, **options):
+        try:
+            entry = run_backup(options['mode'] or 'auto', options['dir'])
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(f'Бэкап {entry["name"]} ({entry["type"]}) записан'))
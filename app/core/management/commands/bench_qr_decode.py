@@ -0,0 +1,62 @@
+import statistics
+import time
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+from django.core.management.base import BaseCommand, CommandError
+from pyzbar.pyzbar import decode
+
+from core.management.commands.bench_workflow import percentile
+from core.qr import decode_image
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.webp'}
+
+
+def decode_image_legacy(image_data):
+    """
+    Прежний способ: полный кадр, растянутый до 500x500, одна попытка.
+    """
+    decoded_qr_img = decode(Image.open(BytesIO(image_data)).resize((500, 500)))
+    return decoded_qr_img[0].data.decode('utf-8') if decoded_qr_img else None
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет распознавание QR по каталогу фотографий и выводит долю распознанных и p50/p95. '
+            'Если рядом с фото лежит файл <имя>.txt, его содержимое считается ожидаемым значением.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help='Каталог с фотографиями QR кодов')
+        parser.add_argument('--repeat', type=int, default=3, help='Сколько раз распознавать каждое фото')
+
+    def handle(self, *args, **options):
+        corpus = sorted(p for p in Path(options['corpus']).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+        if not corpus:
+            raise CommandError(f'В каталоге {options["corpus"]} нет фотографий')
+
+        samples = []
+        for path in corpus:
+            expected_path = path.with_suffix('.txt')
+            expected = expected_path.read_text(encoding='utf-8').strip() if expected_path.exists() else None
+            samples.append((path.read_bytes(), expected))
+
+        for name, func in (('legacy', decode_image_legacy), ('pipeline', decode_image)):
+            self._report(name, func, samples, options['repeat'])
+
+    def _report(self, name, func, samples, repeat):
+        timings = []
+        decoded = 0
+        for image_data, expected in samples:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                result = func(image_data)
+                timings.append(time.perf_counter() - started)
+            if result is not None and (expected is None or result == expected):
+                decoded += 1
+
+        timings.sort()
+        p95 = percentile(timings, 0.95)
+        self.stdout.write(
+            f'{name:>8}: распознано {decoded}/{len(samples)} ({decoded / len(samples):.0%}) | '
+            f'p50 {statistics.median(timings) * 1000:.1f} ms | p95 {p95 * 1000:.1f} ms'
+        )
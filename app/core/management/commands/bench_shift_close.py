@@ -0,0 +1,100 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.buisness import (
+    finalize_shift, calculate_shift_end_time, count_num_ended_orders, calculate_shift_time_total,
+    calculate_total_bugs_time, calculate_good_time, calculate_bad_time, calculate_lost_time,
+)
+from core.models import (
+    CustomUserModel, RoleModel, PositionsModel, WorkingAreaModel, ShiftModel, OrdersModel,
+)
+
+LEGACY_CHAIN = (
+    calculate_shift_end_time,
+    count_num_ended_orders,
+    calculate_shift_time_total,
+    calculate_total_bugs_time,
+    calculate_good_time,
+    calculate_bad_time,
+    calculate_lost_time,
+)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает закрытие смены цепочкой из семи задач и finalize_shift. '
+            'Данные создаются во временной транзакции и откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200, help='Количество заказов в смене')
+        parser.add_argument('--runs', type=int, default=20, help='Количество прогонов каждого варианта')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            shift = self._seed(options['orders'])
+            legacy = self._measure(self._run_legacy, shift, options['runs'])
+            engine = self._measure(finalize_shift, shift, options['runs'])
+            transaction.set_rollback(True)
+
+        for name, (timings, queries) in (('chain', legacy), ('finalize_shift', engine)):
+            self.stdout.write(
+                f'{name:>15}: p50 {statistics.median(timings) * 1000:.2f} ms | '
+                f'max {max(timings) * 1000:.2f} ms | {queries} queries'
+            )
+        self.stdout.write('Время цепочки не включает обращения к брокеру между задачами.')
+
+    @staticmethod
+    def _run_legacy(shift_id):
+        for task in LEGACY_CHAIN:
+            task(shift_id)
+
+    @staticmethod
+    def _measure(func, shift, runs):
+        timings = []
+        queries = 0
+        for _ in range(runs):
+            # Каждый прогон начинается с открытой смены
+            ShiftModel.objects.filter(id=shift.id).update(end_time=None, bad_time=None)
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                func(shift.id)
+                timings.append(time.perf_counter() - started)
+            queries = len(ctx.captured_queries)
+        return timings, queries
+
+    @staticmethod
+    def _seed(num_orders):
+        user = User.objects.create_user(username=f'bench_{time.time_ns()}')
+        custom_user = CustomUserModel.objects.create(
+            user=user,
+            phone_number=user.username,
+            role=RoleModel.objects.create(role_name='worker'),
+            position=PositionsModel.objects.create(position_name='bench', chill_time=timedelta(minutes=30)),
+            working_area=WorkingAreaModel.objects.create(area_name='bench'),
+        )
+        shift = ShiftModel.objects.create(user=custom_user)
+        now = timezone.now()
+        OrdersModel.objects.bulk_create([
+            OrdersModel(
+                user=custom_user,
+                related_to_shift=shift,
+                part_name=f'bench-{i}',
+                num_parts=i % 10 + 1,
+                start_time=now,
+                scan_time=now,
+                start_working_time=now + timedelta(minutes=1),
+                machine_start_time=now + timedelta(minutes=5),
+                machine_end_time=now + timedelta(minutes=25),
+                end_working_time=now + timedelta(minutes=30),
+                bugs_time=timedelta(minutes=i % 3),
+                ended_early=i % 7 == 0,
+            )
+            for i in range(num_orders)
+        ])
+        return shift
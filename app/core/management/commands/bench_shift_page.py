@@ -0,0 +1,83 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections, close_old_connections
+from django.test import Client
+from django.urls import reverse
+
+from core.management.commands.bench_workflow import percentile
+from core.models import (
+    CustomUserModel, RoleModel, PositionsModel, WorkingAreaModel, MachineTypesModel, MachineModel, ShiftModel,
+)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает p50/p99 страницы /shift/ с новым соединением к БД на каждый запрос '
+            'и с постоянным соединением (CONN_MAX_AGE). Запросы идут через тестовый клиент Django '
+            'в этом процессе. Данные создаются в БД и удаляются после замера.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Количество запросов для каждого варианта')
+        parser.add_argument('--max-age', type=int, default=600, help='CONN_MAX_AGE постоянного варианта')
+
+    def handle(self, *args, **options):
+        connection = connections['default']
+        conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        user, objects = self._seed()
+        try:
+            client = Client()
+            client.force_login(user)
+            url = reverse('shift_main_page')
+            for name, max_age in (('CONN_MAX_AGE=0', 0), (f'CONN_MAX_AGE={options["max_age"]}', options['max_age'])):
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                # Прогрев: шаблоны, кэш url и первое соединение не входят в замер
+                client.get(url)
+                timings = []
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    # Тестовый клиент отключает закрытие соединений по сигналам запроса,
+                    # поэтому обработчики сервера вызываются вручную
+                    close_old_connections()
+                    response = client.get(url)
+                    close_old_connections()
+                    timings.append(time.perf_counter() - started)
+                    assert response.status_code == 200, response.status_code
+                timings.sort()
+                self.stdout.write(
+                    f'{name:>18}: p50 {statistics.median(timings) * 1000:.2f} ms | '
+                    f'p99 {percentile(timings, 0.99) * 1000:.2f} ms'
+                )
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+            user.delete()
+            for obj in objects:
+                obj.delete()
+
+    @staticmethod
+    def _seed():
+        user = User.objects.create_user(username=f'bench_{time.time_ns()}')
+        objects = [
+            RoleModel.objects.create(role_name='worker'),
+            PositionsModel.objects.create(position_name='bench', chill_time=timedelta(minutes=30)),
+            WorkingAreaModel.objects.create(area_name='bench'),
+            MachineTypesModel.objects.create(machine_type='bench'),
+        ]
+        role, position, working_area, machine_type = objects
+        custom_user = CustomUserModel.objects.create(
+            id=user.id,
+            user=user,
+            phone_number=user.username,
+            role=role,
+            position=position,
+            working_area=working_area,
+        )
+        custom_user.machine.add(*[
+            MachineModel.objects.create(machine_type=machine_type, machine_name=f'bench-{i}') for i in range(5)
+        ])
+        shift = ShiftModel.objects.create(user=custom_user)
+        CustomUserModel.objects.filter(id=custom_user.id).update(current_shift=shift)
+        return user, objects
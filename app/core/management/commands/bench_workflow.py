@@ -0,0 +1,187 @@
+import json
+import math
+import statistics
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.lookup_cache import lookup_key, user_machines_key
+from core.models import (
+    CustomUserModel, RoleModel, PositionsModel, WorkingAreaModel, MachineTypesModel, MachineModel,
+)
+
+# Шаги заказа после выбора станка: страница и данные формы
+ORDER_STEPS = (
+    ('shift_scan_page', {'partname': 'bench-part'}),
+    ('shift_qauntity_page', {'quantity': '10'}),
+    ('shift_setup_page', {}),
+    ('shift_processing_page', {}),
+    ('shift_ending_page', {}),
+)
+
+
+def percentile(values, q):
+    """
+    Перцентиль по ближайшему рангу для отсортированного списка values.
+    """
+    return values[min(math.ceil(len(values) * q), len(values)) - 1]
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет полный цикл оператора через тестовый клиент Django: начало смены, '
+            'заказы scan -> quantity -> setup -> processing -> ending и закрытие смены. '
+            'Печатает запросы в секунду, p50/p95/p99 и SQL-запросы на запрос по каждому view '
+            'и сохраняет результат в JSON. С --baseline завершается ошибкой, если у какого-либо view '
+            'p95 вырос больше допустимого или стало больше SQL-запросов. Данные создаются во временной '
+            'транзакции и откатываются. Параллельную нагрузку на запущенный сервер дает loadtest.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Количество операторов')
+        parser.add_argument('--machines', type=int, default=3, help='Количество станков у оператора')
+        parser.add_argument('--orders', type=int, default=10, help='Количество заказов у оператора за смену')
+        parser.add_argument('--output', help='Файл для результата в JSON')
+        parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Допустимый рост p95 относительно --baseline, доля')
+
+    def handle(self, *args, **options):
+        timings = defaultdict(list)
+        queries = defaultdict(list)
+
+        with transaction.atomic():
+            users, lookups = self._seed(options['users'], options['machines'])
+            started = time.perf_counter()
+            for user, machine_ids in users:
+                self._run_shift(user, machine_ids, options['orders'], timings, queries)
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        # Откаченные ID могут быть выданы снова, кэш по ним не должен пережить прогон
+        cache.delete_many([user_machines_key(user.id) for user, _ in users] +
+                          [lookup_key(type(obj), obj.pk) for obj in lookups])
+
+        result = self._summary(options, timings, queries, elapsed)
+        self._print(result)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(result, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результат сохранен в {options["output"]}')
+        if options['baseline']:
+            self._compare(result, options['baseline'], options['max_regression'])
+
+    @staticmethod
+    def _seed(users_count, machines_count):
+        stamp = time.time_ns()
+        lookups = [
+            RoleModel.objects.create(role_name='worker'),
+            PositionsModel.objects.create(position_name='bench', chill_time=timedelta(minutes=30)),
+            WorkingAreaModel.objects.create(area_name='bench'),
+            MachineTypesModel.objects.create(machine_type='bench'),
+        ]
+        role, position, working_area, machine_type = lookups
+        users = []
+        for i in range(users_count):
+            user = User.objects.create_user(username=f'bench_{stamp}_{i}')
+            custom_user = CustomUserModel.objects.create(
+                id=user.id,
+                user=user,
+                phone_number=user.username,
+                role=role,
+                position=position,
+                working_area=working_area,
+            )
+            machines = MachineModel.objects.bulk_create([
+                MachineModel(machine_type=machine_type, machine_name=f'bench-{i}-{j}') for j in range(machines_count)
+            ])
+            custom_user.machine.add(*machines)
+            users.append((user, [machine.id for machine in machines]))
+        return users, lookups
+
+    def _run_shift(self, user, machine_ids, orders, timings, queries):
+        client = Client()
+        client.force_login(user)
+
+        self._request(client, 'post', 'main', {'start_shift': ''}, timings, queries)
+        for i in range(orders):
+            machine_id = str(machine_ids[i % len(machine_ids)])
+            self._request(client, 'get', 'shift_main_page', None, timings, queries)
+            self._request(client, 'post', 'shift_main_page',
+                          {'selected_machine_id': machine_id, 'start_new': ''}, timings, queries)
+            for url_name, data in ORDER_STEPS:
+                self._request(client, 'get', url_name, None, timings, queries)
+                self._request(client, 'post', url_name, data, timings, queries)
+        self._request(client, 'post', 'shift_main_page',
+                      {'selected_machine_id': str(machine_ids[0]), 'end_shift': ''}, timings, queries)
+
+    @staticmethod
+    def _request(client, method, url_name, data, timings, queries):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = getattr(client, method)(reverse(url_name), data)
+            elapsed = time.perf_counter() - started
+        # Успешный POST шага всегда заканчивается редиректом на следующую страницу
+        expected = 302 if method == 'post' else 200
+        if response.status_code != expected:
+            raise CommandError(f'{method.upper()} {url_name}: {response.status_code} вместо {expected}')
+        key = f'{method.upper()} {url_name}'
+        timings[key].append(elapsed)
+        queries[key].append(len(ctx.captured_queries))
+
+    @staticmethod
+    def _summary(options, timings, queries, elapsed):
+        total = sum(len(values) for values in timings.values())
+        views = {}
+        for key in sorted(timings):
+            values = sorted(timings[key])
+            views[key] = {
+                'requests': len(values),
+                'p50_ms': round(statistics.median(values) * 1000, 3),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+                'queries_per_request': round(statistics.mean(queries[key]), 2),
+            }
+        return {
+            'started_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'users': options['users'],
+            'machines': options['machines'],
+            'orders': options['orders'],
+            'requests': total,
+            'duration_s': round(elapsed, 3),
+            'requests_per_second': round(total / elapsed, 1),
+            'views': views,
+        }
+
+    def _print(self, result):
+        self.stdout.write(f'{"view":>32} {"reqs":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8}')
+        for key, view in result['views'].items():
+            self.stdout.write(
+                f'{key:>32} {view["requests"]:>6} {view["p50_ms"]:>8.2f} {view["p95_ms"]:>8.2f} '
+                f'{view["p99_ms"]:>8.2f} {view["queries_per_request"]:>8.2f}'
+            )
+        self.stdout.write(f'{result["requests"]} запросов за {result["duration_s"]:.2f} с, '
+                          f'{result["requests_per_second"]} запросов в секунду ({result["database"]})')
+
+    def _compare(self, result, path, max_regression):
+        with open(path) as file:
+            baseline = json.load(file)
+        regressions = []
+        for key, view in result['views'].items():
+            previous = baseline.get('views', {}).get(key)
+            if previous and view['p95_ms'] > previous['p95_ms'] * (1 + max_regression):
+                regressions.append(f'{key}: p95 {previous["p95_ms"]:.2f} -> {view["p95_ms"]:.2f} ms')
+            if previous and view['queries_per_request'] > previous['queries_per_request']:
+                regressions.append(f'{key}: SQL-запросов {previous["queries_per_request"]} -> '
+                                   f'{view["queries_per_request"]}')
+        if regressions:
+            raise CommandError('Регрессия относительно ' + path + ':\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f'Регрессий относительно {path} нет'))
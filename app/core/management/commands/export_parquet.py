@@ -0,0 +1,26 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.parquet_export import export_parquet
+
+
+class Command(BaseCommand):
+    help = ('Выгружает заказы, смены и проблемы в Parquet, '
+            'разбитые по месяцу и рабочему месту, для аналитики.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Каталог выгрузки, по умолчанию BACKUP_DIR/parquet/<дата>')
+        parser.add_argument('--since', help='Только записи, начатые не раньше этого момента (ISO 8601)')
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Количество строк в одной пачке')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or os.path.join(
+            settings.BACKUP_DIR, 'parquet', timezone.now().strftime('%Y-%m-%d_%H%M%S')
+        )
+        since = parse_datetime(options['since']) if options['since'] else None
+        paths = export_parquet(directory, options['chunk_size'], since)
+        self.stdout.write(self.style.SUCCESS(f'Записано файлов: {len(paths)} в {directory}'))
@@ -0,0 +1,96 @@
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.management.commands.bench_workflow import percentile
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест одного адреса: для каждого уровня параллельности открывает столько '
+            'одновременных клиентов и печатает запросы в секунду, задержки и коды ответов. '
+            'Чтобы сравнить емкость одного воркера, запустите сервер с -w 1 в двух вариантах: '
+            '"gunicorn hello_django.wsgi:application" и '
+            '"gunicorn hello_django.asgi:application -k uvicorn.workers.UvicornWorker".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Адрес, например http://localhost:8000/qr-decoder/')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100],
+                            help='Уровни параллельности')
+        parser.add_argument('--requests', type=int, default=20, help='Количество запросов на одного клиента')
+        parser.add_argument('--file', help='Файл, отправляемый POST multipart/form-data')
+        parser.add_argument('--field', default='image', help='Имя поля для --file')
+        parser.add_argument('--cookie', action='append', default=[], help='Cookie name=value, можно несколько')
+        parser.add_argument('--header', action='append', default=[], help='Заголовок "Name: value", можно несколько')
+        parser.add_argument('--timeout', type=float, default=30, help='Таймаут одного запроса, секунды')
+
+    def handle(self, *args, **options):
+        headers = dict(header.split(': ', 1) for header in options['header'])
+        if options['cookie']:
+            headers['Cookie'] = '; '.join(options['cookie'])
+        body = None
+        if options['file']:
+            body, content_type = self._multipart(options['field'], options['file'])
+            headers['Content-Type'] = content_type
+
+        self.stdout.write(f'{"clients":>8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"max ms":>8}  статусы')
+        for concurrency in options['concurrency']:
+            latencies, statuses, elapsed = self._run(
+                options['url'], body, headers, concurrency, options['requests'], options['timeout']
+            )
+            latencies.sort()
+            p95 = percentile(latencies, 0.95) if latencies else 0
+            self.stdout.write(
+                f'{concurrency:>8} {len(latencies) / elapsed:>8.1f} '
+                f'{statistics.median(latencies) * 1000:>8.1f} {p95 * 1000:>8.1f} {latencies[-1] * 1000:>8.1f}  '
+                f'{dict(sorted(statuses.items()))}'
+            )
+
+    @staticmethod
+    def _run(url, body, headers, concurrency, requests_per_client, timeout):
+        latencies = []
+        statuses = Counter()
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(concurrency)
+
+        def client():
+            start_barrier.wait()
+            for _ in range(requests_per_client):
+                request = urllib.request.Request(url, data=body, headers=headers)
+                started = time.perf_counter()
+                try:
+                    with urllib.request.urlopen(request, timeout=timeout) as response:
+                        response.read()
+                        status = response.status
+                except urllib.error.HTTPError as e:
+                    status = e.code
+                except OSError as e:
+                    status = type(e).__name__
+                latency = time.perf_counter() - started
+                with lock:
+                    latencies.append(latency)
+                    statuses[status] += 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(client) for _ in range(concurrency)]:
+                future.result()
+        return latencies, statuses, time.perf_counter() - started
+
+    @staticmethod
+    def _multipart(field, path):
+        boundary = uuid.uuid4().hex
+        with open(path, 'rb') as file:
+            data = file.read()
+        body = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="upload"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+        return body, f'multipart/form-data; boundary={boundary}'
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.buisness import materialize_orders
+
+
+class Command(BaseCommand):
+    help = 'Восстанавливает колонки заказов из журнала событий и пересчитывает bad_time их смен.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order', type=int, action='append', dest='order_ids',
+                            help='ID заказа, можно указать несколько раз. По умолчанию - все заказы с событиями')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество заказов в одной пачке')
+
+    def handle(self, *args, **options):
+        updated = materialize_orders(options['order_ids'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Обновлено заказов: {updated}'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.buisness import rebuild_rollups, parse_local_datetime
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает часовые и дневные итоги производства по завершенным заказам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Пересчитать только начиная с этого момента (ISO 8601). '
+                                            'По умолчанию - за все время')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество строк в одной вставке')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_local_datetime(options['since'])
+            if since is None:
+                raise CommandError(f'Неверное время --since: {options["since"]}')
+        created = rebuild_rollups(since, options['batch_size'])
+        if created is None:
+            raise CommandError('Ошибка при пересчете итогов, подробности в логе')
+        self.stdout.write(self.style.SUCCESS(f'Записано строк итогов: {created}'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.buisness import recalculate_bad_time
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает bad_time и lost_time завершенных смен сгруппированными запросами по заказам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shift', type=int, action='append', dest='shift_ids',
+                            help='ID смены, можно указать несколько раз. По умолчанию - все смены')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество смен в одной пачке')
+
+    def handle(self, *args, **options):
+        updated = recalculate_bad_time(options['shift_ids'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано смен: {updated}'))
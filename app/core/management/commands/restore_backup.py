@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.backup import restore_backup
+
+
+class Command(BaseCommand):
+    help = 'Восстанавливает данные из последнего полного бэкапа и следующих за ним инкрементальных.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Каталог бэкапов')
+        parser.add_argument('--until', help='Имя последнего применяемого бэкапа из манифеста')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Количество строк в одной вставке')
+
+    def handle(self, *args, **options):
+        try:
+            applied = restore_backup(options['dir'], options['until'], options['chunk_size'])
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(f'Применены бэкапы: {", ".join(applied)}'))
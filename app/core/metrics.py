@@ -0,0 +1,154 @@
+import functools
+import glob
+import os
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+
+REQUEST_DURATION = Histogram(
+    'core_request_duration_seconds', 'Время обработки запроса',
+    ['view', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_QUERIES = Histogram(
+    'core_request_db_queries', 'Количество SQL-запросов за запрос',
+    ['view'],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 89),
+)
+REQUEST_DB_DURATION = Histogram(
+    'core_request_db_duration_seconds', 'Суммарное время SQL-запросов за запрос',
+    ['view'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+STEP_DURATION = Histogram(
+    'core_step_duration_seconds', 'Время выполнения шага работы или задачи закрытия смены',
+    ['step'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+# Считаются в DecodeCache. В режиме multiprocess значения всех процессов суммируются
+QR_CACHE_HITS = Counter('core_qr_decode_cache_hits', 'Попадания в кэш распознавания QR')
+QR_CACHE_MISSES = Counter('core_qr_decode_cache_misses', 'Промахи кэша распознавания QR')
+
+# [количество запросов, время в БД] текущего HTTP-запроса. ContextVar копируется
+# в потоки sync_to_async, поэтому запросы асинхронных view тоже учитываются
+_request_db_stats = ContextVar('request_db_stats', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Обертка выполнения SQL: считает запросы и их время для текущего HTTP-запроса.
+    """
+    stats = _request_db_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """
+    Обработчик connection_created: подключает count_queries к соединению один раз.
+    """
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def timed(func):
+    """
+    Пишет время выполнения функции в core_step_duration_seconds{step=<имя функции>}.
+    """
+    histogram = STEP_DURATION.labels(func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class MetricsMiddleware:
+    """
+    Время запроса, количество SQL-запросов и время в БД по имени маршрута.
+
+    Ставится первым в MIDDLEWARE, чтобы учитывать сессии и аутентификацию.
+    Запросы, не совпавшие ни с одним маршрутом, учитываются как view="unmatched".
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = [0, 0.0]
+        token = _request_db_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            _request_db_stats.reset(token)
+            self.observe(request, started, stats)
+
+    async def __acall__(self, request):
+        stats = [0, 0.0]
+        token = _request_db_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            _request_db_stats.reset(token)
+            self.observe(request, started, stats)
+
+    @staticmethod
+    def observe(request, started, stats):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name if match else None) or 'unmatched'
+        REQUEST_DURATION.labels(view, request.method).observe(time.perf_counter() - started)
+        REQUEST_QUERIES.labels(view).observe(stats[0])
+        REQUEST_DB_DURATION.labels(view).observe(stats[1])
+
+
+class MultiDirectoryCollector:
+    """
+    Метрики из файлов процессов в нескольких каталогах, объединенные как из одного.
+
+    У каждого сервиса свой PROMETHEUS_MULTIPROC_DIR, который он очищает при запуске,
+    не трогая файлы других сервисов.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def collect(self):
+        files = [file for path in self.paths for file in glob.glob(os.path.join(path, '*.db'))]
+        return multiprocess.MultiProcessCollector.merge(files, accumulate=True)
+
+
+def render_metrics():
+    """
+    Метрики в текстовом формате Prometheus.
+
+    Если задан PROMETHEUS_MULTIPROC_DIR, метрики собираются из файлов всех процессов
+    в каталогах PROMETHEUS_COLLECT_DIRS (через пробел, по умолчанию только свой каталог):
+    воркеров gunicorn и celery.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        paths = os.environ.get('PROMETHEUS_COLLECT_DIRS', os.environ['PROMETHEUS_MULTIPROC_DIR']).split()
+        registry = CollectorRegistry()
+        registry.register(MultiDirectoryCollector(paths))
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
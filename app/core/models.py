@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
 from django.db import models
@@ -75,7 +77,8 @@ class CustomUserModel(models.Model):
     working_area = models.ForeignKey(WorkingAreaModel,
                                      on_delete=models.CASCADE, verbose_name='Рабочее место')
     machine = models.ManyToManyField(MachineModel, blank=True, verbose_name='Станок')
-
+    current_shift = models.ForeignKey('ShiftModel', on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='+', verbose_name='Текущая смена')
 
     def __str__(self):
         return self.user.username
@@ -95,6 +98,7 @@ class ShiftModel(models.Model):
     bad_time = models.DurationField(blank=True, null=True, verbose_name='Бесполезное время')
     lost_time = models.DurationField(blank=True, null=True, verbose_name='Потерянное время')
     total_bugs_time = models.DurationField(blank=True, null=True, verbose_name='Общее время поломок')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменено')
 
     def formatted_start_time(self):
         return self.start_time.strftime('%Y-%m-%d %H:%M:%S') if self.start_time else None
@@ -111,6 +115,9 @@ class ShiftModel(models.Model):
     class Meta:
         verbose_name = 'Смена'
         verbose_name_plural = 'Смены'
+        indexes = [
+            models.Index(fields=['user', 'id'], name='shift_user_idx'),
+        ]
 
 
 class OrdersModel(models.Model):
@@ -131,6 +138,8 @@ class OrdersModel(models.Model):
     hold_started = models.DateTimeField(blank=True, null=True, verbose_name='Начало удержания')
     hold_url = models.CharField(max_length=256, blank=True, null=True, verbose_name='Ссылка на удержание')
     hold_ended = models.DateTimeField(blank=True, null=True, verbose_name='Конец удержания')
+    hold_time = models.DurationField(default=timedelta, verbose_name='Время удержания')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменено')
 
 
     def __str__(self):
@@ -144,6 +153,9 @@ class OrdersModel(models.Model):
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            models.Index(fields=['related_to_shift', 'machine', 'user', 'id'], name='order_shift_machine_user_idx'),
+        ]
 
 
 class ReportsModel(models.Model):
@@ -155,6 +167,7 @@ class ReportsModel(models.Model):
     end_time = models.DateTimeField(blank=True, null=True, verbose_name='Конец')
     is_solved = models.BooleanField(default=False, verbose_name='Решено?')
     url = models.CharField(max_length=128, blank=True, null=True, verbose_name='Откуда отправлен')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменено')
 
     def __str__(self):
         order_info = f'Order: {self.order.part_name}' if self.order else 'No associated order'
@@ -165,6 +178,9 @@ class ReportsModel(models.Model):
     class Meta:
         verbose_name = 'Сообщение о проблеме'
         verbose_name_plural = 'Сообщения о проблеме'
+        indexes = [
+            models.Index(fields=['order'], condition=models.Q(is_solved=False), name='report_unsolved_order_idx'),
+        ]
 
 
 class UserRequestsModel(models.Model):
@@ -173,6 +189,7 @@ class UserRequestsModel(models.Model):
     start_time = models.DateTimeField(auto_now_add=True, verbose_name='Начало')
     end_time = models.DateTimeField(blank=True, null=True, verbose_name='Конец')
     is_solved = models.BooleanField(default=False, verbose_name='Решено?')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменено')
 
 
     def __str__(self):
@@ -183,4 +200,122 @@ class UserRequestsModel(models.Model):
 
     class Meta:
         verbose_name = 'Запрос пользователя'
-        verbose_name_plural = 'Запросы пользователя'
\ No newline at end of file
+        verbose_name_plural = 'Запросы пользователя'
+
+
+class ProductionRollupModel(models.Model):
+    """
+    Итоги завершенных заказов за час или день в разрезе станка, рабочего места и должности.
+
+    Строки пополняются при завершении или остановке заказа и пересчитываются командой rebuild_rollups.
+    На каждый разрез (период, станок, рабочее место, должность) одна строка. Станок может быть пустым,
+    а NULL в уникальном индексе не совпадает сам с собой, поэтому строки без станка
+    ограничены отдельным условным индексом.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [
+        (HOUR, 'Час'),
+        (DAY, 'День'),
+    ]
+
+    granularity = models.CharField(max_length=8, choices=GRANULARITY_CHOICES, verbose_name='Период')
+    period_start = models.DateTimeField(verbose_name='Начало периода')
+    machine = models.ForeignKey(MachineModel, on_delete=models.CASCADE, blank=True, null=True,
+                                verbose_name='Станок')
+    working_area = models.ForeignKey(WorkingAreaModel, on_delete=models.CASCADE, verbose_name='Рабочее место')
+    position = models.ForeignKey(PositionsModel, on_delete=models.CASCADE, verbose_name='Должность')
+    num_orders = models.PositiveIntegerField(default=0, verbose_name='Количество заказов')
+    num_ended_orders = models.PositiveIntegerField(default=0, verbose_name='Количество завершенных заказов')
+    num_parts = models.PositiveIntegerField(default=0, verbose_name='Количество деталей')
+    good_time = models.DurationField(default=timedelta, verbose_name='Полезное время')
+    bad_time = models.DurationField(default=timedelta, verbose_name='Бесполезное время')
+    bugs_time = models.DurationField(default=timedelta, verbose_name='Время поломок')
+
+    def __str__(self):
+        return f'{self.get_granularity_display()} {self.period_start} | {self.machine} | {self.working_area}'
+
+    class Meta:
+        verbose_name = 'Итоги производства'
+        verbose_name_plural = 'Итоги производства'
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'period_start', 'machine', 'working_area', 'position'],
+                                    condition=models.Q(machine__isnull=False), name='rollup_unique_slice'),
+            models.UniqueConstraint(fields=['granularity', 'period_start', 'working_area', 'position'],
+                                    condition=models.Q(machine__isnull=True), name='rollup_unique_slice_no_machine'),
+        ]
+        indexes = [
+            models.Index(fields=['granularity', 'period_start'], name='rollup_period_idx'),
+        ]
+
+
+class OrderEventModel(models.Model):
+    """
+    Журнал шагов работы над заказом. Записи только добавляются.
+
+    Колонки времени OrdersModel - текущее состояние заказа, журнал хранит всю историю,
+    в том числе каждую паузу. Ключ идемпотентности передает планшет, отправляющий события
+    пакетом: повторно отправленное событие не применяется второй раз.
+    """
+    START = 'start'
+    SCAN = 'scan'
+    QUANTITY = 'quantity'
+    SETUP = 'setup'
+    PROCESSING = 'processing'
+    ENDING = 'ending'
+    PAUSE = 'pause'
+    RESUME = 'resume'
+    STOP = 'stop'
+    STEP_CHOICES = [
+        (START, 'Начало'),
+        (SCAN, 'Сканирование'),
+        (QUANTITY, 'Количество'),
+        (SETUP, 'Наладка'),
+        (PROCESSING, 'Обработка'),
+        (ENDING, 'Завершение'),
+        (PAUSE, 'Пауза'),
+        (RESUME, 'Продолжение'),
+        (STOP, 'Досрочное завершение'),
+    ]
+    KEY_MAX_LENGTH = 64
+
+    user = models.ForeignKey(CustomUserModel, on_delete=models.CASCADE, verbose_name='Пользователь')
+    order = models.ForeignKey(OrdersModel, on_delete=models.CASCADE, verbose_name='Заказ')
+    step = models.CharField(max_length=16, choices=STEP_CHOICES, verbose_name='Шаг')
+    idempotency_key = models.CharField(max_length=KEY_MAX_LENGTH, blank=True, null=True,
+                                       verbose_name='Ключ идемпотентности')
+    ts = models.DateTimeField(verbose_name='Время события')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='Данные')
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name='Получено')
+
+    def __str__(self):
+        return f'{self.get_step_display()} | Заказ {self.order_id} | {self.ts}'
+
+    class Meta:
+        verbose_name = 'Событие заказа'
+        verbose_name_plural = 'События заказов'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='order_event_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['order', 'ts'], name='order_event_order_ts_idx'),
+        ]
+
+
+class DeletedRowModel(models.Model):
+    """
+    Отметка об удалении строки модели с updated_at.
+
+    Удаленная строка не попадает в инкрементальный бэкап, поэтому удаление
+    записывается отдельно и повторяется при восстановлении.
+    """
+    model = models.CharField(max_length=100, verbose_name='Модель')
+    object_id = models.BigIntegerField(verbose_name='ID записи')
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Удалено')
+
+    def __str__(self):
+        return f'{self.model} {self.object_id} | {self.deleted_at}'
+
+    class Meta:
+        verbose_name = 'Удаленная запись'
+        verbose_name_plural = 'Удаленные записи'
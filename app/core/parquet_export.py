@@ -0,0 +1,161 @@
+import datetime
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.db import models
+from django.db.models import F
+from django.db.models.functions import TruncMonth
+
+from core.log import get_logger
+from core.models import ShiftModel, OrdersModel, ReportsModel
+
+logger = get_logger(__name__)
+
+# Модель -> поле времени, по месяцу которого разбиваются файлы.
+# Рабочее место берется у пользователя, создавшего запись.
+PARQUET_MODELS = {
+    OrdersModel: 'start_time',
+    ShiftModel: 'start_time',
+    ReportsModel: 'start_time',
+}
+
+# Значение ключа раздела, если месяц или рабочее место не заданы
+EMPTY_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def arrow_type(field):
+    """
+    Тип колонки Arrow для поля модели.
+
+    Время хранится как timestamp[us, UTC], длительности - как int64 в микросекундах.
+    """
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.DurationField):
+        return pa.int64()
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, (models.IntegerField, models.AutoField, models.ForeignKey)):
+        return pa.int64()
+    return pa.string()
+
+
+def arrow_schema(model):
+    """
+    Возвращает (схема Arrow, attname) конкретных полей модели, первичный ключ первым.
+    """
+    fields = [model._meta.pk] + [field for field in model._meta.concrete_fields if not field.primary_key]
+    schema = pa.schema([
+        pa.field(
+            field.attname,
+            arrow_type(field),
+            metadata={'unit': 'us'} if isinstance(field, models.DurationField) else None,
+        )
+        for field in fields
+    ])
+    return schema, [field.attname for field in fields]
+
+
+def to_record_batch(rows, schema):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pa.types.is_int64(field.type) and field.metadata:
+            values = [value // MICROSECOND if value is not None else None for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def partition_path(directory, label, month, area_id):
+    month = f'{month:%Y-%m}' if month is not None else EMPTY_PARTITION
+    area = area_id if area_id is not None else EMPTY_PARTITION
+    return os.path.join(directory, label, f'month={month}', f'area={area}')
+
+
+class PartitionedWriter:
+    """
+    Пишет строки одной модели в файлы Parquet по разделам month=/area=.
+
+    Строки приходят отсортированными по разделу, поэтому одновременно открыт
+    только один ParquetWriter, а в памяти держится одна пачка строк.
+    """
+
+    def __init__(self, directory, label, schema, batch_size):
+        self.directory = directory
+        self.label = label
+        self.schema = schema
+        self.batch_size = batch_size
+        self.partition = None
+        self.writer = None
+        self.rows = []
+        self.paths = []
+
+    def write(self, partition, row):
+        if partition != self.partition:
+            self._close_partition()
+            path = os.path.join(partition_path(self.directory, self.label, *partition), 'part-0.parquet')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+            self.partition = partition
+            self.paths.append(path)
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self._flush()
+
+    def close(self):
+        self._close_partition()
+        return self.paths
+
+    def _flush(self):
+        if self.rows:
+            self.writer.write_batch(to_record_batch(self.rows, self.schema))
+            self.rows = []
+
+    def _close_partition(self):
+        if self.writer is not None:
+            self._flush()
+            self.writer.close()
+            self.writer = None
+
+
+def export_parquet(directory, chunk_size=50000, since=None):
+    """
+    Потоково выгружает заказы, смены и проблемы в Parquet с разбиением по месяцу и рабочему месту.
+
+    Результат - набор в формате hive (<модель>/month=YYYY-MM/area=<id>/part-0.parquet),
+    который читается pyarrow.dataset, pandas, DuckDB и Spark с отсечением разделов.
+
+    Parameters:
+        directory (str): Каталог выгрузки, создается при необходимости.
+        chunk_size (int): Количество строк, читаемых из БД и записываемых в файл за раз.
+        since (datetime | None): Выгрузить только записи, начатые не раньше этого момента.
+
+    Returns:
+        list[str]: Пути созданных файлов.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    rows_done = 0
+
+    for model, time_field in PARQUET_MODELS.items():
+        schema, attnames = arrow_schema(model)
+        queryset = model._default_manager.all()
+        if since is not None:
+            queryset = queryset.filter(**{f'{time_field}__gte': since})
+        queryset = queryset.annotate(
+            partition_month=TruncMonth(time_field),
+            partition_area=F('user__working_area_id'),
+        ).order_by('partition_month', 'partition_area', 'pk')
+
+        writer = PartitionedWriter(directory, model._meta.label_lower, schema, chunk_size)
+        for row in queryset.values_list('partition_month', 'partition_area', *attnames).iterator(chunk_size=chunk_size):
+            writer.write(row[:2], row[2:])
+            rows_done += 1
+        paths.extend(writer.close())
+
+    logger.info('parquet_exported', rows=rows_done, directory=directory)
+
+    return paths
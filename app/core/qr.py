@@ -0,0 +1,68 @@
+from io import BytesIO
+
+from PIL import Image
+from pyzbar.pyzbar import decode
+
+# Лестница попыток распознавания: (длинная сторона в пикселях, доля кадра по центру).
+# Попытки идут по порядку до первого найденного кода.
+DECODE_LADDER = (
+    (800, 1.0),
+    (1600, 1.0),
+    (800, 0.5),
+)
+
+
+def load_grayscale(image_data, max_side):
+    """
+    Загружает изображение в оттенках серого с длинной стороной не больше max_side.
+
+    Для JPEG draft() заставляет декодер сразу распаковать кадр в уменьшенном
+    масштабе (1/2, 1/4, 1/8) и без цветовых каналов, поэтому полный кадр
+    камеры телефона в память не попадает. Пропорции сохраняются.
+    """
+    image = Image.open(BytesIO(image_data))
+    image.draft('L', (max_side, max_side))
+    image = image.convert('L')
+    image.thumbnail((max_side, max_side))
+    return image
+
+
+def iter_attempts(image_data, ladder=DECODE_LADDER):
+    """
+    Возвращает кадры для попыток распознавания по лестнице ladder.
+
+    Изображение декодируется один раз в самом крупном нужном масштабе,
+    меньшие масштабы и вырезки получаются из него в памяти.
+    """
+    base = load_grayscale(image_data, max(side for side, _ in ladder))
+    for side, crop in ladder:
+        frame = base
+        if crop < 1.0:
+            width, height = frame.size
+            dx, dy = int(width * (1 - crop) / 2), int(height * (1 - crop) / 2)
+            frame = frame.crop((dx, dy, width - dx, height - dy))
+        if max(frame.size) > side:
+            frame = frame.copy()
+            frame.thumbnail((side, side))
+        yield frame
+
+
+def decode_image(image_data):
+    """
+    Распознает QR код на изображении.
+
+    Как и раньше, распознаются все типы кодов, которые поддерживает zbar, включая штрихкоды.
+
+    Выполняется только в воркере очереди qr, веб-процессы изображения не обрабатывают.
+
+    Parameters:
+        image_data (bytes): Содержимое загруженного файла.
+
+    Returns:
+        str | None: Данные QR кода или None, если код не найден.
+    """
+    for frame in iter_attempts(image_data):
+        decoded_qr_img = decode(frame)
+        if decoded_qr_img:
+            return decoded_qr_img[0].data.decode('utf-8')
+    return None
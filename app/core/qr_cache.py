@@ -0,0 +1,122 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+
+from core.log import get_logger
+from core.metrics import QR_CACHE_HITS, QR_CACHE_MISSES
+
+logger = get_logger(__name__)
+
+# Как часто писать в лог счетчики попаданий, в обращениях к кэшу
+STATS_LOG_EVERY = 100
+
+
+class DecodeCache:
+    """
+    LRU кэш с TTL для результатов распознавания QR.
+
+    Ключ - хэш содержимого загруженного файла, поэтому повторная отправка того же
+    кадра не доходит ни до очереди, ни до PIL и zbar. Если задан redis_url,
+    результаты дополнительно хранятся в Redis и доступны всем веб-процессам.
+    Пустая строка в кэше означает, что код на этом кадре не найден.
+    """
+
+    def __init__(self, max_size, ttl, redis_url=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = redis.Redis.from_url(redis_url) if redis_url else None
+
+    @staticmethod
+    def key(image_data):
+        return hashlib.blake2b(image_data, digest_size=16).hexdigest()
+
+    def get(self, key):
+        value = self._get_local(key)
+        if value is None and self._redis is not None:
+            value = self._get_redis(key)
+            if value is not None:
+                self._set_local(key, value)
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                QR_CACHE_MISSES.inc()
+            else:
+                self.hits += 1
+                QR_CACHE_HITS.inc()
+            lookups = self.hits + self.misses
+        if lookups % STATS_LOG_EVERY == 0:
+            logger.info('qr_decode_cache_stats', **self.stats())
+        return value
+
+    def set(self, key, value):
+        self._set_local(key, value)
+        if self._redis is not None:
+            try:
+                self._redis.setex(f'qr:{key}', self.ttl, value)
+            except redis.RedisError as e:
+                logger.warning('qr_decode_cache_redis_error', error=str(e))
+
+    def set_task(self, task_id, key):
+        """
+        Запоминает ключ файла, распознавание которого поставлено задачей task_id.
+
+        Результат задачи, готовый уже после ответа 202, кладется в кэш по этому ключу,
+        а не по значению, присланному клиентом.
+        """
+        self.set(f'task:{task_id}', key)
+
+    def task_key(self, task_id):
+        name = f'task:{task_id}'
+        key = self._get_local(name)
+        if key is None and self._redis is not None:
+            key = self._get_redis(name)
+        return key
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._items),
+            }
+
+    def _get_local(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def _set_local(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def _get_redis(self, key):
+        try:
+            value = self._redis.get(f'qr:{key}')
+        except redis.RedisError as e:
+            logger.warning('qr_decode_cache_redis_error', error=str(e))
+            return None
+        return value.decode('utf-8') if value is not None else None
+
+
+qr_decode_cache = DecodeCache(settings.QR_CACHE_SIZE, settings.QR_CACHE_TTL, settings.QR_CACHE_REDIS_URL)
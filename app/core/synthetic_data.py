@@ -0,0 +1,390 @@
+import csv
+import io
+import math
+import random
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta, timezone as datetime_timezone
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.buisness import hold_duration
+from core.log import get_logger
+from core.models import (
+    CustomUserModel, RoleModel, PositionsModel, WorkingAreaModel, MachineTypesModel, MachineModel,
+    ShiftModel, OrdersModel, ReportsModel, UserRequestsModel,
+)
+
+logger = get_logger(__name__)
+
+# Параметры распределений сгенерированной истории
+ORDERS_PER_SHIFT = 8
+ORDERS_PER_USER = 5000
+USERS_PER_AREA = 25
+MACHINES_PER_USER = (1, 4)
+SHIFT_START_HOUR = 8
+ABSENCE_RATE = 0.05
+ENDED_EARLY_RATE = 0.03
+HOLD_RATE = 0.08
+REPORT_RATE = 0.05
+REQUEST_RATE = 0.04
+
+# Должность и время отдыха за смену в минутах
+POSITIONS = (('Оператор ЧПУ', 45), ('Токарь', 30), ('Фрезеровщик', 30))
+MACHINE_TYPES = ('Токарный', 'Фрезерный', 'Сверлильный', 'Шлифовальный')
+PART_PREFIXES = ('ВТ', 'КР', 'ФЛ', 'ШС', 'ОС', 'ПЛ')
+REPORT_DESCRIPTIONS = ('Сломался инструмент', 'Нет заготовок', 'Ошибка станка', 'Брак на детали')
+REQUEST_DESCRIPTIONS = ('Нужен инструмент', 'Нужна заготовка', 'Вызов наладчика', 'Замена спецодежды')
+
+SHIFT_COLUMNS = (
+    'id', 'user_id', 'start_time', 'end_time', 'num_ended_orders', 'time_total', 'good_time', 'bad_time',
+    'lost_time', 'total_bugs_time', 'updated_at',
+)
+ORDER_COLUMNS = (
+    'id', 'user_id', 'machine_id', 'related_to_shift_id', 'part_name', 'num_parts', 'start_time', 'scan_time',
+    'start_working_time', 'machine_start_time', 'machine_end_time', 'end_working_time', 'bugs_time',
+    'ended_early', 'hold_started', 'hold_url', 'hold_ended', 'hold_time', 'updated_at',
+)
+REPORT_COLUMNS = ('id', 'user_id', 'order_id', 'description', 'start_time', 'end_time', 'is_solved', 'url',
+                  'updated_at')
+REQUEST_COLUMNS = ('id', 'user_id', 'description', 'start_time', 'end_time', 'is_solved', 'updated_at')
+
+
+@contextmanager
+def without_secondary_indexes(models):
+    """
+    В PostgreSQL снимает внешние ключи и неуникальные индексы таблиц моделей и создает их заново на выходе.
+
+    Массовая загрузка без них идет в разы быстрее: индексы строятся один раз сортировкой,
+    а внешние ключи проверяются одним запросом вместо проверки каждой строки.
+    DDL в PostgreSQL транзакционный, поэтому вызывать нужно внутри transaction.atomic():
+    при ошибке индексы и ключи вернутся вместе с откатом. Таблицы заблокированы до конца транзакции.
+    В остальных БД ничего не делает.
+    """
+    if connection.vendor != 'postgresql':
+        yield
+        return
+
+    tables = [model._meta.db_table for model in models]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conrelid::regclass::text, quote_ident(conname), pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE contype = 'f' AND conrelid = ANY(%s::regclass[])",
+            [tables],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            'SELECT indexrelid::regclass::text, pg_get_indexdef(indexrelid) FROM pg_index '
+            'WHERE indrelid = ANY(%s::regclass[]) AND NOT indisunique',
+            [tables],
+        )
+        indexes = cursor.fetchall()
+        # Отложенные проверки строк, уже вставленных в этой транзакции, не дают менять таблицы
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        for table, name, _ in foreign_keys:
+            cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {name}')
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX {name}')
+
+    yield
+
+    with connection.cursor() as cursor:
+        for _, definition in indexes:
+            cursor.execute(definition)
+        for table, name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+        cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+def _next_id(model):
+    return (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+
+class TableWriter:
+    """
+    Копит строки одной таблицы и записывает их пачкой.
+
+    В PostgreSQL пачка загружается через COPY в формате CSV, в остальных БД - одним executemany.
+    Строки пишутся в обход ORM, поэтому auto_now и auto_now_add не подменяют
+    сгенерированное время. Значения передаются в порядке columns вместе с ID,
+    время - наивным datetime в UTC. В COPY пустая строка записывается как NULL.
+    """
+
+    def __init__(self, model, columns):
+        self.model = model
+        self.table = model._meta.db_table
+        self.fields = [model._meta.get_field(column) for column in columns]
+        self.rows = []
+        self.written = 0
+
+    def add(self, row):
+        self.rows.append(row)
+
+    def flush(self):
+        if not self.rows:
+            return
+        quote_name = connection.ops.quote_name
+        columns = ', '.join(quote_name(field.column) for field in self.fields)
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Соединение Django работает в UTC, а str() у timedelta и bool PostgreSQL разбирает сам,
+                # поэтому значения пишутся в CSV без преобразований
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(self.rows)
+                buffer.seek(0)
+                cursor.copy_expert(f'COPY {quote_name(self.table)} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+            else:
+                placeholders = ', '.join(['%s'] * len(self.fields))
+                cursor.executemany(
+                    f'INSERT INTO {quote_name(self.table)} ({columns}) VALUES ({placeholders})',
+                    [[field.get_db_prep_save(self._aware(value), connection) for field, value in zip(self.fields, row)]
+                     for row in self.rows],
+                )
+        self.written += len(self.rows)
+        self.rows = []
+
+    @staticmethod
+    def _aware(value):
+        if isinstance(value, datetime):
+            return timezone.make_aware(value, datetime_timezone.utc)
+        return value
+
+
+class DataGenerator:
+    """
+    Синтетическая история цеха: рабочие, станки, закрытые смены, заказы, проблемы и запросы.
+
+    Все случайные значения берутся из random.Random(seed) в одном порядке, поэтому одинаковые
+    seed, количество заказов и until дают одинаковые данные независимо от БД и размера пачки.
+    ID назначаются подряд после текущего максимума, последовательности сбрасываются в конце.
+    Пока идет генерация, в эти таблицы никто другой писать не должен.
+
+    Вся генерация идет одной транзакцией: прерванный запуск не оставляет частичных данных.
+    В PostgreSQL на время загрузки снимаются вторичные индексы и внешние ключи
+    заполняемых таблиц, см. without_secondary_indexes.
+    """
+
+    def __init__(self, orders, users=None, seed=0, until=None, batch_size=20000):
+        self.orders = orders
+        self.users = users or max(1, math.ceil(orders / ORDERS_PER_USER))
+        self.seed = seed
+        self.until = until or timezone.localdate()
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.shifts = TableWriter(ShiftModel, SHIFT_COLUMNS)
+        self.order_rows = TableWriter(OrdersModel, ORDER_COLUMNS)
+        self.reports = TableWriter(ReportsModel, REPORT_COLUMNS)
+        self.requests = TableWriter(UserRequestsModel, REQUEST_COLUMNS)
+        # Порядок записи соответствует внешним ключам
+        self.writers = (self.shifts, self.order_rows, self.reports, self.requests)
+
+    def run(self):
+        """
+        Returns:
+            dict: Количество записанных строк по таблицам.
+        """
+        prefix = f'gen{self.seed}_'
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise ValueError(f'Данные с seed={self.seed} уже сгенерированы')
+
+        models = [writer.model for writer in self.writers]
+        with transaction.atomic():
+            users = self._create_users(prefix)
+            with without_secondary_indexes(models):
+                self._create_history(users)
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+
+        counts = {
+            'users': len(users),
+            'shifts': self.shifts.written,
+            'orders': self.order_rows.written,
+            'reports': self.reports.written,
+            'requests': self.requests.written,
+        }
+        logger.info('synthetic_data_generated', seed=self.seed, **counts)
+        return counts
+
+    def _create_users(self, prefix):
+        rng = self.rng
+        role = RoleModel.objects.filter(role_name='worker').first() or RoleModel.objects.create(role_name='worker')
+        positions = [
+            PositionsModel.objects.get_or_create(position_name=name,
+                                                 defaults={'chill_time': timedelta(minutes=minutes)})[0]
+            for name, minutes in POSITIONS
+        ]
+        machine_types = [MachineTypesModel.objects.get_or_create(machine_type=name)[0] for name in MACHINE_TYPES]
+        areas = [
+            WorkingAreaModel.objects.get_or_create(area_name=f'Цех {i + 1}')[0]
+            for i in range(math.ceil(self.users / USERS_PER_AREA))
+        ]
+
+        first_user_id = max(_next_id(User), _next_id(CustomUserModel))
+        first_machine_id = _next_id(MachineModel)
+        date_joined = timezone.make_aware(datetime.combine(self.until, time()))
+        auth_users, custom_users, machines, links = [], [], [], []
+        users = []
+        for i in range(self.users):
+            user_id = first_user_id + i
+            area = areas[i // USERS_PER_AREA]
+            position = rng.choice(positions)
+            machine_ids = []
+            for _ in range(rng.randint(*MACHINES_PER_USER)):
+                machine_type = rng.choice(machine_types)
+                machine_id = first_machine_id + len(machines)
+                machines.append(MachineModel(id=machine_id, machine_type=machine_type,
+                                             machine_name=f'{machine_type.machine_type} {area.area_name}-{machine_id}'))
+                machine_ids.append(machine_id)
+            auth_users.append(User(id=user_id, username=f'{prefix}{i}', password=UNUSABLE_PASSWORD_PREFIX,
+                                   date_joined=date_joined))
+            # ID CustomUserModel совпадает с ID User, как у пользователей, созданных через админку
+            custom_users.append(CustomUserModel(id=user_id, user_id=user_id, phone_number=f'{prefix}{i}',
+                                                role=role, position=position, working_area=area))
+            links.extend(CustomUserModel.machine.through(customusermodel_id=user_id, machinemodel_id=machine_id)
+                         for machine_id in machine_ids)
+            users.append((user_id, machine_ids, position.chill_time))
+
+        User.objects.bulk_create(auth_users, batch_size=self.batch_size)
+        CustomUserModel.objects.bulk_create(custom_users, batch_size=self.batch_size)
+        MachineModel.objects.bulk_create(machines, batch_size=self.batch_size)
+        CustomUserModel.machine.through.objects.bulk_create(links, batch_size=self.batch_size)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User, CustomUserModel, MachineModel]):
+                cursor.execute(sql)
+        return users
+
+    def _workdays(self):
+        """
+        Рабочие дни по возрастанию, начиная с дня, от которого история с запасом доходит до until.
+        Если заказов все равно не хватило, дни продолжаются после until.
+        """
+        shifts_per_user = math.ceil(self.orders / self.users / ORDERS_PER_SHIFT / (1 - ABSENCE_RATE))
+        day = self.until
+        for _ in range(shifts_per_user):
+            day -= timedelta(days=1)
+            while day.weekday() >= 5:
+                day -= timedelta(days=1)
+        while True:
+            if day.weekday() < 5:
+                yield day
+            day += timedelta(days=1)
+
+    def _create_history(self, users):
+        rng = self.rng
+        self.next_shift_id = _next_id(ShiftModel)
+        self.next_order_id = _next_id(OrdersModel)
+        self.next_report_id = _next_id(ReportsModel)
+        self.next_request_id = _next_id(UserRequestsModel)
+        remaining = self.orders
+        for day in self._workdays():
+            day_start = timezone.make_naive(timezone.make_aware(datetime.combine(day, time(SHIFT_START_HOUR))),
+                                            datetime_timezone.utc)
+            for user_id, machine_ids, chill_time in users:
+                if rng.random() < ABSENCE_RATE:
+                    continue
+                orders = min(remaining, max(1, round(rng.gauss(ORDERS_PER_SHIFT, ORDERS_PER_SHIFT / 3))))
+                start = day_start + timedelta(minutes=rng.gauss(0, 10))
+                self._add_shift(user_id, machine_ids, chill_time, start, orders)
+                remaining -= orders
+                if len(self.order_rows.rows) >= self.batch_size or not remaining:
+                    for writer in self.writers:
+                        writer.flush()
+                    logger.info('synthetic_data_batch_written', orders=self.order_rows.written)
+                if not remaining:
+                    return
+
+    def _add_shift(self, user_id, machine_ids, chill_time, start, orders):
+        rng = self.rng
+        shift_id = self.next_shift_id
+        self.next_shift_id += 1
+
+        good_time = bad_time = total_bugs_time = timedelta()
+        num_ended_orders = 0
+        t = start + timedelta(minutes=rng.uniform(3, 15))
+        for _ in range(orders):
+            order_id = self.next_order_id
+            self.next_order_id += 1
+            num_parts = max(1, int(rng.lognormvariate(2.3, 0.7)))
+            scan_time = t + timedelta(seconds=rng.uniform(10, 120))
+            start_working_time = scan_time + timedelta(seconds=rng.uniform(20, 180))
+            # Наладка около 10 минут, обработка около 2 минут на деталь
+            machine_start_time = start_working_time + timedelta(minutes=rng.lognormvariate(2.3, 0.5))
+            processing = timedelta(minutes=num_parts * rng.lognormvariate(0.7, 0.4))
+            ended_early = rng.random() < ENDED_EARLY_RATE
+            if ended_early:
+                processing *= rng.uniform(0.1, 0.9)
+
+            # Поломка и пауза идут после работы станка: время станка целиком полезное,
+            # а поломки и паузы вычитаются из бесполезного, которое так не уходит в минус
+            machine_end_time = machine_start_time + processing
+            idle_from = machine_end_time
+
+            bugs_time = timedelta()
+            if rng.random() < REPORT_RATE:
+                report_start = idle_from + timedelta(seconds=rng.uniform(10, 60))
+                bugs_time = timedelta(minutes=rng.uniform(5, 90))
+                idle_from = report_start + bugs_time
+                self.reports.add((
+                    self.next_report_id, user_id, order_id, rng.choice(REPORT_DESCRIPTIONS), report_start,
+                    idle_from, True, '/shift/processing/', idle_from,
+                ))
+                self.next_report_id += 1
+
+            hold_started = hold_ended = None
+            hold_time = timedelta()
+            if rng.random() < HOLD_RATE:
+                hold_started = idle_from + timedelta(seconds=rng.uniform(10, 120))
+                hold_ended = hold_started + timedelta(minutes=rng.uniform(5, 60))
+                hold_time = hold_duration(hold_started, hold_ended, machine_start_time, machine_end_time)
+                idle_from = hold_ended
+
+            end_working_time = idle_from + timedelta(seconds=rng.uniform(30, 300))
+            self.order_rows.add((
+                order_id, user_id, rng.choice(machine_ids), shift_id,
+                f'{rng.choice(PART_PREFIXES)}-{rng.randrange(10000):04d}', num_parts, t, scan_time,
+                start_working_time, machine_start_time, machine_end_time, end_working_time, bugs_time,
+                ended_early, hold_started, '/shift/ending/', hold_ended, hold_time, end_working_time,
+            ))
+
+            # Те же формулы, что в finalize_shift
+            good_time += machine_end_time - machine_start_time
+            bad_time += end_working_time - scan_time - (machine_end_time - machine_start_time) - bugs_time - hold_time
+            total_bugs_time += bugs_time
+            num_ended_orders += not ended_early
+            t = end_working_time + timedelta(minutes=rng.uniform(1, 10))
+
+        if rng.random() < REQUEST_RATE:
+            request_start = start + (t - start) * rng.random()
+            request_end = request_start + timedelta(minutes=rng.uniform(5, 240))
+            self.requests.add((self.next_request_id, user_id, rng.choice(REQUEST_DESCRIPTIONS), request_start,
+                               request_end, True, request_end))
+            self.next_request_id += 1
+
+        end_time = t + timedelta(minutes=rng.uniform(5, 20))
+        time_total = end_time - start
+        self.shifts.add((
+            shift_id, user_id, start, end_time, num_ended_orders, time_total, good_time, bad_time,
+            time_total - good_time - bad_time - total_bugs_time - chill_time, total_bugs_time, end_time,
+        ))
+
+
+def generate_data(orders, users=None, seed=0, until=None, batch_size=20000):
+    """
+    Генерирует историю цеха с заданным количеством заказов.
+
+    Parameters:
+        orders (int): Количество заказов.
+        users (int | None): Количество рабочих, по умолчанию один на ORDERS_PER_USER заказов.
+        seed (int): Зерно генератора случайных чисел.
+        until (date | None): День, до которого идет история, по умолчанию сегодня.
+        batch_size (int): Количество заказов в одной пачке записи.
+
+    Returns:
+        dict: Количество записанных строк по таблицам.
+    """
+    return DataGenerator(orders, users, seed, until, batch_size).run()
@@ -1,6 +1,12 @@
+import base64
+import os
 import time
 
 from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from core.export import export_data
 
 @shared_task
 def add(x, y):
@@ -10,4 +16,30 @@ def add(x, y):
 @shared_task()
 def my_async_task():
     print(123)
-    pass
\ No newline at end of file
+    pass
+
+
+@shared_task(soft_time_limit=settings.QR_DECODE_TIMEOUT, time_limit=settings.QR_DECODE_TIMEOUT + 5)
+def decode_qr_image(image_data):
+    """
+    Распознает QR код на изображении, переданном в base64.
+    Маршрутизируется в отдельную очередь qr, см. CELERY_TASK_ROUTES.
+    """
+    # zbar загружается только в воркере очереди qr
+    from core.qr import decode_image
+
+    return decode_image(base64.b64decode(image_data))
+
+
+@shared_task(bind=True)
+def export_backup(self, formats):
+    """
+    Потоковая выгрузка всех моделей core в BACKUP_DIR/<дата_время>/.
+    Прогресс публикуется в состоянии задачи PROGRESS.
+    """
+    directory = os.path.join(settings.BACKUP_DIR, timezone.now().strftime('%Y-%m-%d_%H%M%S'))
+
+    def progress(label, rows_done, rows_total):
+        self.update_state(state='PROGRESS', meta={'model': label, 'done': rows_done, 'total': rows_total})
+
+    return export_data(directory, formats, settings.BACKUP_CHUNK_SIZE, progress)
@@ -1,3 +1,1140 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import skipUnless, mock
 
-# Create your tests here.
+import openpyxl
+import pyarrow as pa
+import pyarrow.dataset as ds
+import qrcode
+from PIL import Image
+from prometheus_client import REGISTRY
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import QuerySet, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_duration
+
+from core.admin import estimated_count
+from core.backup import run_backup, restore_backup, load_manifest
+from core.export import export_data
+from core.parquet_export import export_parquet
+from core.buisness import (
+    add_quantity_and_start_working_time, add_end_working_time, add_order_to_rollups, rebuild_rollups, get_rollups,
+    start_new_order, stop_order, claim_machine, add_part_name, add_machine_start_time, add_machine_end_time,
+    set_on_hold, remove_hold, hold_duration, log_order_event, materialize_orders, submit_qr_decode, finalize_shift,
+    parse_order_event, calculate_shift_end_time, count_num_ended_orders, calculate_shift_time_total,
+    calculate_total_bugs_time, calculate_good_time, calculate_bad_time, calculate_lost_time, GOOD_TIME_EXPRESSION, GOOD_TIME_FILTER, BAD_TIME_EXPRESSION, BAD_TIME_FILTER,
+)
+from core.models import (
+    CustomUserModel, RoleModel, PositionsModel, WorkingAreaModel, MachineTypesModel, MachineModel,
+    ShiftModel, OrdersModel, ReportsModel, ProductionRollupModel, OrderEventModel,
+)
+from core.log import BackgroundStreamHandler, get_logger
+from core.lookup_cache import get_lookup, get_user_machine_ids
+from core.machine_state import MACHINE_STATE_KEY, MACHINE_STATE_READY_KEY, machine_state_cache
+from core.qr import DECODE_LADDER, decode_image, iter_attempts
+from core.qr_cache import DecodeCache, qr_decode_cache
+from core.synthetic_data import generate_data
+
+
+class WorkflowTestMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='operator', password='operator')
+        cls.custom_user = CustomUserModel.objects.create(
+            id=cls.user.id,
+            user=cls.user,
+            phone_number='+70000000000',
+            role=RoleModel.objects.create(role_name='worker'),
+            position=PositionsModel.objects.create(position_name='Оператор', chill_time=timedelta(minutes=30)),
+            working_area=WorkingAreaModel.objects.create(area_name='Цех 1'),
+        )
+        cls.machine = MachineModel.objects.create(
+            machine_type=MachineTypesModel.objects.create(machine_type='Токарный'),
+            machine_name='Станок 1',
+        )
+        cls.custom_user.machine.add(cls.machine)
+        cls.shift = ShiftModel.objects.create(user=cls.custom_user)
+        cls.order = OrdersModel.objects.create(
+            user=cls.custom_user,
+            machine=cls.machine,
+            related_to_shift=cls.shift,
+            part_name='Деталь',
+        )
+        # Указатели, которые выставляют get_last_or_create_shift и start_new_order
+        CustomUserModel.objects.filter(id=cls.custom_user.id).update(current_shift=cls.shift)
+        MachineModel.objects.filter(id=cls.machine.id).update(is_in_progress=True, order_in_progress=cls.order)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['selected_machine_id'] = str(self.machine.id)
+        session.save()
+
+
+class WorkContextQueryCountTests(WorkflowTestMixin, TestCase):
+    # Пользователь auth, смена вместе с пользователем, заказ вместе с флагом проблем.
+    # Сессия читается из кэша
+    ORDER_PAGE_QUERIES = 3
+
+    def assertPageQueries(self, url_name, num):
+        url = reverse(url_name)
+        OrdersModel.objects.filter(id=self.order.id).update(hold_url=url)
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_scan_view(self):
+        self.assertPageQueries('shift_scan_page', self.ORDER_PAGE_QUERIES)
+
+    def test_order_quantity_view(self):
+        self.assertPageQueries('shift_qauntity_page', self.ORDER_PAGE_QUERIES)
+
+    def test_order_setup_view(self):
+        self.assertPageQueries('shift_setup_page', self.ORDER_PAGE_QUERIES)
+
+    def test_order_processing_view(self):
+        self.assertPageQueries('shift_processing_page', self.ORDER_PAGE_QUERIES)
+
+    def test_order_ending_view(self):
+        self.assertPageQueries('shift_ending_page', self.ORDER_PAGE_QUERIES)
+
+    def test_report_send(self):
+        self.assertPageQueries('report_page', self.ORDER_PAGE_QUERIES)
+
+    def test_page_reload_does_not_write_order(self):
+        def order_updates(ctx):
+            return [query['sql'] for query in ctx.captured_queries
+                    if query['sql'].startswith('UPDATE "core_ordersmodel"')]
+
+        OrdersModel.objects.filter(id=self.order.id).update(hold_url=reverse('shift_main_page'))
+        # Первый заход на страницу запоминает ее в заказе, повторный ничего не пишет
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(reverse('shift_scan_page'))
+        with CaptureQueriesContext(connection) as reload:
+            self.client.get(reverse('shift_scan_page'))
+        self.assertEqual(len(order_updates(first)), 1)
+        self.assertEqual(order_updates(reload), [])
+
+
+class LookupCacheTests(WorkflowTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_shift_page_machines_in_one_query(self):
+        second = MachineModel.objects.create(machine_type=self.machine.machine_type, machine_name='Станок 2')
+        self.custom_user.machine.add(second)
+        self.client.get(reverse('shift_main_page'))
+        # Пользователь auth, смена вместе с пользователем, текущий заказ, станки вместе с типом и заказом
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('shift_main_page'))
+        self.assertEqual([machine.id for machine in response.context['machines']], [self.machine.id, second.id])
+
+    def test_user_machines_invalidated_on_change(self):
+        self.assertEqual(get_user_machine_ids(self.custom_user.id), [self.machine.id])
+        second = MachineModel.objects.create(machine_type=self.machine.machine_type, machine_name='Станок 2')
+        second.customusermodel_set.add(self.custom_user)
+        self.assertEqual(sorted(get_user_machine_ids(self.custom_user.id)), [self.machine.id, second.id])
+        self.custom_user.machine.remove(self.machine)
+        self.assertEqual(get_user_machine_ids(self.custom_user.id), [second.id])
+        second.customusermodel_set.clear()
+        self.assertEqual(get_user_machine_ids(self.custom_user.id), [])
+
+    def test_lookup_invalidated_on_save(self):
+        position = self.custom_user.position
+        self.assertEqual(get_lookup(PositionsModel, position.id).chill_time, timedelta(minutes=30))
+        with self.assertNumQueries(0):
+            get_lookup(PositionsModel, position.id)
+        position.chill_time = timedelta(minutes=10)
+        position.save()
+        self.assertEqual(get_lookup(PositionsModel, position.id).chill_time, timedelta(minutes=10))
+
+
+class OrderTransitionTests(WorkflowTestMixin, TestCase):
+    def test_transition_updates_only_given_columns(self):
+        with CaptureQueriesContext(connection) as ctx:
+            add_quantity_and_start_working_time(self.order, 5)
+
+        # INSERT в журнал событий, затем UPDATE заказа последним запросом транзакции
+        statements = [query['sql'] for query in ctx.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual([sql.split()[0] for sql in statements], ['INSERT', 'UPDATE'])
+        sql = statements[1]
+        self.assertIn('num_parts', sql)
+        self.assertIn('start_working_time', sql)
+        self.assertNotIn('part_name', sql)
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.num_parts, 5)
+        self.assertIsNotNone(self.order.start_working_time)
+
+    def test_ended_order_is_not_modified(self):
+        ended_at = timezone.now() - timedelta(hours=1)
+        OrdersModel.objects.filter(id=self.order.id).update(end_working_time=ended_at)
+
+        self.assertIsNone(add_end_working_time(self.order))
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.end_working_time, ended_at)
+        self.assertFalse(OrderEventModel.objects.filter(order=self.order).exists())
+
+    def test_stop_does_not_overwrite_ended_order(self):
+        ended_at = timezone.now() - timedelta(hours=1)
+        OrdersModel.objects.filter(id=self.order.id).update(end_working_time=ended_at)
+
+        self.assertIsNone(stop_order(self.order))
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.end_working_time, ended_at)
+        self.assertFalse(self.order.ended_early)
+
+    def test_stop_ends_order_and_releases_machine(self):
+        self.assertEqual(stop_order(self.order), self.order)
+
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.ended_early)
+        self.assertIsNotNone(self.order.end_working_time)
+        machine = MachineModel.objects.get(id=self.machine.id)
+        self.assertFalse(machine.is_in_progress)
+        self.assertIsNone(machine.order_in_progress_id)
+
+
+class RecalculateBadTimeTests(WorkflowTestMixin, TestCase):
+    def test_command_recalculates_bad_and_lost_time(self):
+        started = timezone.now() - timedelta(hours=8)
+        OrdersModel.objects.filter(id=self.order.id).update(
+            scan_time=started,
+            machine_start_time=started + timedelta(minutes=10),
+            machine_end_time=started + timedelta(minutes=40),
+            end_working_time=started + timedelta(minutes=50),
+            bugs_time=timedelta(),
+        )
+        ShiftModel.objects.filter(id=self.shift.id).update(
+            end_time=started + timedelta(hours=8),
+            time_total=timedelta(hours=8),
+            good_time=timedelta(minutes=30),
+            total_bugs_time=timedelta(),
+            bad_time=timedelta(minutes=5),
+            lost_time=timedelta(hours=6, minutes=55),
+        )
+
+        call_command('recalculate_bad_time', stdout=io.StringIO())
+
+        self.shift.refresh_from_db()
+        self.assertEqual(self.shift.bad_time, timedelta(minutes=20))
+        # 8 ч - 30 мин полезного - 20 мин бесполезного - 30 мин отдыха
+        self.assertEqual(self.shift.lost_time, timedelta(hours=6, minutes=40))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Планы запросов проверяются только на PostgreSQL')
+class HotLookupPlanTests(WorkflowTestMixin, TestCase):
+    """
+    С выключенным seq scan планировщик выбирает его только если подходящего индекса нет.
+    """
+
+    def assertUsesIndex(self, queryset):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan, plan)
+
+    def test_current_user_lookup(self):
+        self.assertUsesIndex(
+            CustomUserModel.objects.select_related('user', 'current_shift').filter(id=self.custom_user.id)
+        )
+
+    def test_last_shift_lookup(self):
+        self.assertUsesIndex(ShiftModel.objects.filter(user=self.custom_user).order_by('-id')[:1])
+
+    def test_last_order_lookup(self):
+        self.assertUsesIndex(OrdersModel.objects.filter(
+            user=self.custom_user, related_to_shift=self.shift, machine_id=self.machine.id
+        ).order_by('-id')[:1])
+
+    def test_unsolved_reports_lookup(self):
+        self.assertUsesIndex(ReportsModel.objects.filter(order__related_to_shift=self.shift, is_solved=False))
+
+    def test_hold_url_fallback_lookup(self):
+        self.assertUsesIndex(ReportsModel.objects.filter(order__machine_id=self.machine.id).order_by('-id')[:1])
+
+
+class DecodePhotoTests(TestCase):
+    def tearDown(self):
+        qr_decode_cache._items.clear()
+
+    def test_repeated_upload_is_served_from_cache(self):
+        qr_decode_cache.set(qr_decode_cache.key(b'jpeg'), 'Деталь-42')
+        image = SimpleUploadedFile('qr.jpg', b'jpeg', content_type='image/jpeg')
+        with mock.patch('core.views.submit_qr_decode') as submit:
+            response = self.client.post(reverse('decode_photo'), {'image': image})
+        submit.assert_not_called()
+        self.assertEqual(response.content.decode(), 'Деталь-42')
+
+    def test_full_queue_returns_429(self):
+        image = SimpleUploadedFile('qr.jpg', b'jpeg', content_type='image/jpeg')
+        with mock.patch('core.buisness.qr_queue_length', return_value=100):
+            response = self.client.post(reverse('decode_photo'), {'image': image})
+        self.assertEqual(response.status_code, 429)
+
+    def test_missing_image_is_bad_request(self):
+        response = self.client.post(reverse('decode_photo'))
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(QR_DECODE_POLL_INTERVAL=0)
+    def test_waits_for_result_without_blocking_get(self):
+        result = mock.Mock(id='task', **{'ready.side_effect': [False, True], 'get.return_value': 'Деталь-7'})
+        image = SimpleUploadedFile('qr.jpg', b'other-jpeg', content_type='image/jpeg')
+        with mock.patch('core.views.submit_qr_decode', return_value=result):
+            response = self.client.post(reverse('decode_photo'), {'image': image})
+        self.assertEqual(response.content.decode(), 'Деталь-7')
+        result.get.assert_called_once_with()
+
+    @override_settings(QR_DECODE_WAIT=0, QR_DECODE_POLL_INTERVAL=0)
+    def test_slow_decode_returns_status_url(self):
+        result = mock.Mock(id='task', **{'ready.return_value': False})
+        image = SimpleUploadedFile('qr.jpg', b'slow-jpeg', content_type='image/jpeg')
+        with mock.patch('core.views.submit_qr_decode', return_value=result):
+            response = self.client.post(reverse('decode_photo'), {'image': image})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status_url'], reverse('decode_photo_status', args=['task']))
+
+    def test_status_caches_result_under_submitted_image_key(self):
+        result = mock.Mock(id='task', result='Деталь-9', **{'ready.return_value': True, 'successful.return_value': True})
+        with mock.patch('core.buisness.qr_queue_length', return_value=0), \
+                mock.patch('core.buisness.decode_qr_image.apply_async', return_value=result), \
+                mock.patch('core.views.decode_qr_image.AsyncResult', return_value=result):
+            submit_qr_decode(b'late-jpeg', qr_decode_cache.key(b'late-jpeg'))
+            response = self.client.get(reverse('decode_photo_status', args=['task']), {'key': 'forged'})
+        self.assertEqual(response.json()['data'], 'Деталь-9')
+        self.assertEqual(qr_decode_cache.get(qr_decode_cache.key(b'late-jpeg')), 'Деталь-9')
+        self.assertIsNone(qr_decode_cache.get('forged'))
+
+
+class DecodeImageTests(TestCase):
+    def make_photo(self, data, size=(4000, 3000)):
+        """JPEG размером с кадр камеры телефона с QR кодом по центру."""
+        code = qrcode.make(data, box_size=20).get_image().convert('RGB')
+        photo = Image.new('RGB', size, 'white')
+        photo.paste(code, ((size[0] - code.width) // 2, (size[1] - code.height) // 2))
+        buffer = io.BytesIO()
+        photo.save(buffer, 'JPEG', quality=90)
+        return buffer.getvalue()
+
+    def test_decodes_generated_qr(self):
+        self.assertEqual(decode_image(self.make_photo('Деталь-42')), 'Деталь-42')
+
+    def test_image_without_code_returns_none(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 900), 'white').save(buffer, 'JPEG')
+        self.assertIsNone(decode_image(buffer.getvalue()))
+
+    def test_attempt_frames_follow_ladder(self):
+        frames = list(iter_attempts(self.make_photo('Деталь-42')))
+        self.assertEqual([frame.size for frame in frames], [(800, 600), (1600, 1200), (800, 600)])
+        self.assertEqual({frame.mode for frame in frames}, {'L'})
+        self.assertEqual(len(frames), len(DECODE_LADDER))
+
+    def test_retries_until_code_found(self):
+        found = mock.Mock(data='Деталь-42'.encode())
+        with mock.patch('core.qr.decode', side_effect=[[], [found]]) as decode:
+            self.assertEqual(decode_image(self.make_photo('Деталь-42')), 'Деталь-42')
+        self.assertEqual(decode.call_count, 2)
+        self.assertEqual(decode.call_args.args[0].size, (1600, 1200))
+
+
+class DecodeCacheTests(TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = DecodeCache(max_size=2, ttl=60)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), '1')
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_expired_entry_is_a_miss(self):
+        cache = DecodeCache(max_size=2, ttl=-1)
+        cache.set('a', '1')
+        self.assertIsNone(cache.get('a'))
+
+
+class IncrementalBackupTests(WorkflowTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+
+    @override_settings(BACKUP_OVERLAP=0)
+    def test_incremental_contains_only_changed_rows(self):
+        self.assertEqual(run_backup(directory=self.directory)['type'], 'full')
+        add_quantity_and_start_working_time(self.order, 5)
+        entry = run_backup('incremental', self.directory)
+
+        self.assertEqual(entry['since'], load_manifest(self.directory)['backups'][0]['until'])
+        rows = {}
+        for model in (OrdersModel, ShiftModel):
+            path = f'{self.directory}/{entry["name"]}/{model._meta.label_lower}.jsonl.gz'
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                rows[model] = [json.loads(line) for line in file]
+        self.assertEqual([row['id'] for row in rows[OrdersModel]], [self.order.id])
+        self.assertEqual(rows[ShiftModel], [])
+
+    def test_restore_replays_full_and_incremental(self):
+        run_backup('full', self.directory)
+        add_quantity_and_start_working_time(self.order, 5)
+        run_backup('incremental', self.directory)
+        OrdersModel.objects.filter(id=self.order.id).update(num_parts=1)
+
+        restore_backup(self.directory)
+
+        self.assertEqual(OrdersModel.objects.get(id=self.order.id).num_parts, 5)
+
+    def test_incremental_overlaps_previous_backup(self):
+        full = run_backup('full', self.directory)
+        entry = run_backup('incremental', self.directory)
+
+        since = datetime.fromisoformat(entry['since'])
+        self.assertEqual(datetime.fromisoformat(full['until']) - since, timedelta(seconds=settings.BACKUP_OVERLAP))
+
+    @override_settings(BACKUP_OVERLAP=0)
+    def test_incremental_contains_only_new_events(self):
+        log_order_event(self.order, OrderEventModel.SCAN, timezone.now(), {'part_name': 'Вал'}, 'e1')
+        run_backup('full', self.directory)
+        event = log_order_event(self.order, OrderEventModel.QUANTITY, timezone.now(), {'num_parts': 5}, 'e2')
+        entry = run_backup('incremental', self.directory)
+
+        path = f'{self.directory}/{entry["name"]}/core.ordereventmodel.jsonl.gz'
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            self.assertEqual([json.loads(line)['id'] for line in file], [event.id])
+
+    def test_restore_rebuilds_rollups(self):
+        OrdersModel.objects.filter(id=self.order.id).update(end_working_time=timezone.now(), num_parts=3)
+        add_order_to_rollups(self.order)
+        entry = run_backup('full', self.directory)
+        with gzip.open(f'{self.directory}/{entry["name"]}/core.productionrollupmodel.jsonl.gz', 'rt') as file:
+            self.assertEqual(file.read(), '')
+        ProductionRollupModel.objects.all().delete()
+
+        restore_backup(self.directory)
+
+        self.assertEqual(get_rollups('day', group_by=['machine']).get()['num_parts'], 3)
+
+    def test_restore_repeats_deletions(self):
+        order_id = self.order.id
+        run_backup('full', self.directory)
+        self.order.delete()
+        entry = run_backup('incremental', self.directory)
+        self.assertTrue(os.path.exists(f'{self.directory}/{entry["name"]}/core.deletedrowmodel.jsonl.gz'))
+
+        restore_backup(self.directory)
+
+        self.assertFalse(OrdersModel.objects.filter(id=order_id).exists())
+
+
+class ExportTests(WorkflowTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.payload = {'part_name': 'Вал', 'num_parts': [1, 2]}
+        log_order_event(self.order, OrderEventModel.SCAN, timezone.now(), self.payload, 'e1')
+
+    def test_event_payload_is_json_in_every_format(self):
+        export_data(self.directory, ('xlsx', 'csv', 'jsonl'))
+
+        sheet = openpyxl.load_workbook(f'{self.directory}/core.xlsx', read_only=True)['core.ordereventmodel']
+        headers, row = list(sheet.values)
+        self.assertEqual(json.loads(row[headers.index('payload')]), self.payload)
+        with open(f'{self.directory}/core.ordereventmodel.csv', encoding='utf-8', newline='') as file:
+            row = next(csv.DictReader(file))
+        self.assertEqual(json.loads(row['payload']), self.payload)
+        with open(f'{self.directory}/core.ordereventmodel.jsonl', encoding='utf-8') as file:
+            row = json.loads(file.readline())
+        self.assertEqual(row['payload'], self.payload)
+
+
+    def test_typed_columns_round_trip(self):
+        start = timezone.now().replace(microsecond=0)
+        OrdersModel.objects.filter(id=self.order.id).update(start_time=start, bugs_time=timedelta(minutes=2, seconds=5))
+        unassigned = OrdersModel.objects.create(user=self.custom_user, related_to_shift=self.shift)
+        export_data(self.directory, ('xlsx', 'csv', 'jsonl'))
+        expected = {
+            self.order.id: (start, timedelta(minutes=2, seconds=5), self.machine.id),
+            unassigned.id: (None, None, None),
+        }
+
+        sheet = openpyxl.load_workbook(f'{self.directory}/core.xlsx', read_only=True)['core.ordersmodel']
+        headers, *rows = sheet.values
+        rows = [dict(zip(headers, row)) for row in rows]
+        self.assertEqual({row['id']: (
+            row['start_time'] and row['start_time'].replace(tzinfo=dt_timezone.utc),
+            row['bugs_time'],
+            row['machine'],
+        ) for row in rows}, expected)
+
+        with open(f'{self.directory}/core.ordersmodel.csv', encoding='utf-8', newline='') as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual({int(row['id']): (
+            parse_datetime(row['start_time']),
+            parse_duration(row['bugs_time']) if row['bugs_time'] else None,
+            int(row['machine']) if row['machine'] else None,
+        ) for row in rows}, expected)
+
+        with open(f'{self.directory}/core.ordersmodel.jsonl', encoding='utf-8') as file:
+            rows = [json.loads(line) for line in file]
+        self.assertEqual({row['id']: (
+            row['start_time'] and parse_datetime(row['start_time']),
+            row['bugs_time'] and parse_duration(row['bugs_time']),
+            row['machine'],
+        ) for row in rows}, expected)
+
+
+class BackupViewTests(WorkflowTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.is_superuser = True
+        self.user.save()
+
+    def test_backup_starts_task_with_known_formats(self):
+        with mock.patch('core.views.export_backup.delay', return_value=mock.Mock(id='t1')) as delay:
+            response = self.client.get(reverse('backup'), {'format': ['csv', 'exe']})
+
+        self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(['csv'])
+        self.assertEqual(response.json()['status_url'], reverse('backup_status', args=['t1']))
+
+    def get_status(self, result):
+        with mock.patch('core.views.export_backup.AsyncResult', return_value=result):
+            return self.client.get(reverse('backup_status', args=['t1'])).json()
+
+    def test_backup_status_reports_progress_and_files(self):
+        progress = {'model': 'core.ordersmodel', 'done': 10, 'total': 20}
+        self.assertEqual(self.get_status(mock.Mock(state='PROGRESS', info=progress)),
+                         {'status': 'PROGRESS', **progress})
+
+        done = mock.Mock(state='SUCCESS', result=['core.xlsx'], **{'successful.return_value': True})
+        self.assertEqual(self.get_status(done), {'status': 'SUCCESS', 'files': ['core.xlsx']})
+
+    def test_backup_requires_superuser(self):
+        self.user.is_superuser = False
+        self.user.save()
+
+        with mock.patch('core.views.export_backup.delay') as delay:
+            response = self.client.get(reverse('backup'))
+
+        self.assertEqual(response.status_code, 302)
+        delay.assert_not_called()
+
+
+class ParquetExportTests(WorkflowTestMixin, TestCase):
+    def test_partitioned_typed_columns(self):
+        OrdersModel.objects.filter(id=self.order.id).update(
+            start_time=timezone.now(), bugs_time=timedelta(minutes=2)
+        )
+        directory = tempfile.mkdtemp()
+        export_parquet(directory)
+
+        dataset = ds.dataset(f'{directory}/core.ordersmodel', format='parquet', partitioning='hive')
+        self.assertEqual(dataset.schema.field('start_time').type, pa.timestamp('us', tz='UTC'))
+        self.assertEqual(dataset.schema.field('bugs_time').type, pa.int64())
+        row = dataset.to_table().to_pylist()[0]
+        self.assertEqual(row['bugs_time'], 120 * 10 ** 6)
+        self.assertEqual(row['area'], self.custom_user.working_area_id)
+
+
+class ProductionRollupTests(WorkflowTestMixin, TestCase):
+    def end_order(self, order, minutes):
+        start = timezone.now() - timedelta(hours=1)
+        OrdersModel.objects.filter(id=order.id).update(
+            num_parts=2, scan_time=start, machine_start_time=start,
+            machine_end_time=start + timedelta(minutes=minutes), bugs_time=timedelta(),
+        )
+        order.refresh_from_db()
+        add_end_working_time(order)
+        add_order_to_rollups(order)
+
+    def test_incremental_matches_rebuild(self):
+        second_order = OrdersModel.objects.create(
+            user=self.custom_user, machine=self.machine, related_to_shift=self.shift, part_name='Деталь 2',
+        )
+        self.end_order(self.order, 20)
+        self.end_order(second_order, 10)
+        incremental = list(get_rollups('hour'))
+
+        rebuild_rollups()
+
+        self.assertEqual(list(get_rollups('hour')), incremental)
+        self.assertEqual(ProductionRollupModel.objects.filter(granularity='day').count(), 1)
+        row = get_rollups('day', group_by=['machine']).get()
+        self.assertEqual(row['num_orders'], 2)
+        self.assertEqual(row['num_parts'], 4)
+        self.assertEqual(row['good_time'], timedelta(minutes=30))
+
+    def test_stopped_order_is_added_once(self):
+        stop_order(self.order)
+        self.assertIsNone(stop_order(self.order))
+        finalize_shift(self.shift.id)
+
+        row = get_rollups('day', group_by=['machine']).get()
+        self.assertEqual(row['num_orders'], 1)
+        self.assertEqual(row['num_ended_orders'], 0)
+
+    def test_orders_without_machine_share_one_row(self):
+        second_order = OrdersModel.objects.create(user=self.custom_user, related_to_shift=self.shift)
+        OrdersModel.objects.filter(id=self.order.id).update(machine=None)
+        self.order.refresh_from_db()
+        self.end_order(self.order, 20)
+        self.end_order(second_order, 10)
+
+        self.assertEqual(ProductionRollupModel.objects.filter(granularity='day').get().num_orders, 2)
+
+    def test_row_created_concurrently_is_incremented(self):
+        self.end_order(self.order, 20)
+        second_order = OrdersModel.objects.create(
+            user=self.custom_user, machine=self.machine, related_to_shift=self.shift,
+        )
+        update = QuerySet.update
+        missed = []
+
+        def update_before_insert(queryset, **kwargs):
+            # Строку разреза вставил параллельный заказ уже после первого UPDATE
+            if queryset.model is ProductionRollupModel and not missed:
+                missed.append(queryset)
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update_before_insert):
+            self.end_order(second_order, 10)
+
+        self.assertEqual(len(missed), 1)
+        self.assertEqual(ProductionRollupModel.objects.filter(granularity='hour').get().num_orders, 2)
+
+    def test_rollups_view(self):
+        self.end_order(self.order, 20)
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.client.get(reverse('rollups'), {'granularity': 'day', 'group_by': 'machine'})
+
+        self.assertEqual(response.status_code, 200)
+        row = response.json()['rows'][0]
+        self.assertEqual(row['machine'], self.machine.id)
+        self.assertEqual(row['good_time'], 20 * 60)
+
+    def test_rollups_view_rejects_bad_time(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        for params in ({'since': 'вчера'}, {'until': '2024-13-01T00:00:00'}, {'machine': 'x'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(reverse('rollups'), params).status_code, 400)
+
+    def test_rebuild_since_naive_time(self):
+        self.end_order(self.order, 20)
+
+        call_command('rebuild_rollups', since=f'{timezone.localdate():%Y-%m-%d}T00:00:00', stdout=io.StringIO())
+
+        self.assertEqual(get_rollups('day').get()['num_orders'], 1)
+
+
+class FinalizeShiftTests(WorkflowTestMixin, TestCase):
+    # Задачи Celery, которыми смена закрывалась до finalize_shift, в порядке цепочки
+    LEGACY_CHAIN = (
+        calculate_shift_end_time, count_num_ended_orders, calculate_shift_time_total, calculate_total_bugs_time,
+        calculate_good_time, calculate_bad_time, calculate_lost_time,
+    )
+    FIELDS = ('end_time', 'num_ended_orders', 'time_total', 'total_bugs_time', 'good_time', 'bad_time', 'lost_time')
+
+    def test_matches_legacy_chain(self):
+        now = timezone.now()
+        start = now - timedelta(hours=2)
+        ShiftModel.objects.filter(id=self.shift.id).update(start_time=now - timedelta(hours=8))
+        OrdersModel.objects.filter(id=self.order.id).update(
+            num_parts=4, scan_time=start, machine_start_time=start + timedelta(minutes=10),
+            machine_end_time=start + timedelta(minutes=50), end_working_time=start + timedelta(minutes=60),
+            bugs_time=timedelta(minutes=5), hold_time=timedelta(minutes=3),
+        )
+        OrdersModel.objects.create(
+            user=self.custom_user, machine=self.machine, related_to_shift=self.shift, ended_early=True,
+            scan_time=start, machine_start_time=start + timedelta(minutes=70), end_working_time=now,
+        )
+
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            for task in self.LEGACY_CHAIN:
+                self.assertEqual(task(self.shift.id), self.shift.id, task.__name__)
+            legacy = ShiftModel.objects.values(*self.FIELDS).get(id=self.shift.id)
+            self.assertEqual(finalize_shift(self.shift.id), self.shift.id)
+
+        self.assertEqual(ShiftModel.objects.values(*self.FIELDS).get(id=self.shift.id), legacy)
+        self.assertEqual(legacy['num_ended_orders'], 1)
+        self.assertEqual(legacy['good_time'], timedelta(minutes=40))
+        self.assertEqual(legacy['bad_time'], timedelta(minutes=12))
+
+
+class MachinesStreamTests(WorkflowTestMixin, TestCase):
+    def test_snapshot_without_redis(self):
+        response = self.client.get(reverse('machines_stream'))
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response).decode('utf-8')
+        event, data = body.split('\n\n')[1].split('\n')
+        self.assertEqual(event, 'event: snapshot')
+        state = json.loads(data.removeprefix('data: '))[0]
+        self.assertEqual(state['id'], self.machine.id)
+        self.assertEqual(state['order_id'], self.order.id)
+        self.assertTrue(state['is_in_progress'])
+
+    def test_anonymous_is_rejected(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('machines_stream')).status_code, 401)
+
+    def test_snapshot_warms_up_hash_once(self):
+        client = mock.Mock(**{'exists.side_effect': [0, 1], 'hvals.return_value': []})
+        with mock.patch.object(machine_state_cache, '_redis', client):
+            machine_state_cache.snapshot()
+            machine_state_cache.snapshot()
+        pipe = client.pipeline.return_value
+        pipe.hsetnx.assert_called_once_with(MACHINE_STATE_KEY, self.machine.id, mock.ANY)
+        pipe.set.assert_called_once_with(MACHINE_STATE_READY_KEY, 1)
+
+    def test_deleted_machine_is_removed_from_hash(self):
+        client = mock.Mock()
+        machine_id = self.machine.id
+        with mock.patch.object(machine_state_cache, '_redis', client):
+            self.machine.delete()
+        client.pipeline.return_value.hdel.assert_called_once_with(MACHINE_STATE_KEY, machine_id)
+
+
+class AsyncEndpointsTests(WorkflowTestMixin, TestCase):
+    def test_report_send(self):
+        response = self.client.post(reverse('report_page'), {'bug_description': 'Не включается'})
+
+        self.assertEqual(response.content, b'Report sent successfully')
+        report = ReportsModel.objects.get()
+        self.assertEqual(report.order_id, self.order.id)
+        self.assertTrue(MachineModel.objects.get(id=self.machine.id).is_broken)
+
+    def test_solve_report(self):
+        report = ReportsModel.objects.create(user=self.custom_user, order=self.order, description='Сломан')
+        MachineModel.objects.filter(id=self.machine.id).update(is_broken=True)
+
+        response = self.client.post(reverse('reports_view'), {'bug_id': report.id, 'is_solved': True})
+
+        self.assertEqual(response.json(), {'status': 'success'})
+        report.refresh_from_db()
+        self.assertTrue(report.is_solved)
+        self.assertIsNotNone(report.end_time)
+        self.assertFalse(MachineModel.objects.get(id=self.machine.id).is_broken)
+
+    def test_reports_page(self):
+        ReportsModel.objects.create(user=self.custom_user, order=self.order, description='Сломан')
+
+        response = self.client.get(reverse('reports_view'))
+
+        self.assertContains(response, 'Сломан')
+
+    def test_anonymous_is_redirected(self):
+        self.client.logout()
+
+        response = self.client.post(reverse('request_send'), {'request_description': 'Нужен инструмент'})
+
+        self.assertRedirects(response, f"/login/?next={reverse('request_send')}", fetch_redirect_response=False)
+
+
+class MachineClaimTests(WorkflowTestMixin, TestCase):
+    def test_busy_machine_is_not_claimed(self):
+        self.assertIsNone(start_new_order(self.custom_user, self.shift, self.machine.id))
+
+        self.assertEqual(OrdersModel.objects.count(), 1)
+        self.assertEqual(MachineModel.objects.get(id=self.machine.id).order_in_progress_id, self.order.id)
+
+    def test_stale_order_does_not_release_machine(self):
+        stale_order = OrdersModel.objects.create(
+            user=self.custom_user, machine=self.machine, related_to_shift=self.shift, part_name='Старый',
+        )
+
+        stop_order(stale_order)
+
+        machine = MachineModel.objects.get(id=self.machine.id)
+        self.assertTrue(machine.is_in_progress)
+        self.assertEqual(machine.order_in_progress_id, self.order.id)
+
+
+class OrderEventsTests(WorkflowTestMixin, TestCase):
+    def post_events(self, events):
+        return self.client.post(reverse('order_events'), json.dumps({'events': events}),
+                                content_type='application/json')
+
+    def event(self, key, step, minutes, payload=None, order=None):
+        return {
+            'key': key,
+            'order': order or self.order.id,
+            'step': step,
+            'client_ts': (self.started + timedelta(minutes=minutes)).isoformat(),
+            'payload': payload or {},
+        }
+
+    def setUp(self):
+        super().setUp()
+        self.started = timezone.now() - timedelta(hours=1)
+
+    def test_offline_batch_applies_whole_workflow(self):
+        events = [
+            self.event('e1', 'scan', 0, {'part_name': 'Вал'}),
+            self.event('e2', 'quantity', 1, {'quantity': 3}),
+            self.event('e3', 'setup', 5),
+            self.event('e4', 'processing', 25),
+            self.event('e5', 'ending', 30),
+        ]
+
+        response = self.post_events(events)
+
+        self.assertEqual([result['status'] for result in response.json()['results']], ['applied'] * 5)
+        order = OrdersModel.objects.get(id=self.order.id)
+        self.assertEqual(order.part_name, 'Вал')
+        self.assertEqual(order.num_parts, 3)
+        self.assertEqual(order.machine_end_time - order.machine_start_time, timedelta(minutes=20))
+        self.assertEqual(order.end_working_time, self.started + timedelta(minutes=30))
+        self.assertFalse(MachineModel.objects.get(id=self.machine.id).is_in_progress)
+        self.assertEqual(ProductionRollupModel.objects.filter(granularity='day').count(), 1)
+
+    def test_resent_events_are_not_applied_twice(self):
+        events = [self.event('e1', 'scan', 0, {'part_name': 'Вал'}), self.event('e2', 'ending', 30)]
+        self.post_events(events)
+
+        response = self.post_events(events + [self.event('e3', 'setup', 31)])
+
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ['duplicate', 'duplicate', 'rejected'])
+        self.assertEqual(OrderEventModel.objects.count(), 2)
+
+    def test_key_accepted_concurrently_is_duplicate(self):
+        def accept_concurrently(event):
+            # Параллельный запрос принимает тот же ключ после проверки уже принятых ключей
+            log_order_event(self.order, 'scan', self.started, {'part_name': 'Вал'}, event['key'])
+            return parse_order_event(event)
+
+        with mock.patch('core.buisness.parse_order_event', side_effect=accept_concurrently):
+            response = self.post_events([self.event('e1', 'scan', 0, {'part_name': 'Вал'})])
+
+        self.assertEqual(response.json()['results'], [{'key': 'e1', 'status': 'duplicate'}])
+        self.assertEqual(OrderEventModel.objects.count(), 1)
+
+    def test_rejected_event_does_not_stop_batch(self):
+        other_user = CustomUserModel.objects.create(
+            user=User.objects.create_user(username='other'), phone_number='+70000000001',
+            role=self.custom_user.role, position=self.custom_user.position,
+            working_area=self.custom_user.working_area,
+        )
+        foreign_order = OrdersModel.objects.create(user=other_user, related_to_shift=self.shift)
+
+        response = self.post_events([
+            self.event('e1', 'quantity', 0, {'quantity': 'много'}),
+            self.event('e2', 'setup', 1, order=foreign_order.id),
+            {'key': 'e3', 'step': 'unknown'},
+            self.event('e4', 'setup', 2),
+        ])
+
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ['rejected', 'rejected', 'rejected', 'applied'])
+        self.assertEqual(list(OrderEventModel.objects.values_list('idempotency_key', flat=True)), ['e4'])
+        self.assertEqual(OrdersModel.objects.get(id=self.order.id).num_parts, 0)
+
+
+class OrderEventLogTests(WorkflowTestMixin, TestCase):
+    def test_every_hold_is_counted(self):
+        request = mock.Mock(META={'HTTP_REFERER': '/shift/quantity/'})
+        started = timezone.now() - timedelta(hours=1)
+        for minutes in (0, 10, 20):
+            set_on_hold(request, self.order, started + timedelta(minutes=minutes))
+            remove_hold(self.order, started + timedelta(minutes=minutes + 5))
+        # Повторное продолжение не добавляет паузу второй раз
+        remove_hold(self.order, started + timedelta(minutes=40))
+
+        self.assertEqual(OrdersModel.objects.get(id=self.order.id).hold_time, timedelta(minutes=15))
+        self.assertEqual(OrderEventModel.objects.filter(order=self.order, step='pause').count(), 3)
+
+    def test_hold_while_machine_runs_is_good_time(self):
+        started = timezone.now()
+        self.assertEqual(
+            hold_duration(started, started + timedelta(minutes=30),
+                          started + timedelta(minutes=10), started + timedelta(minutes=20)),
+            timedelta(minutes=20),
+        )
+
+    def test_materialize_rebuilds_order_and_bad_time(self):
+        started = timezone.now() - timedelta(hours=1)
+        at = lambda minutes: started + timedelta(minutes=minutes)
+        add_part_name(self.order, 'Вал', at(0))
+        add_quantity_and_start_working_time(self.order, 2, at(1))
+        for step, minutes in (('pause', 2), ('resume', 7), ('pause', 8), ('resume', 10)):
+            log_order_event(self.order, step, at(minutes))
+        add_machine_start_time(self.order, at(10))
+        add_machine_end_time(self.order, at(30))
+        add_end_working_time(self.order, at(40))
+        OrdersModel.objects.filter(id=self.order.id).update(
+            part_name='', num_parts=0, machine_start_time=None, hold_time=timedelta(), bugs_time=timedelta(),
+        )
+        ShiftModel.objects.filter(id=self.shift.id).update(end_time=at(50))
+
+        self.assertEqual(materialize_orders([self.order.id]), 1)
+
+        order = OrdersModel.objects.get(id=self.order.id)
+        self.assertEqual((order.part_name, order.num_parts, order.machine_start_time), ('Вал', 2, at(10)))
+        self.assertEqual(order.hold_time, timedelta(minutes=7))
+        # 40 минут заказа - 20 минут станка - 7 минут пауз
+        self.assertEqual(ShiftModel.objects.get(id=self.shift.id).bad_time, timedelta(minutes=13))
+
+
+class StructuredLoggingTests(WorkflowTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.stream = io.StringIO()
+        self.handler = BackgroundStreamHandler(self.stream)
+        self.logger = logging.getLogger('core.tests.structured')
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def test_record_is_written_as_json_without_queries(self):
+        self.logger.setLevel(logging.INFO)
+        with self.assertNumQueries(0):
+            get_logger(self.logger.name).info('order_started', user=self.custom_user, order=self.order.id)
+            self.handler._stop()
+
+        record = json.loads(self.stream.getvalue())
+        self.assertEqual(record['event'], 'order_started')
+        self.assertEqual(record['func'], 'test_record_is_written_as_json_without_queries')
+        self.assertEqual((record['user'], record['order']), (self.custom_user.id, self.order.id))
+
+    def test_disabled_level_is_not_formatted(self):
+        self.logger.setLevel(logging.WARNING)
+        field = mock.Mock(__str__=mock.Mock(side_effect=AssertionError))
+        get_logger(self.logger.name).info('ignored', field=field)
+        self.handler._stop()
+
+        self.assertEqual(self.stream.getvalue(), '')
+
+
+class MetricsTests(WorkflowTestMixin, TestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_latency_and_queries_per_view(self):
+        count = self.sample('core_request_duration_seconds_count', view='shift_scan_page', method='GET')
+        queries = self.sample('core_request_db_queries_sum', view='shift_scan_page')
+
+        self.client.get(reverse('shift_scan_page'))
+
+        self.assertEqual(
+            self.sample('core_request_duration_seconds_count', view='shift_scan_page', method='GET'), count + 1)
+        self.assertGreater(self.sample('core_request_db_queries_sum', view='shift_scan_page'), queries)
+
+    def test_async_view_queries_are_counted(self):
+        queries = self.sample('core_request_db_queries_sum', view='reports_view')
+
+        self.client.get(reverse('reports_view'))
+
+        self.assertGreater(self.sample('core_request_db_queries_sum', view='reports_view'), queries)
+
+    def test_metrics_endpoint(self):
+        count = self.sample('core_step_duration_seconds_count', step='add_machine_start_time')
+        add_machine_start_time(self.order)
+
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(self.sample('core_step_duration_seconds_count', step='add_machine_start_time'), count + 1)
+        self.assertIn(b'core_request_duration_seconds_bucket', response.content)
+        self.assertIn(b'core_qr_decode_cache_hits_total', response.content)
+
+    def test_qr_decode_cache_counters(self):
+        hits = self.sample('core_qr_decode_cache_hits_total')
+        misses = self.sample('core_qr_decode_cache_misses_total')
+        cache = DecodeCache(max_size=2, ttl=60)
+        cache.set('a', '1')
+
+        cache.get('a')
+        cache.get('b')
+
+        self.assertEqual(self.sample('core_qr_decode_cache_hits_total'), hits + 1)
+        self.assertEqual(self.sample('core_qr_decode_cache_misses_total'), misses + 1)
+
+    def test_metrics_endpoint_is_closed_to_external_clients(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.7')
+        self.assertEqual(response.status_code, 200)
+
+
+class SyntheticDataTests(TestCase):
+    UNTIL = date(2024, 6, 3)
+
+    def snapshot(self):
+        return list(
+            OrdersModel.objects.filter(user__user__username__startswith='gen7_').order_by('id').values_list(
+                'user__user__username', 'related_to_shift__start_time', 'part_name', 'num_parts', 'scan_time',
+                'machine_end_time', 'bugs_time', 'hold_time', 'ended_early',
+            )
+        )
+
+    def test_same_seed_gives_same_data(self):
+        counts = generate_data(500, users=4, seed=7, until=self.UNTIL, batch_size=100)
+        self.assertEqual(counts['orders'], 500)
+        self.assertEqual(OrdersModel.objects.count(), 500)
+        first = self.snapshot()
+        # Повторный запуск с тем же seed не добавляет данные
+        with self.assertRaises(ValueError):
+            generate_data(500, users=4, seed=7, until=self.UNTIL)
+
+        User.objects.filter(username__startswith='gen7_').delete()
+        generate_data(500, users=4, seed=7, until=self.UNTIL, batch_size=1000)
+        self.assertEqual(self.snapshot(), first)
+
+    def test_shift_totals_match_finalize_shift(self):
+        generate_data(300, users=3, seed=8, until=self.UNTIL)
+        shift = ShiftModel.objects.order_by('id').first()
+        totals = OrdersModel.objects.filter(related_to_shift=shift).aggregate(
+            good_time=Sum(GOOD_TIME_EXPRESSION, filter=GOOD_TIME_FILTER),
+            bad_time=Sum(BAD_TIME_EXPRESSION, filter=BAD_TIME_FILTER),
+            total_bugs_time=Sum('bugs_time'),
+        )
+        self.assertEqual(shift.good_time, totals['good_time'])
+        self.assertEqual(shift.bad_time, totals['bad_time'])
+        self.assertEqual(shift.total_bugs_time, totals['total_bugs_time'])
+        self.assertLess(shift.end_time.date(), self.UNTIL)
+        # Последовательности сдвинуты за сгенерированные ID
+        self.assertGreater(ShiftModel.objects.create(user=shift.user).id, shift.id)
+
+    def test_holds_and_bad_time_obey_invariants(self):
+        generate_data(1000, users=2, seed=9, until=self.UNTIL)
+
+        holds = 0
+        for order in OrdersModel.objects.all():
+            bad_time = (order.end_working_time - order.scan_time - (order.machine_end_time - order.machine_start_time)
+                        - order.bugs_time - order.hold_time)
+            self.assertGreaterEqual(bad_time, timedelta(), order.id)
+            if order.hold_started is not None:
+                holds += 1
+                self.assertEqual(order.hold_time, hold_duration(
+                    order.hold_started, order.hold_ended, order.machine_start_time, order.machine_end_time))
+        self.assertGreater(holds, 0)
+        self.assertFalse(ShiftModel.objects.filter(bad_time__lt=timedelta()).exists())
+
+
+class AdminChangelistTests(WorkflowTestMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser(username='admin', password='admin'))
+
+    def changelist(self, **params):
+        return self.client.get(reverse('admin:core_ordersmodel_changelist'), params)
+
+    def test_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as one_order:
+            self.assertEqual(self.changelist().status_code, 200)
+        OrdersModel.objects.bulk_create([
+            OrdersModel(user=self.custom_user, machine=self.machine, related_to_shift=self.shift, part_name='Деталь')
+            for _ in range(5)
+        ])
+        with CaptureQueriesContext(connection) as six_orders:
+            self.assertEqual(self.changelist().status_code, 200)
+        self.assertEqual(len(six_orders), len(one_order))
+
+    def test_id_filter_and_search(self):
+        other_shift = ShiftModel.objects.create(user=self.custom_user)
+        OrdersModel.objects.create(user=self.custom_user, machine=self.machine, related_to_shift=other_shift,
+                                   part_name='Деталь')
+
+        response = self.changelist(related_to_shift_id=self.shift.id)
+        self.assertEqual([order.id for order in response.context['cl'].result_list], [self.order.id])
+        response = self.changelist(q=str(self.order.id))
+        self.assertEqual([order.id for order in response.context['cl'].result_list], [self.order.id])
+        # Поиск подстроки по всей таблице не выполняется
+        response = self.changelist(q=self.order.part_name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Оценка количества строк есть только в PostgreSQL')
+    def test_estimated_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_ordersmodel')
+        with mock.patch('core.admin.EXACT_COUNT_LIMIT', 0):
+            self.assertEqual(estimated_count(OrdersModel.objects.all()), OrdersModel.objects.count())
+            self.assertEqual(estimated_count(OrdersModel.objects.filter(id=self.order.id)), 1)
+            self.assertEqual(estimated_count(OrdersModel.objects.none()), 0)
+        # Небольшие таблицы считаются точно
+        self.assertIsNone(estimated_count(OrdersModel.objects.all()))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Параллельные транзакции проверяются только на PostgreSQL')
+class MachineClaimConcurrencyTests(WorkflowTestMixin, TransactionTestCase):
+    THREADS = 16
+    ROUNDS = 5
+
+    def setUp(self):
+        self.setUpTestData()
+        MachineModel.objects.filter(id=self.machine.id).update(is_in_progress=False, order_in_progress=None)
+
+    def hammer(self, target):
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+
+        def worker():
+            try:
+                barrier.wait()
+                results.append(target())
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_only_one_operator_claims_machine(self):
+        for _ in range(self.ROUNDS):
+            orders_before = OrdersModel.objects.count()
+            orders = self.hammer(lambda: start_new_order(self.custom_user, self.shift, self.machine.id))
+
+            claimed = [order for order in orders if order is not None]
+            self.assertEqual(len(claimed), 1)
+            # Заказы проигравших операторов откатываются
+            self.assertEqual(OrdersModel.objects.count(), orders_before + 1)
+            self.assertEqual(MachineModel.objects.get(id=self.machine.id).order_in_progress_id, claimed[0].id)
+
+            stop_order(claimed[0])
+
+    def test_claim_and_release_interleaved(self):
+        def claim_then_release():
+            order = OrdersModel.objects.create(
+                user=self.custom_user, machine=self.machine, related_to_shift=self.shift, part_name='Деталь',
+            )
+            if claim_machine(self.machine.id, order):
+                stop_order(order)
+                return order.id
+            return None
+
+        for _ in range(self.ROUNDS):
+            self.hammer(claim_then_release)
+
+        machine = MachineModel.objects.get(id=self.machine.id)
+        self.assertFalse(machine.is_in_progress)
+        self.assertIsNone(machine.order_in_progress_id)
@@ -2,7 +2,8 @@ from django.urls import path
 
 from core.views import decode_photo, pre_shift_view, login_view, logout_view, shift_main_view, order_scan_view, \
     order_quantity_view, order_setup_view, order_processing_view, order_ending_view, report_send, reports_view, \
-    request_send, backup
+    request_send, backup, backup_status, decode_photo_status, rollups_view, \
+    machines_board, machines_stream, order_events, metrics
 
 urlpatterns = [
     path('', pre_shift_view, name='main'),
@@ -11,13 +12,20 @@ urlpatterns = [
     path('reports/', reports_view, name='reports_view'),
     path('request/', request_send, name='request_send'),
     path('qr-decoder/', decode_photo, name='decode_photo'),
+    path('qr-decoder/<str:task_id>/', decode_photo_status, name='decode_photo_status'),
     path('shift/scan/', order_scan_view, name='shift_scan_page'),
     path('shift/quantity/', order_quantity_view, name='shift_qauntity_page'),
     path('shift/setup/', order_setup_view, name='shift_setup_page'),
     path('shift/processing/', order_processing_view, name='shift_processing_page'),
     path('shift/ending/', order_ending_view, name='shift_ending_page'),
+    path('shift/events/', order_events, name='order_events'),
     path('login/', login_view, name='login'),
     path('logout/', logout_view, name='logout'),
-    path('backup/', backup, name='backup')
+    path('backup/', backup, name='backup'),
+    path('backup/<str:task_id>/', backup_status, name='backup_status'),
+    path('rollups/', rollups_view, name='rollups'),
+    path('machines/', machines_board, name='machines_board'),
+    path('machines/stream/', machines_stream, name='machines_stream'),
+    path('metrics', metrics, name='metrics'),
 
 ]
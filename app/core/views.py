@@ -1,57 +1,215 @@
-import os
+import ipaddress
+import json
+import time
 import traceback
-import pandas as pd
+
+from asgiref.sync import sync_to_async
+from celery.exceptions import TimeoutError as CeleryTimeoutError
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.core.handlers.asgi import ASGIRequest
 from django.db.models.expressions import NoneType
-from django.http import JsonResponse
-from django.shortcuts import render, redirect, get_object_or_404
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect
+from django.urls import reverse
 
 from core.buisness import *
+from core.export import EXPORT_FORMATS
+from core.async_auth import async_login_required
 from core.forms import ReportEditForm
+from core.log import get_logger
+from core.lookup_cache import get_user_machines
+from core.machine_state import machine_state_cache
+from core.metrics import render_metrics
 from core.models import CustomUserModel
+from core.qr_cache import qr_decode_cache
+from core.tasks import decode_qr_image, export_backup
+from core.work_context import with_work_context
 
 
-logger = logging.getLogger('django')
+logger = get_logger(__name__)
 
 
 @login_required(login_url='login')
 @user_passes_test(lambda u: u.is_superuser)
 def backup(request):
-    filename = timezone.now().date()
-    backup_dir = "./backups"
-    # Создаем директорию, если ее нет
-    if not os.path.exists(backup_dir):
-        os.makedirs(backup_dir)
-    json_filepath = os.path.join(backup_dir, f"{filename}.json")
-    excel_filepath = os.path.join(backup_dir, f"{filename}.xlsx")
+    """
+    Запускает фоновую выгрузку всех данных core.
+    Необязательный GET-параметр format (можно несколько): xlsx, csv, jsonl.
+    """
+    formats = [name for name in request.GET.getlist('format') if name in EXPORT_FORMATS] or list(EXPORT_FORMATS)
+    result = export_backup.delay(formats)
+    logger.info('backup_started', task=result.id, formats=formats)
+
+    return JsonResponse({
+        'task_id': result.id,
+        'status_url': reverse('backup_status', args=[result.id]),
+    }, status=202)
+
+
+@login_required(login_url='login')
+@user_passes_test(lambda u: u.is_superuser)
+def backup_status(request, task_id):
+    """
+    Статус и прогресс выгрузки, запущенной backup.
+    """
+    result = export_backup.AsyncResult(task_id)
+    response = {'status': result.state}
+    if result.state == 'PROGRESS':
+        response.update(result.info)
+    elif result.successful():
+        response['files'] = result.result
+    elif result.failed():
+        response['error'] = str(result.result)
+    return JsonResponse(response)
+
+
+@login_required(login_url='login')
+@user_passes_test(lambda u: u.is_staff)
+def rollups_view(request):
+    """
+    Итоги производства для дашбордов.
+
+    GET-параметры: granularity (hour, day), since и until (ISO 8601),
+    group_by (можно несколько: machine, working_area, position),
+    machine, working_area, position - ID для фильтра.
+    Длительности возвращаются в секундах.
+    """
+    granularity = request.GET.get('granularity', ProductionRollupModel.DAY)
+    if granularity not in dict(ProductionRollupModel.GRANULARITY_CHOICES):
+        return JsonResponse({'error': 'Неизвестный период'}, status=400)
+
+    group_by = [name for name in request.GET.getlist('group_by') if name in ROLLUP_DIMENSIONS] or ROLLUP_DIMENSIONS
+    filters = {f'{name}_id': request.GET[name] for name in ROLLUP_DIMENSIONS if request.GET.get(name)}
+    if not all(value.isdigit() for value in filters.values()):
+        return JsonResponse({'error': 'Неверный ID для фильтра'}, status=400)
+    since = parse_local_datetime(request.GET['since']) if request.GET.get('since') else None
+    until = parse_local_datetime(request.GET['until']) if request.GET.get('until') else None
+    if (request.GET.get('since') and since is None) or (request.GET.get('until') and until is None):
+        return JsonResponse({'error': 'Неверное время, ожидается ISO 8601'}, status=400)
+
+    rows = []
+    for row in get_rollups(granularity, since, until, group_by, **filters):
+        for name, value in row.items():
+            if isinstance(value, timedelta):
+                row[name] = value.total_seconds()
+        rows.append(row)
+
+    return JsonResponse({'granularity': granularity, 'rows': rows})
+
+
+@login_required(login_url='login')
+def machines_board(request):
+    """
+    Табло состояния станков цеха, обновляется через machines_stream.
+    """
+    custom_user = CustomUserModel.objects.filter(user=request.user).first()
+    return render(request, 'include/machines_board.html', {'custom_user': custom_user})
 
-    # Создаем JSON-бэкап
-    with open(json_filepath, 'w') as json_file:
-        call_command('dumpdata', 'core', stdout=json_file, indent=3)
 
-    # Преобразуем JSON в DataFrame с использованием pandas
-    df = pd.read_json(json_filepath)
+async def machines_stream(request):
+    """
+    Server-Sent Events с состоянием станков: событие snapshot со всеми станками,
+    затем событие machine на каждое изменение, для удаленного станка - {"id": ..., "deleted": true}.
+    Данные берутся из Redis, в БД поток не ходит.
+
+    Под WSGI отдается только снимок, браузер переподключается через MACHINE_BOARD_RETRY мс.
+    """
+    is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+    if not is_authenticated:
+        return HttpResponse(status=401)
+
+    response = StreamingHttpResponse(
+        _machine_events(streaming=isinstance(request, ASGIRequest)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Отключает буферизацию ответа в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+async def _machine_events(streaming):
+    yield f'retry: {settings.MACHINE_BOARD_RETRY}\n\n'
+    yield _sse_event('snapshot', await sync_to_async(machine_state_cache.snapshot)())
+    if not streaming or not machine_state_cache.enabled:
+        return
+
+    # Поток закрывается через MACHINE_BOARD_STREAM_TTL секунд, браузер переподключается сам.
+    # Так соединения отключившихся экранов не копятся.
+    deadline = time.monotonic() + settings.MACHINE_BOARD_STREAM_TTL
+    changes = machine_state_cache.changes(heartbeat=settings.MACHINE_BOARD_HEARTBEAT)
+    try:
+        async for state in changes:
+            yield ': ping\n\n' if state is None else _sse_event('machine', state)
+            if time.monotonic() > deadline:
+                break
+    finally:
+        await changes.aclose()
 
-    # Создаем объект ExcelWriter для записи в файл Excel
-    with pd.ExcelWriter(excel_filepath, engine='xlsxwriter') as writer:
-        # Итерируем по уникальным моделям и сохраняем каждую в отдельном листе
-        for model in df['model'].unique():
-            model_df = df[df['model'] == model]
 
-            # Преобразуем столбец 'fields' в отдельные столбцы с использованием expand
-            fields_df = model_df['fields'].apply(pd.Series)
+async def decode_photo(request):
+    """
+    API endpoint to /qr-decoder/
+    Отдает результат из кэша по хэшу файла, иначе ставит распознавание в очередь qr
+    и ждет результат не дольше QR_DECODE_WAIT, не занимая поток воркера.
+    request: request
+    return: str, либо 202 с адресом для опроса, либо 429 при переполненной очереди
+    """
+    image_file = request.FILES.get('image')
+    if image_file is None:
+        return HttpResponse('Bad request', status=400)
 
-            # Добавляем столбец 'pk'
-            fields_df.insert(0, 'pk', model_df['pk'])
+    image_data = image_file.read()
+    cache_key = qr_decode_cache.key(image_data)
+    cached = await sync_to_async(qr_decode_cache.get, thread_sensitive=False)(cache_key)
+    if cached is not None:
+        return HttpResponse(cached or QR_DECODE_ERROR)
 
-            # Добавляем столбец 'model'
-            fields_df.insert(0, 'model', model)
+    result = await sync_to_async(submit_qr_decode, thread_sensitive=False)(image_data, cache_key)
+    if result is None:
+        return HttpResponse('Сервис распознавания перегружен, попробуйте еще раз', status=429)
 
-            fields_df.to_excel(writer, index=False, sheet_name=model)
+    try:
+        decoded_qr_data = await wait_qr_decode(result, settings.QR_DECODE_WAIT)
+    except CeleryTimeoutError:
+        return JsonResponse({
+            'task_id': result.id,
+            'status_url': reverse('decode_photo_status', args=[result.id]),
+        }, status=202)
+    except Exception:
+        logger.exception('decode_photo_failed')
+        return HttpResponse(QR_DECODE_ERROR)
+
+    await sync_to_async(qr_decode_cache.set, thread_sensitive=False)(cache_key, decoded_qr_data or '')
+    if decoded_qr_data is None:
+        logger.info('qr_not_decoded')
+        return HttpResponse(QR_DECODE_ERROR)
+
+    logger.info('qr_decoded', data=decoded_qr_data)
+    return HttpResponse(decoded_qr_data)
+
+
+async def decode_photo_status(request, task_id):
+    """
+    API endpoint to /qr-decoder/<task_id>/
+    Статус задачи распознавания, поставленной decode_photo.
+    """
+    result = decode_qr_image.AsyncResult(task_id)
+    if not await sync_to_async(result.ready, thread_sensitive=False)():
+        return JsonResponse({'status': 'pending'}, status=202)
+    if not result.successful():
+        return JsonResponse({'status': 'done', 'data': QR_DECODE_ERROR})
 
-    return HttpResponse(excel_filepath)
+    cache_key = await sync_to_async(qr_decode_cache.task_key, thread_sensitive=False)(task_id)
+    if cache_key:
+        await sync_to_async(qr_decode_cache.set, thread_sensitive=False)(cache_key, result.result or '')
+    return JsonResponse({'status': 'done', 'data': result.result or QR_DECODE_ERROR})
 
 
 def login_view(request):
@@ -73,8 +231,8 @@ def login_view(request):
 
         return render(request, 'include/login.html')
 
-    except Exception as e:
-        logger.error(f'An error occurred in login_view: {e}', exc_info=True)
+    except Exception:
+        logger.exception('login_view_failed')
         messages.error(request, 'Произошла ошибка в процессе входа. Пожалуйста, попробуйте еще раз.')
         return render(request, 'include/login.html')
 
@@ -111,41 +269,41 @@ def pre_shift_view(request):
         if request.method == 'POST':
             if 'start_shift' in request.POST:
                 get_last_or_create_shift(custom_user)
-                logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} "
-                            f"started-continued a shift")
+                logger.info('shift_started', user=custom_user.id)
                 return redirect('shift_main_page')
 
         return render(request, 'include/shift/pre_shift_page.html', context)
 
-    except Exception as e:
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in pre_shift_view: {e}", exc_info=True)
+    except Exception:
+        logger.exception('pre_shift_view_failed')
 
         return HttpResponse('Произошла ошибка')
 
 
 @login_required(login_url='/login/')
+@with_work_context
 def shift_main_view(request):
     """
     Главная страница смены
     """
     try:
-        custom_user = CustomUserModel.objects.get(id=request.user.id)
-        machines = custom_user.machine.all()
-        shift = get_last_or_create_shift(custom_user)
+        work_context = request.work_context
+        custom_user = work_context.custom_user
+        machines = get_user_machines(custom_user.id)
+        shift = work_context.shift
         shift_id = shift.id
-        has_unsolved_reports = ReportsModel.objects.filter(
-            order__related_to_shift=shift, is_solved=False
-        ).exists()
         context = {
             'user': request.user,
             'custom_user': custom_user,
             'machines': machines,
-            'has_unsolved_reports': has_unsolved_reports,
+            'has_unsolved_reports': work_context.has_unsolved_reports,
         }
 
         if request.method == 'POST':
             selected_machine_id = request.POST.get('selected_machine_id')
-            request.session['selected_machine_id'] = selected_machine_id
+            # Сессия пишется в БД только при смене станка
+            if request.session.get('selected_machine_id') != selected_machine_id:
+                request.session['selected_machine_id'] = selected_machine_id
 
             if 'continue' in request.POST:
                 order = get_order(custom_user, shift, selected_machine_id)
@@ -155,29 +313,28 @@ def shift_main_view(request):
                     try:
                         url = ReportsModel.objects.filter(order__machine_id=selected_machine_id).last().url
                     except:
-                        logger.error(f"An error occurred while getting hold URL: {traceback.format_exc()}")
+                        logger.exception('hold_url_not_found', machine=selected_machine_id)
                         return HttpResponse(f'Произошла ошибка: <br>{traceback.format_exc()} '
                                             f'<br> Обратитесь к администратору, мы все исправим :)'
                                             f'А пока что вернитесь назад используя браузер и экстренно завершив заказ')
 
-                logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} "
-                            f"continued working on machine {selected_machine_id}. Order {order.id} ")
+                logger.info('order_continued', user=custom_user.id, machine=selected_machine_id, order=order.id)
                 remove_hold(order)
                 return redirect(url)
 
             if 'start_new' in request.POST:
                 new_order = start_new_order(custom_user, shift, selected_machine_id)
-                logger.info(
-                    f"{datetime.datetime.now()} |INFO| User {custom_user}"
-                    f" started a new order #{new_order.id} on machine {selected_machine_id}.")
+                if new_order is None:
+                    messages.error(request, 'Станок уже занят или сломан, выберите другой.')
+                    return redirect('shift_main_page')
+                logger.info('new_order_started', user=custom_user.id, order=new_order.id, machine=selected_machine_id)
 
                 return redirect('shift_scan_page')
 
             if 'stop_working' in request.POST:
                 order = get_order(custom_user, shift, selected_machine_id)
                 stop_order(order)
-                logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} "
-                            f"early stopped working on machine {selected_machine_id}. Order {order.id}")
+                logger.info('order_stopped_early', user=custom_user.id, machine=selected_machine_id, order=order.id)
 
                 return redirect('shift_main_page')
 
@@ -185,46 +342,36 @@ def shift_main_view(request):
                 if not is_all_orders_ended(shift):
                     messages.error(request, 'Необходимо завершить все заказы!')
                     return redirect('shift_main_page')
-                count_and_end_shift.delay(shift_id)
-                logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} ended the shift {shift.id}.")
+                end_shift(shift_id)
+                logger.info('shift_ended', user=custom_user.id, shift=shift.id)
 
                 return redirect('main')
 
         return render(request, 'include/shift/main_page.html', context)
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in shift_main_view: {e}")
+        logger.exception('shift_main_view_failed')
 
         # Вернуть страницу с сообщением об ошибке или выполнить другие действия по вашему усмотрению
         return HttpResponse('Произошла ошибка')
 
 
 @login_required(login_url='/login/')
+@with_work_context
 def order_scan_view(request):
     try:
-        custom_user = CustomUserModel.objects.get(id=request.user.id)
-        shift = get_last_or_create_shift(custom_user)
-        order = get_order(custom_user, shift, request.session.get('selected_machine_id'))
-        has_unsolved_reports = ReportsModel.objects.filter(
-            order__related_to_shift=shift, is_solved=False
-        ).exists()
-        context = {
-            'user': request.user,
-            'custom_user': custom_user,
-            'shift': shift,
-            'order': order,
-            'has_unsolved_reports': has_unsolved_reports
-        }
+        work_context = request.work_context
+        custom_user = work_context.custom_user
+        order = work_context.order
+        context = work_context.as_context(qr_client_decode=settings.QR_CLIENT_DECODE)
         save_url(request, order)
 
         if request.method == 'POST':
             if 'back' in request.POST:
                 machine_free(order, 'in_progress')
                 # Логирование события возврата на предыдущую страницу
-                logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} "
-                            f"returned to the main shift page from order scanning. "
-                            f"Order {order.id} deleted.")
+                logger.info('order_scan_cancelled', user=custom_user.id, order=order.id)
                 order.delete()
                 return redirect('shift_main_page')
 
@@ -232,38 +379,28 @@ def order_scan_view(request):
             add_part_name(order, part_name)
 
             # Логирование события добавления наименования детали
-            logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} "
-                        f"added part name '{part_name}' to the order {order.id}")
+            logger.info('part_name_submitted', user=custom_user.id, order=order.id, part_name=part_name)
 
             return redirect('shift_qauntity_page')
 
         return render(request, 'include/shift/scan_name_page.html', context)
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in order_scan_view: {e}", exc_info=True)
+        logger.exception('order_scan_view_failed')
 
         # Вернуть страницу с сообщением об ошибке или выполнить другие действия по вашему усмотрению
         return HttpResponse('Произошла ошибка')
 
 
 @login_required(login_url='/login/')
+@with_work_context
 def order_quantity_view(request):
     try:
-        custom_user = CustomUserModel.objects.get(id=request.user.id)
-        shift = get_last_or_create_shift(custom_user)
-        order = get_order(custom_user, shift, request.session.get('selected_machine_id'))
-        has_unsolved_reports = ReportsModel.objects.filter(
-            order__related_to_shift=shift, is_solved=False
-        ).exists()
-
-        context = {
-            'user': request.user,
-            'custom_user': custom_user,
-            'shift': shift,
-            'order': order,
-            'has_unsolved_reports': has_unsolved_reports
-        }
+        work_context = request.work_context
+        custom_user = work_context.custom_user
+        order = work_context.order
+        context = work_context.as_context()
         save_url(request, order)
 
         if request.method == 'POST':
@@ -271,242 +408,259 @@ def order_quantity_view(request):
                 set_on_hold(request, order)
 
                 # Логирование события приостановки работы и перехода к другому станку
-                logger.info(f"{datetime.datetime.now()} |INFO| User "
-                            f"{custom_user} paused Order {order.id}")
+                logger.info('order_paused', user=custom_user.id, order=order.id)
 
                 return redirect('shift_main_page')
 
             quantity = int(request.POST.get('quantity'))
-            add_quantity(order, quantity)
-            add_start_working_time(order)
+            add_quantity_and_start_working_time(order, quantity)
 
             # Логирование события добавления количества и начала работы над заказом
-            logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} added quantity '{quantity}' "
-                        f"and started working on the order {order.id}")
+            logger.info('quantity_submitted', user=custom_user.id, order=order.id, quantity=quantity)
 
             return redirect('shift_setup_page')
 
         return render(request, 'include/shift/quantity_page.html', context)
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in order_qauntity_view: {e}", exc_info=True)
+        logger.exception('order_qauntity_view_failed')
 
         return HttpResponse('Произошла ошибка')
 
 
 @login_required(login_url='/login/')
+@with_work_context
 def order_setup_view(request):
     try:
-        custom_user = CustomUserModel.objects.get(id=request.user.id)
-        shift = get_last_or_create_shift(custom_user)
-        order = get_order(custom_user, shift, request.session.get('selected_machine_id'))
-        has_unsolved_reports = ReportsModel.objects.filter(
-            order__related_to_shift=shift, is_solved=False
-        ).exists()
+        work_context = request.work_context
+        custom_user = work_context.custom_user
+        order = work_context.order
+        context = work_context.as_context()
         save_url(request, order)
-        context = {
-            'user': request.user,
-            'custom_user': custom_user,
-            'shift': shift,
-            'order': order,
-            'has_unsolved_reports': has_unsolved_reports
-        }
 
         if request.method == 'POST':
             if 'pause_shift' in request.POST:
                 set_on_hold(request, order)
 
                 # Логирование события приостановки работы и перехода к другому станку
-                logger.info(f"{datetime.datetime.now()} |INFO| User "
-                            f"{custom_user} paused Order {order.id}")
+                logger.info('order_paused', user=custom_user.id, order=order.id)
 
                 return redirect('shift_main_page')
 
             add_machine_start_time(order)
 
             # Логирование события добавления времени начала работы над заказом
-            logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user}"
-                        f" added machine start time for the order {order.id}.")
+            logger.info('setup_submitted', user=custom_user.id, order=order.id)
 
             return redirect('shift_processing_page')
 
         return render(request, 'include/shift/setup_page.html', context)
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in order_setup_view: {e}", exc_info=True)
+        logger.exception('order_setup_view_failed')
 
         return HttpResponse('Произошла ошибка')
 
 
 @login_required(login_url='/login/')
+@with_work_context
 def order_processing_view(request):
     try:
-        custom_user = CustomUserModel.objects.get(id=request.user.id)
-        shift = get_last_or_create_shift(custom_user)
-        order = get_order(custom_user, shift, request.session.get('selected_machine_id'))
-        has_unsolved_reports = ReportsModel.objects.filter(
-            order__related_to_shift=shift, is_solved=False
-        ).exists()
+        work_context = request.work_context
+        custom_user = work_context.custom_user
+        order = work_context.order
+        context = work_context.as_context()
         save_url(request, order)
-        context = {
-            'user': request.user,
-            'custom_user': custom_user,
-            'shift': shift,
-            'order': order,
-            'has_unsolved_reports': has_unsolved_reports
-        }
 
         if request.method == 'POST':
             if 'pause_shift' in request.POST:
                 set_on_hold(request, order)
 
                 # Логирование события приостановки работы и перехода к другому станку
-                logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} paused Order {order.id}")
+                logger.info('order_paused', user=custom_user.id, order=order.id)
 
                 return redirect('shift_main_page')
 
             add_machine_end_time(order)
 
             # Логирование события добавления времени окончания работы над заказом
-            logger.info(
-                f"{datetime.datetime.now()} |INFO| User {custom_user} added machine end time for the order {order.id}.")
+            logger.info('processing_submitted', user=custom_user.id, order=order.id)
 
             return redirect('shift_ending_page')
 
         return render(request, 'include/shift/processing_page.html', context)
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in order_processing_view: {e}",
-                     exc_info=True)
+        logger.exception('order_processing_view_failed')
 
         return HttpResponse('Произошла ошибка')
 
 
 @login_required(login_url='/login/')
+@with_work_context
 def order_ending_view(request):
     try:
-        custom_user = CustomUserModel.objects.get(id=request.user.id)
-        shift = get_last_or_create_shift(custom_user)
-        order = get_order(custom_user, shift, request.session.get('selected_machine_id'))
-        has_unsolved_reports = ReportsModel.objects.filter(
-            order__related_to_shift=shift, is_solved=False
-        ).exists()
+        work_context = request.work_context
+        custom_user = work_context.custom_user
+        order = work_context.order
+        context = work_context.as_context()
         save_url(request, order)
-        context = {
-            'user': request.user,
-            'custom_user': custom_user,
-            'shift': shift,
-            'order': order,
-            'has_unsolved_reports': has_unsolved_reports
-        }
 
         if request.method == 'POST':
             if 'pause_shift' in request.POST:
                 set_on_hold(request, order)
 
                 # Логирование события приостановки работы и перехода к другому станку
-                logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} paused Order {order.id}")
+                logger.info('order_paused', user=custom_user.id, order=order.id)
 
                 return redirect('shift_main_page')
-            add_end_working_time(order)
-            machine_free(order)
-            count_and_set_reports_duration(order)
+            end_order(order)
 
-            logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} ended work on Order {order.id}")
+            logger.info('ending_submitted', user=custom_user.id, order=order.id)
 
             return redirect('shift_main_page')
 
         return render(request, 'include/shift/ending_order_page.html', context)
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in order_ending_view: {e}", exc_info=True)
+        logger.exception('order_ending_view_failed')
 
         return HttpResponse('Произошла ошибка')
 
 
-@login_required(login_url='/login/')
-def report_send(request):
+@async_login_required(login_url='/login/')
+@with_work_context
+async def report_send(request):
     try:
-        custom_user = CustomUserModel.objects.get(id=request.user.id)
-        shift = get_last_or_create_shift(custom_user)
-        order = get_order(custom_user, shift, request.session.get('selected_machine_id'))
+        work_context = request.work_context
+        custom_user = work_context.custom_user
+        order = work_context.order
 
         if request.method == 'POST':
-            add_report(request, order, custom_user)
-            logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} sent a report for Order {order.id}")
+            await sync_to_async(add_report)(request, order, custom_user)
+            logger.info('report_sent', user=custom_user.id, order=order.id)
 
             return HttpResponse('Report sent successfully')
         else:
             # Логирование неправильного запроса
-            logger.warning(
-                f"{datetime.datetime.now()} |WARNING| User {custom_user} made a bad request to report_send view")
+            logger.warning('bad_request', user=custom_user.id)
             return HttpResponse('Bad request')
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in report_send: {e}", exc_info=True)
+        logger.exception('report_send_failed')
 
         return HttpResponse('An error occurred')
 
 
-@login_required(login_url='/login/')
-def reports_view(request):
+@async_login_required(login_url='/login/')
+async def reports_view(request):
     try:
-        custom_user = CustomUserModel.objects.get(id=request.user.id)
-        user_reports = ReportsModel.objects.filter(user=custom_user).order_by('-start_time').order_by('is_solved')
-        form = ReportEditForm()
-
-        context = {
-            'user_reports': user_reports,
-            'form': form,
-            'custom_user': custom_user
-        }
+        custom_user = await CustomUserModel.objects.select_related('user').aget(id=request.user.id)
 
         # POST to solve report and set is_broken False
         if request.method == 'POST':
             report_id = request.POST.get('bug_id')
-            report = get_object_or_404(ReportsModel, pk=report_id)
+            report = await ReportsModel.objects.select_related('order').filter(pk=report_id).afirst()
+            if report is None:
+                return HttpResponse('Report not found', status=404)
             form = ReportEditForm(request.POST, instance=report)
             if form.is_valid():
                 if form.cleaned_data['is_solved']:
                     report.end_time = timezone.now()
-                form.save()
-                machine_free(report.order, status='broken')
+                await report.asave()
+                await sync_to_async(machine_free)(report.order, status='broken')
 
-                logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} solved Report {report.id}")
+                logger.info('report_solved', user=custom_user.id, report=report.id)
 
                 return JsonResponse({'status': 'success'})
 
-        return render(request, 'include/reports_page.html', context)
+        user_reports = ReportsModel.objects.filter(user=custom_user).select_related('order').order_by('is_solved')
+        context = {
+            'user_reports': [report async for report in user_reports],
+            'form': ReportEditForm(),
+            'custom_user': custom_user
+        }
 
-    except Exception as e:
+        return await sync_to_async(render)(request, 'include/reports_page.html', context)
+
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in reports_view: {e}", exc_info=True)
+        logger.exception('reports_view_failed')
 
         return HttpResponse('An error occurred')
 
 
-@login_required(login_url='/login/')
-def request_send(request):
+@async_login_required(login_url='/login/')
+async def request_send(request):
     try:
-        custom_user = CustomUserModel.objects.get(id=request.user.id)
+        custom_user = await CustomUserModel.objects.select_related('user').aget(id=request.user.id)
 
         if request.method == 'POST':
-            add_request(request, custom_user)
-            logger.info(f"{datetime.datetime.now()} |INFO| User {custom_user} sent a request")
+            await sync_to_async(add_request)(request, custom_user)
+            logger.info('request_sent', user=custom_user.id)
             return HttpResponse('Request sent successfully')
         else:
             # Логирование неправильного запроса
-            logger.warning(
-                f"{datetime.datetime.now()} |WARNING| User {custom_user} made a bad request to request_send view")
+            logger.warning('bad_request', user=custom_user.id)
             return HttpResponse('Bad request')
 
-    except Exception as e:
+    except Exception:
         # Логирование исключения, если оно произошло
-        logger.error(f"{datetime.datetime.now()} |ERROR| An error occurred in request_send: {e}", exc_info=True)
+        logger.exception('request_send_failed')
 
         return HttpResponse('An error occurred')
+
+
+@login_required(login_url='/login/')
+def order_events(request):
+    """
+    Принимает пакет шагов работы над заказами, накопленный планшетом без связи.
+
+    Тело POST: {"events": [{"key", "order", "step", "client_ts", "payload"}, ...]}, события по порядку.
+    Ответ: {"results": [{"key", "status", "error"}, ...]} в том же порядке. События со статусами
+    applied и duplicate планшет может удалить из очереди.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Ожидается POST'}, status=405)
+    try:
+        events = json.loads(request.body)['events']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Ожидается JSON вида {"events": [...]}'}, status=400)
+    if not isinstance(events, list) or len(events) > settings.ORDER_EVENTS_MAX_BATCH:
+        return JsonResponse({'error': f'events - список не длиннее {settings.ORDER_EVENTS_MAX_BATCH}'}, status=400)
+
+    try:
+        custom_user = CustomUserModel.objects.get(id=request.user.id)
+        results = apply_order_events(custom_user, events)
+        return JsonResponse({'results': results})
+
+    except Exception:
+        logger.exception('order_events_failed')
+
+        return JsonResponse({'error': 'Произошла ошибка'}, status=500)
+
+
+def metrics(request):
+    """
+    Метрики в формате Prometheus: время запросов, SQL-запросы и время в БД по маршрутам,
+    время шагов работы и задач закрытия смены.
+
+    Доступны персоналу и адресам из METRICS_ALLOWED_NETWORKS. Снаружи nginx путь закрыт,
+    Prometheus опрашивает web:8000 напрямую.
+    """
+    if not (request.user.is_staff or _is_metrics_client(request.META.get('REMOTE_ADDR'))):
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _is_metrics_client(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in settings.METRICS_ALLOWED_NETWORKS)
@@ -0,0 +1,110 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db.models import Exists, OuterRef
+from django.utils.functional import cached_property
+
+from core.buisness import get_last_or_create_shift, find_current_order
+from core.models import CustomUserModel, OrdersModel, ReportsModel
+
+
+class WorkContext:
+    """
+    Пользователь, смена и заказ оператора, загружаемые один раз за запрос.
+
+    В обычном случае хватает двух точечных запросов: пользователь вместе с текущей сменой
+    и текущий заказ станка вместе с флагом нерешенных проблем по смене.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def _user_and_shift(self):
+        custom_user = CustomUserModel.objects.select_related('user', 'current_shift').get(id=self.request.user.id)
+        shift = custom_user.current_shift
+        if shift is None or shift.is_ended():
+            return custom_user, get_last_or_create_shift(custom_user)
+
+        shift.user = custom_user
+        return custom_user, shift
+
+    @property
+    def custom_user(self):
+        return self._user_and_shift[0]
+
+    @property
+    def shift(self):
+        return self._user_and_shift[1]
+
+    @cached_property
+    def selected_machine_id(self):
+        return self.request.session.get('selected_machine_id')
+
+    @cached_property
+    def order(self):
+        orders = OrdersModel.objects.filter(
+            user=self.custom_user,
+            related_to_shift=self.shift,
+            machine_id=self.selected_machine_id
+        ).annotate(
+            shift_has_unsolved_reports=Exists(ReportsModel.objects.filter(
+                order__related_to_shift=OuterRef('related_to_shift'), is_solved=False
+            ))
+        )
+        order = find_current_order(orders, self.selected_machine_id)
+        if order:
+            order.user = self.custom_user
+            order.related_to_shift = self.shift
+        return order
+
+    @cached_property
+    def has_unsolved_reports(self):
+        if self.order is not None:
+            return self.order.shift_has_unsolved_reports
+        return ReportsModel.objects.filter(
+            order__related_to_shift=self.shift, is_solved=False
+        ).exists()
+
+    async def aload(self):
+        """
+        Загружает пользователя, смену и заказ за один переход в поток - для async-представлений.
+        """
+        await sync_to_async(lambda: self.order)()
+
+    def as_context(self, **extra):
+        """
+        Базовый контекст шаблонов страниц смены.
+        """
+        context = {
+            'user': self.request.user,
+            'custom_user': self.custom_user,
+            'shift': self.shift,
+            'order': self.order,
+            'has_unsolved_reports': self.has_unsolved_reports,
+        }
+        context.update(extra)
+        return context
+
+
+def with_work_context(view):
+    """
+    Декоратор: кладет в request.work_context ленивый WorkContext текущего запроса.
+    Для async-представлений контекст загружается заранее через WorkContext.aload.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            request.work_context = WorkContext(request)
+            await request.work_context.aload()
+            return await view(request, *args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.work_context = WorkContext(request)
+        return view(request, *args, **kwargs)
+
+    return wrapper
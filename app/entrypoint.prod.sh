@@ -11,6 +11,14 @@ then
     echo "PostgreSQL started"
 fi
 
+# Файлы метрик прошлого запуска. У каждого сервиса свой каталог в общем томе,
+# файлы работающих воркеров celery не удаляются
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]
+then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 python manage.py makemigrations
 python manage.py migrate
 python manage.py collectstatic --no-input
@@ -11,6 +11,13 @@ then
     echo "PostgreSQL started"
 fi
 
+# Файлы метрик прошлого запуска этого сервиса, см. entrypoint.prod.sh
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]
+then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
 python manage.py flush --no-input
 python manage.py collectstatic --no-input
 python manage.py makemigrations
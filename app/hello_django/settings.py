@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -84,6 +85,13 @@ DATABASES = {
         "PASSWORD": os.environ.get("SQL_PASSWORD"),
         "HOST": os.environ.get("SQL_HOST"),
         "PORT": os.environ.get("SQL_PORT"),
+        # Сколько секунд держать соединение открытым между запросами и задачами, 0 - закрывать сразу.
+        # Под ASGI соединения между запросами не переиспользуются, веб-процессы ходят через pgbouncer
+        "CONN_MAX_AGE": int(os.environ.get("SQL_CONN_MAX_AGE", default=0)),
+        # Проверять переиспользуемое соединение перед первым запросом
+        "CONN_HEALTH_CHECKS": bool(int(os.environ.get("SQL_CONN_HEALTH_CHECKS", default=1))),
+        # pgbouncer в режиме transaction: серверные курсоры .iterator() не переживают смену соединения
+        "DISABLE_SERVER_SIDE_CURSORS": bool(int(os.environ.get("SQL_PGBOUNCER", default=0))),
     }
 }
 
@@ -135,4 +143,94 @@ MEDIA_ROOT = BASE_DIR / "mediafiles"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 CELERY_BROKER_URL = 'redis://redis:6379/0'
-CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
\ No newline at end of file
+CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
+CELERY_TASK_ROUTES = {
+    'core.tasks.decode_qr_image': {'queue': 'qr'},
+}
+
+# Закрытие смены в фоне через Celery вместо синхронного расчета в запросе
+SHIFT_CLOSE_ASYNC = bool(int(os.environ.get("SHIFT_CLOSE_ASYNC", default=0)))
+
+# Распознавание QR в отдельной очереди qr
+# Сколько секунд запрос ждет результат, прежде чем вернуть адрес для опроса
+QR_DECODE_WAIT = float(os.environ.get("QR_DECODE_WAIT", default=3))
+# Предельное время распознавания одного изображения, секунды
+QR_DECODE_TIMEOUT = int(os.environ.get("QR_DECODE_TIMEOUT", default=15))
+# Максимум ожидающих задач в очереди, дальше сервис отвечает 429
+QR_DECODE_MAX_PENDING = int(os.environ.get("QR_DECODE_MAX_PENDING", default=20))
+# Как часто async-представление проверяет готовность распознавания, секунды
+QR_DECODE_POLL_INTERVAL = float(os.environ.get("QR_DECODE_POLL_INTERVAL", default=0.1))
+
+# Распознавать QR в браузере, отправляя фото на сервер только при неудаче
+QR_CLIENT_DECODE = bool(int(os.environ.get("QR_CLIENT_DECODE", default=1)))
+
+# Кэш результатов распознавания QR по хэшу загруженного файла
+QR_CACHE_SIZE = int(os.environ.get("QR_CACHE_SIZE", default=1024))
+QR_CACHE_TTL = int(os.environ.get("QR_CACHE_TTL", default=3600))
+# Необязательный общий уровень кэша в Redis, например redis://redis:6379/2
+QR_CACHE_REDIS_URL = os.environ.get("QR_CACHE_REDIS_URL")
+
+# Выгрузка данных (backup)
+BACKUP_DIR = os.environ.get("BACKUP_DIR", default=BASE_DIR / "backups")
+# Количество строк, читаемых из БД за раз
+BACKUP_CHUNK_SIZE = int(os.environ.get("BACKUP_CHUNK_SIZE", default=2000))
+# Полный бэкап делается раз в столько запусков manage.py backup, остальные - инкрементальные
+BACKUP_FULL_EVERY = int(os.environ.get("BACKUP_FULL_EVERY", default=7))
+# Перекрытие инкрементальных бэкапов в секундах, не меньше самой долгой транзакции:
+# строка с updated_at до начала бэкапа может быть зафиксирована уже после чтения
+BACKUP_OVERLAP = int(os.environ.get("BACKUP_OVERLAP", default=300))
+
+# Табло станков: состояние станков в Redis, например redis://redis:6379/3.
+# Без адреса табло читает снимок из БД
+MACHINE_STATE_REDIS_URL = os.environ.get("MACHINE_STATE_REDIS_URL")
+# Интервал keep-alive в потоке событий, секунды
+MACHINE_BOARD_HEARTBEAT = int(os.environ.get("MACHINE_BOARD_HEARTBEAT", default=15))
+# Через сколько секунд поток закрывается и браузер переподключается
+MACHINE_BOARD_STREAM_TTL = int(os.environ.get("MACHINE_BOARD_STREAM_TTL", default=300))
+# Пауза перед переподключением браузера, миллисекунды
+MACHINE_BOARD_RETRY = int(os.environ.get("MACHINE_BOARD_RETRY", default=3000))
+
+# Сети, из которых /metrics доступен без входа персонала, через пробел.
+# Через nginx путь закрыт, иначе любой внешний запрос пришел бы с адреса nginx
+METRICS_ALLOWED_NETWORKS = os.environ.get(
+    "METRICS_ALLOWED_NETWORKS", default="127.0.0.0/8 ::1/128 10.0.0.0/8 172.16.0.0/12 192.168.0.0/16"
+).split()
+
+# Кэш и сессии в Redis. Для запуска без Redis: CACHE_BACKEND=django.core.cache.backends.locmem.LocMemCache
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", default="django.core.cache.backends.redis.RedisCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", default="redis://redis:6379/1"),
+    }
+}
+# Сессия читается из кэша, в БД пишется только при изменении
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+# Время жизни справочников в кэше, секунды. Изменения сбрасывают кэш сразу
+LOOKUP_CACHE_TTL = int(os.environ.get("LOOKUP_CACHE_TTL", default=3600))
+
+# Максимальное количество событий в одном пакете от планшета
+ORDER_EVENTS_MAX_BATCH = int(os.environ.get("ORDER_EVENTS_MAX_BATCH", default=500))
+
+# Логи пишутся JSON-строками в stderr фоновым потоком, см. core.log
+LOG_LEVEL = os.environ.get("LOG_LEVEL", default="INFO")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "background": {
+            "()": "core.log.BackgroundStreamHandler",
+        },
+    },
+    "loggers": {
+        "core": {
+            "handlers": ["background"],
+            "level": LOG_LEVEL,
+            "propagate": False,
+        },
+        "django": {
+            "handlers": ["background"],
+            "level": LOG_LEVEL,
+            "propagate": False,
+        },
+    },
+}